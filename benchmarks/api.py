@@ -0,0 +1,208 @@
+"""
+Latency and throughput of the API hot paths, driven through the ASGI app.
+
+Seeds the database (see `benchmarks.seed`), then runs every scenario with `--requests` requests
+issued by `--concurrency` concurrent clients and reports p50/p95/p99 latency and req/s.
+Results are written to `--output` as JSON. With `--baseline` (a previous output) the deltas are
+printed, and the exit code is 1 when a scenario p95 grew more than `--max-regression` percent.
+
+The default database is a temporary SQLite file, run in the SQLite mode (`--sqlite-default-pragmas`
+compares with the SQLite default pragmas). A local Postgres can be used with
+`--database-url postgresql+asyncpg://...`; its tables are dropped and recreated.
+
+Usage: python -m benchmarks.api --users 1000 --transactions 10000 --requests 500 --concurrency 10 \\
+    --output bench.json [--baseline baseline.json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+from sqlalchemy import select
+
+from benchmarks.seed import benchmark_settings, seed_database
+from main import create_app
+from src.database import Database
+from src.transactions.models import Transaction
+from src.users.enums import CurrencyEnum
+
+
+RequestFactory = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+SCENARIOS = ("create_user", "create_transaction", "rollback_transaction", "get_users", "get_transactions", "analysis")
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(round(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, make_request: RequestFactory, requests: int, concurrency: int
+) -> dict[str, Any]:
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counter = itertools.count()
+
+    async def worker() -> None:
+        while (index := next(counter)) < requests:
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, index)
+                status = str(response.status_code)
+            except Exception as exc:  # a failed request is reported, not fatal for the run
+                status = type(exc).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+        "req_per_sec": round(requests / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def scenario_factories(database: Database, users: int, requests: int, seed: int) -> dict[str, RequestFactory]:
+    rng = random.Random(seed)
+    currencies = list(CurrencyEnum)
+    run_id = os.urandom(4).hex()
+
+    async with database.session_maker() as session:
+        rows = (await session.execute(select(Transaction.id, Transaction.user_id).limit(requests))).all()
+    rollback_targets = [(row.id, row.user_id) for row in rows]
+
+    async def create_user(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await client.post("/users", json={"email": f"bench_{run_id}_{index}@bench.com"})
+
+    async def create_transaction(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        payload = {"amount": rng.randint(1, 1000), "currency": rng.choice(currencies).value}
+        return await client.post(f"/transactions/{rng.randint(1, users)}", json=payload)
+
+    async def rollback_transaction(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        transaction_id, user_id = rollback_targets[index % len(rollback_targets)]
+        return await client.patch(f"/transactions/{transaction_id}/user/{user_id}/rollback")
+
+    async def get_users(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await client.get("/users")
+
+    async def get_transactions(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await client.get("/transactions", params={"user_id": rng.randint(1, users)})
+
+    async def analysis(client: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await client.get("/transactions/analysis")
+
+    return {
+        "create_user": create_user,
+        "create_transaction": create_transaction,
+        "rollback_transaction": rollback_transaction,
+        "get_users": get_users,
+        "get_transactions": get_transactions,
+        "analysis": analysis,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], max_regression: Optional[float]) -> bool:
+    """Print the deltas against the baseline, returns False when a p95 regression exceeds `max_regression`."""
+    passed = True
+    print(f"\n{'scenario':<22} {'p95 base':>10} {'p95 now':>10} {'delta':>8} {'rps base':>10} {'rps now':>10}")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        delta = (current["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100 if previous["p95_ms"] else 0.0
+        regressed = max_regression is not None and delta > max_regression
+        passed = passed and not regressed
+        print(
+            f"{name:<22} {previous['p95_ms']:>10.2f} {current['p95_ms']:>10.2f} {delta:>+7.1f}%"
+            f" {previous['req_per_sec']:>10.1f} {current['req_per_sec']:>10.1f}{'  REGRESSION' if regressed else ''}"
+        )
+    return passed
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_api.db')}"
+    app = create_app(benchmark_settings(database_url, args.sqlite_default_pragmas, POOL_SIZE=max(args.concurrency, 5)))
+
+    results: dict[str, Any] = {
+        "meta": {
+            "database": database_url.split("://")[0],
+            "users": args.users,
+            "transactions": args.transactions,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "sqlite_default_pragmas": args.sqlite_default_pragmas,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "scenarios": {},
+    }
+    async with app.router.lifespan_context(app):
+        database: Database = app.state.database
+        await seed_database(database, args.users, args.transactions, args.seed)
+        factories = await scenario_factories(database, args.users, args.requests, args.seed)
+
+        transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                results["scenarios"][name] = await run_scenario(
+                    client, factories[name], args.requests, args.concurrency
+                )
+                scenario = results["scenarios"][name]
+                print(
+                    f"{name:<22} p50={scenario['p50_ms']:>9.2f}ms p95={scenario['p95_ms']:>9.2f}ms"
+                    f" p99={scenario['p99_ms']:>9.2f}ms {scenario['req_per_sec']:>9.1f} req/s"
+                    f" errors={scenario['errors']}"
+                )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--sqlite-default-pragmas", action="store_true", help="SQLite defaults instead of the tuned SQLite mode pragmas"
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="previous output to compare with")
+    parser.add_argument("--max-regression", type=float, help="allowed p95 growth in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
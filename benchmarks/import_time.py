@@ -0,0 +1,54 @@
+"""
+Import time of the app entrypoint and model modules.
+
+Every module is imported in a fresh interpreter with `-X importtime`, the cumulative import
+time reported for the module is collected and the median over `--repeat` runs is printed.
+No database settings are needed: importing must not read settings nor create engines.
+
+Usage: python -m benchmarks.import_time --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+MODULES = [
+    "main",
+    "src.users.models",
+    "src.transactions.models",
+    "src.analytics.models",
+]
+
+
+def import_time_us(module: str) -> int:
+    env = {key: value for key, value in os.environ.items() if not key.startswith(("POSTGRES_", "DB__"))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    # lines look like: "import time:  self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.removeprefix("import time:").split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise RuntimeError(f"Import time of {module} not found")
+
+
+def main(repeat: int) -> None:
+    print(f"repeat={repeat} (median cumulative import time)")
+    for module in MODULES:
+        timings = [import_time_us(module) for _ in range(repeat)]
+        print(f"  {module:<28} {statistics.median(timings) / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.repeat)
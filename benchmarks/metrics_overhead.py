@@ -0,0 +1,104 @@
+"""
+Cost of metrics recording compared to the `POST /transactions/{user_id}` request it is recorded for.
+
+Measures per call cost of the recording primitives on a private registry, then the median latency of
+`POST /transactions/{user_id}` served by the ASGI app over a temporary SQLite database. One request records
+a request counter and latency histogram, a transaction outcome and a pool wait observation per checkout,
+so the reported share is the overhead added to the hot path.
+
+Usage: python -m benchmarks.metrics_overhead --calls 1000000 --requests 500
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import timeit
+from typing import Callable
+
+from httpx import AsyncClient
+
+from main import create_app
+from src.config import DatabaseSettings, Settigns
+from src.database import Base, Database
+from src.monitoring.metrics import MetricsRegistry, count_outcomes
+from src.users.enums import CurrencyEnum
+
+
+def recording_cost_ns(calls: int) -> dict[str, float]:
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Benchmark counter", ("method", "route", "status"))
+    histogram = registry.histogram("bench_seconds", "Benchmark histogram", ("method", "route"))
+
+    @count_outcomes(counter, "create")
+    async def operation() -> None:
+        return None
+
+    def run_operation() -> None:
+        coroutine = operation()
+        try:
+            coroutine.send(None)
+        except StopIteration:
+            pass
+
+    async def plain_operation() -> None:
+        return None
+
+    def run_plain_operation() -> None:
+        coroutine = plain_operation()
+        try:
+            coroutine.send(None)
+        except StopIteration:
+            pass
+
+    def per_call(statement: Callable[[], object]) -> float:
+        return min(timeit.repeat(statement, number=calls, repeat=3)) / calls * 1e9
+
+    return {
+        "counter_inc_ns": per_call(lambda: counter.inc("POST", "/transactions/{user_id}", "200")),
+        "histogram_observe_ns": per_call(lambda: histogram.observe(0.0042, "POST", "/transactions/{user_id}")),
+        "count_outcomes_ns": per_call(run_operation) - per_call(run_plain_operation),
+    }
+
+
+async def request_latency_ms(requests: int) -> float:
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_metrics.db")
+    app = create_app(Settigns(DB=DatabaseSettings(URL=f"sqlite+aiosqlite:///{db_path}")))
+
+    async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://bench") as client:
+        database: Database = app.state.database
+        async with database.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        user_id = (await client.post("/users", json={"email": "bench@metrics.com"})).json()["id"]
+
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.post(f"/transactions/{user_id}", json={"amount": 1.0, "currency": CurrencyEnum.USD})
+            timings.append(time.perf_counter() - started)
+            response.raise_for_status()
+    return statistics.median(timings) * 1000
+
+
+def main(calls: int, requests: int) -> None:
+    costs = recording_cost_ns(calls)
+    latency_ms = asyncio.run(request_latency_ms(requests))
+    # counter + histogram in the middleware, one outcome counter and ~2 pool checkouts per request
+    per_request_ns = costs["counter_inc_ns"] + 3 * costs["histogram_observe_ns"] + costs["count_outcomes_ns"]
+
+    print(f"calls={calls} requests={requests}")
+    for name, value in costs.items():
+        print(f"  {name:<28} {value:10.1f}")
+    print(f"  {'post_transaction_ms':<28} {latency_ms:10.3f}")
+    print(f"  {'recording_per_request_ns':<28} {per_request_ns:10.1f}")
+    print(f"  {'overhead_percent':<28} {per_request_ns / (latency_ms * 1e6) * 100:10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+    main(args.calls, args.requests)
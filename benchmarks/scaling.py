@@ -0,0 +1,176 @@
+"""
+Throughput of `python -m src.server` from one to `--max-workers` worker processes.
+
+For every worker count (powers of two up to `--max-workers`, and `--max-workers` itself) the database is
+seeded again (see `benchmarks.seed`), the server is started as a subprocess on a free port and the scenarios
+of `benchmarks.api` are run over HTTP with `--requests` requests issued by `--concurrency` concurrent clients.
+Reports req/s and p95 latency per worker count with the speedup over one worker. Results are written
+to `--output` as JSON. The server runs with `SERVER__ALLOW_PER_WORKER_STATE`, limits are per worker.
+
+The load is generated by this single process: once it saturates a core, the throughput stops growing with
+the workers because of the client, compare with its CPU usage. The default database is a temporary SQLite file
+shared by the workers, their writes serialize on the database lock. A local Postgres can be used with
+`--database-url postgresql+asyncpg://...`; its tables are dropped and recreated.
+
+Usage: python -m benchmarks.scaling --max-workers 4 --requests 2000 --concurrency 32 --output scaling.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+import httpx
+
+from benchmarks.api import SCENARIOS, run_scenario, scenario_factories
+from benchmarks.seed import benchmark_settings, seed_database
+from src.database import Database
+
+
+DEFAULT_SCENARIOS = ("create_transaction", "get_transactions", "get_users")
+STARTUP_TIMEOUT_SECONDS = 30
+
+
+def worker_counts(max_workers: int) -> list[int]:
+    counts = []
+    workers = 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    return counts + [max_workers]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+    return port
+
+
+def server_env(database_url: str, workers: int, port: int) -> dict[str, str]:
+    """The settings of `benchmark_settings` as env variables, without access logs."""
+    return {
+        **os.environ,
+        "DB__URL": database_url,
+        "SERVER__HOST": "127.0.0.1",
+        "SERVER__PORT": str(port),
+        "SERVER__WORKERS": str(workers),
+        "SERVER__ALLOW_PER_WORKER_STATE": "true",
+        "SERVER__ACCESS_LOG": "false",
+        "MONITORING__SLOW_REQUEST_MS": "-1",
+        "RATE_LIMIT__USER_RATE": "1e9",
+        "RATE_LIMIT__USER_BURST": str(10**9),
+        "RATE_LIMIT__CLIENT_RATE": "1e9",
+        "RATE_LIMIT__CLIENT_BURST": str(10**9),
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, server: asyncio.subprocess.Process) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.returncode is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if (await client.get("/monitoring/pool")).status_code == httpx.codes.OK:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server not ready in {STARTUP_TIMEOUT_SECONDS}s")
+
+
+async def run_workers(args: argparse.Namespace, database_url: str, workers: int) -> dict[str, Any]:
+    database = Database(benchmark_settings(database_url))
+    try:
+        await seed_database(database, args.users, args.transactions, args.seed)
+        factories = await scenario_factories(database, args.users, args.requests, args.seed)
+    finally:
+        await database.dispose()
+
+    port = free_port()
+    server = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "src.server",
+        env=server_env(database_url, workers, port),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            limits=httpx.Limits(max_connections=args.concurrency),
+            timeout=30,
+        ) as client:
+            await wait_ready(client, server)
+            # lets the workers that are still starting join before the measured runs
+            await run_scenario(client, factories["get_transactions"], args.concurrency * 4, args.concurrency)
+            for name in args.scenarios:
+                results[name] = await run_scenario(client, factories[name], args.requests, args.concurrency)
+    finally:
+        server.terminate()
+        try:
+            await asyncio.wait_for(server.wait(), timeout=30)
+        except TimeoutError:
+            server.kill()
+            await server.wait()
+    return results
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_scaling.db')}"
+    results: dict[str, Any] = {
+        "meta": {
+            "database": database_url.split("://")[0],
+            "users": args.users,
+            "transactions": args.transactions,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "workers": {},
+    }
+    for workers in worker_counts(args.max_workers):
+        results["workers"][str(workers)] = await run_workers(args, database_url, workers)
+
+    single = results["workers"]["1"]
+    print(f"{'scenario':<22} {'workers':>7} {'req/s':>10} {'p95 ms':>10} {'speedup':>8} {'errors':>7}")
+    for name in args.scenarios:
+        for workers, scenarios in results["workers"].items():
+            scenario = scenarios[name]
+            speedup = scenario["req_per_sec"] / single[name]["req_per_sec"] if single[name]["req_per_sec"] else 0.0
+            print(
+                f"{name:<22} {workers:>7} {scenario['req_per_sec']:>10.1f} {scenario['p95_ms']:>10.2f}"
+                f" {speedup:>7.2f}x {scenario['errors']:>7}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario and worker count")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(DEFAULT_SCENARIOS))
+    parser.add_argument("--output", default="scaling.json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
@@ -0,0 +1,133 @@
+"""
+Seed a benchmark database with users, balances and transactions.
+
+Every user gets a balance in every currency, transactions are spread over the users, currencies
+and the last year, and balances equal the sum of the user transactions. The data is generated
+from `--seed`, so runs with the same arguments work on the same data.
+
+Usage: python -m benchmarks.seed --database-url sqlite+aiosqlite:///bench.db --users 1000 --transactions 10000
+"""
+
+import argparse
+import asyncio
+import random
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy import insert, text
+
+from src.analytics.services.analytics import EXCHANGE_RATES_TO_USD
+from src.config import DatabaseSettings, MonitoringSettings, RateLimitSettings, Settigns, SqliteSettings
+from src.database import Base, Database
+from src.transactions.enums import TransactionStatusEnum
+from src.transactions.models import Transaction
+from src.users.enums import CurrencyEnum, UserStatusEnum
+from src.users.models import User, UserBalance, UserPortfolio
+from src.users.services.portfolio import PortfolioService
+from src.utils.utils import utc_now
+
+
+CHUNK_SIZE = 5000
+
+
+# SQLite defaults, to compare the tuned pragmas of the SQLite mode against (`--sqlite-default-pragmas`)
+DEFAULT_SQLITE_PRAGMAS = SqliteSettings(JOURNAL_MODE="DELETE", SYNCHRONOUS="FULL", CACHE_SIZE=-2000, MMAP_SIZE=0)
+
+
+def benchmark_settings(database_url: str, default_pragmas: bool = False, **database_options: Any) -> Settigns:
+    """
+    App settings for benchmarks: the given database and no slow request logging. Rate limits are checked
+    but never exceeded, so their cost is measured without rejecting benchmark requests. SQLite databases
+    run in the SQLite mode, with its tuned pragmas unless `default_pragmas`.
+    """
+    if default_pragmas:
+        database_options["SQLITE"] = DEFAULT_SQLITE_PRAGMAS
+    return Settigns(
+        DB=DatabaseSettings(URL=database_url, **database_options),
+        MONITORING=MonitoringSettings(SLOW_REQUEST_MS=-1),
+        RATE_LIMIT=RateLimitSettings(USER_RATE=1e9, USER_BURST=10**9, CLIENT_RATE=1e9, CLIENT_BURST=10**9),
+    )
+
+
+async def seed_database(database: Database, users: int, transactions: int, seed: int = 0) -> None:
+    """Recreate all tables of the database and fill them. Existing data is dropped."""
+    rng = random.Random(seed)
+    now = utc_now()
+    currencies = list(CurrencyEnum)
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    balances: dict[tuple[int, str], Decimal] = defaultdict(Decimal)
+    transaction_rows = []
+    for _ in range(transactions):
+        user_id = rng.randint(1, users)
+        currency = rng.choice(currencies).value
+        amount = Decimal(rng.randint(100, 100_000)) / 100
+        balances[user_id, currency] += amount
+        transaction_rows.append(
+            {
+                "user_id": user_id,
+                "currency": currency,
+                "amount": amount,
+                "status": TransactionStatusEnum.PROCESSED,
+                "created": now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+            }
+        )
+    transaction_rows.sort(key=lambda row: row["created"])
+
+    user_rows = [
+        {"id": user_id, "email": f"user{user_id}@bench.com", "status": UserStatusEnum.ACTIVE, "created": now}
+        for user_id in range(1, users + 1)
+    ]
+    balance_rows = [
+        {
+            "user_id": user_id,
+            "currency": currency.value,
+            "amount": balances[user_id, currency.value],
+            "created": now,
+        }
+        for user_id in range(1, users + 1)
+        for currency in currencies
+    ]
+    portfolio_rows = [{"user_id": user_id, "total_usd": 0, "updated": now} for user_id in range(1, users + 1)]
+
+    async with database.session_maker() as session:
+        async with session.begin():
+            for model, rows in (
+                (User, user_rows),
+                (UserBalance, balance_rows),
+                (UserPortfolio, portfolio_rows),
+                (Transaction, transaction_rows),
+            ):
+                for start in range(0, len(rows), CHUNK_SIZE):
+                    await session.execute(insert(model), rows[start : start + CHUNK_SIZE])
+            if database.engine.dialect.name == "postgresql":
+                # users were inserted with explicit ids
+                await session.execute(
+                    text("""SELECT setval(pg_get_serial_sequence('"user"', 'id'), (SELECT max(id) FROM "user"))""")
+                )
+        # refreshes every portfolio from the seeded balances
+        await PortfolioService().set_exchange_rates(session, EXCHANGE_RATES_TO_USD)
+
+
+async def main(database_url: str, users: int, transactions: int, seed: int) -> None:
+    database = Database(benchmark_settings(database_url))
+    try:
+        await seed_database(database, users, transactions, seed)
+    finally:
+        await database.dispose()
+    print(f"seeded users={users} transactions={transactions}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="the database is recreated")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.users, args.transactions, args.seed))
@@ -0,0 +1,155 @@
+"""
+Response time of list endpoints with validated vs trusted serialization.
+
+Seeds a temporary SQLite database with `--rows` users (with balances in every currency)
+and `--rows` transactions, then compares:
+
+- `validated`: ORM objects -> `model_validate` -> FastAPI `response_model` validation -> JSON
+  (the path used before `TrustedJSONResponse`);
+- `trusted`: row tuples -> `model_construct` -> `TrustedJSONResponse`.
+
+Usage: python -m benchmarks.serialization --rows 10000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable
+
+from fastapi.encoders import jsonable_encoder
+from httpx import AsyncClient
+from pydantic import TypeAdapter
+from sqlalchemy import desc, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from main import create_app
+from src.config import DatabaseSettings, Settigns
+from src.database import Base, Database
+from src.transactions.enums import TransactionStatusEnum
+from src.transactions.models import Transaction
+from src.transactions.schemas import TransactionModel
+from src.transactions.services.transactions import TransactionsService
+from src.users.enums import CurrencyEnum, UserStatusEnum
+from src.users.models import User, UserBalance
+from src.users.schemas import ResponseUserBalanceModel, ResponseUserModel
+from src.users.services.users import UsersService
+from src.utils.responses import TrustedJSONResponse
+from src.utils.utils import utc_now
+
+
+async def seed(session_maker: async_sessionmaker[AsyncSession], rows: int) -> None:
+    now = utc_now()
+    async with session_maker() as session, session.begin():
+        await session.execute(
+            insert(User),
+            [
+                {"id": i, "email": f"user{i}@bench.com", "status": UserStatusEnum.ACTIVE, "created": now}
+                for i in range(1, rows + 1)
+            ],
+        )
+        await session.execute(
+            insert(UserBalance),
+            [
+                {"user_id": i, "currency": currency.value, "amount": Decimal("10.50"), "created": now}
+                for i in range(1, rows + 1)
+                for currency in CurrencyEnum
+            ],
+        )
+        await session.execute(
+            insert(Transaction),
+            [
+                {
+                    "user_id": i,
+                    "currency": CurrencyEnum.USD.value,
+                    "amount": Decimal("10.50"),
+                    "status": TransactionStatusEnum.PROCESSED,
+                    "created": now,
+                }
+                for i in range(1, rows + 1)
+            ],
+        )
+
+
+async def validated_users(session: AsyncSession) -> bytes:
+    result = await session.execute(select(User).options(selectinload(User.user_balance)))
+    users = [
+        ResponseUserModel(
+            id=user.id,
+            email=user.email,
+            status=UserStatusEnum(user.status),
+            created=user.created,
+            balances=[ResponseUserBalanceModel.model_validate(balance) for balance in user.user_balance],
+        )
+        for user in result.scalars().all()
+    ]
+    validated = TypeAdapter(list[ResponseUserModel]).validate_python(users, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+async def trusted_users(session: AsyncSession) -> bytes:
+    return TrustedJSONResponse(await UsersService().get_users_with_relations(session)).body
+
+
+async def validated_transactions(session: AsyncSession, rows: int) -> bytes:
+    result = await session.execute(select(Transaction).order_by(desc(Transaction.created)).limit(rows))
+    transactions = [TransactionModel.model_validate(transaction) for transaction in result.scalars().all()]
+    validated = TypeAdapter(list[TransactionModel]).validate_python(transactions, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+async def trusted_transactions(session: AsyncSession, rows: int, settings: Settigns) -> bytes:
+    transactions = await TransactionsService(settings).get_user_transactions(session, limit=rows)
+    return TrustedJSONResponse(transactions).body
+
+
+async def measure(fn: Callable[[], Awaitable[Any]], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def main(rows: int, repeat: int) -> None:
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_serialization.db")
+    app = create_app(Settigns(DB=DatabaseSettings(URL=f"sqlite+aiosqlite:///{db_path}")))
+
+    async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://bench") as client:
+        database: Database = app.state.database
+        session_maker = database.session_maker
+        async with database.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await seed(session_maker, rows)
+
+        async def session_call(fn: Callable[..., Awaitable[bytes]], *args: Any) -> bytes:
+            async with session_maker() as session:
+                return await fn(session, *args)
+
+        results = {
+            "users_validated_ms": await measure(lambda: session_call(validated_users), repeat),
+            "users_trusted_ms": await measure(lambda: session_call(trusted_users), repeat),
+            "users_endpoint_ms": await measure(lambda: client.get("/users"), repeat),
+            "transactions_validated_ms": await measure(lambda: session_call(validated_transactions, rows), repeat),
+            "transactions_trusted_ms": await measure(
+                lambda: session_call(trusted_transactions, rows, database.settings), repeat
+            ),
+        }
+
+    print(f"rows={rows} repeat={repeat} (median)")
+    for name, value in results.items():
+        print(f"  {name:<28} {value:10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
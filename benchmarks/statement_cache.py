@@ -0,0 +1,151 @@
+"""
+Python overhead of the hot service statements built on every call compared to the prebuilt ones.
+
+`built` statements are constructed per call the way the services did before, `prebuilt` ones are the module
+level statements with bound parameters they use now. Measures per call cost of preparing each statement
+(construction and cache key), then the median execution time of each through a session on a temporary SQLite
+database, and the compiled cache results counted meanwhile. Both variants hit the compiled cache, a built
+statement still pays for its construction and cache key on every call. A transaction creation runs the user
+and balance lock statements, a rollback the user and rollback statements.
+
+Usage: python -m benchmarks.statement_cache --calls 20000 --executions 2000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from typing import Any, Callable
+
+from httpx import AsyncClient
+from sqlalchemy import Executable, select
+
+from main import create_app
+from src.config import DatabaseSettings, Settigns
+from src.database import Base, Database
+from src.monitoring.metrics import SQL_COMPILE_CACHE
+from src.transactions.models import Transaction
+from src.transactions.services.transactions import BALANCE_LOCK_QUERY, ROLLBACK_QUERY
+from src.users.enums import CurrencyEnum
+from src.users.models import User, UserBalance
+from src.users.services.users import ACTIVE_USER_QUERY
+
+
+CACHE_RESULTS = ("hit", "miss", "no_key", "disabled")
+# bound to the statements whose cost is measured without a database
+CREATED = datetime(2024, 1, 1)
+
+
+# (statement built per call from the user id, transaction id and creation time, prebuilt statement, its parameters)
+HotStatement = tuple[
+    Callable[[int, int, datetime], Executable], Executable, Callable[[int, int, datetime], dict[str, Any]]
+]
+
+HOT_STATEMENTS: dict[str, HotStatement] = {
+    "active_user": (
+        lambda user_id, transaction_id, created: select(User).where(User.id == user_id),
+        ACTIVE_USER_QUERY,
+        lambda user_id, transaction_id, created: {"user_id": user_id},
+    ),
+    "balance_lock": (
+        lambda user_id, transaction_id, created: (
+            select(UserBalance)
+            .where(UserBalance.user_id == user_id, UserBalance.currency == CurrencyEnum.USD)
+            .with_for_update()
+        ),
+        BALANCE_LOCK_QUERY,
+        lambda user_id, transaction_id, created: {"user_id": user_id, "currency": CurrencyEnum.USD},
+    ),
+    "rollback": (
+        lambda user_id, transaction_id, created: (
+            select(Transaction, UserBalance)
+            .join(UserBalance, (UserBalance.user_id == user_id) & (UserBalance.currency == Transaction.currency))
+            .where(
+                (Transaction.user_id == user_id) & (Transaction.id == transaction_id) & (Transaction.created == created)
+            )
+            .with_for_update(of=(Transaction, UserBalance))
+        ),
+        ROLLBACK_QUERY,
+        lambda user_id, transaction_id, created: {
+            "user_id": user_id,
+            "transaction_id": transaction_id,
+            "created": created,
+        },
+    ),
+}
+
+
+def preparation_cost_us(calls: int) -> dict[str, float]:
+    def per_call(statement: Callable[[], object]) -> float:
+        return min(timeit.repeat(statement, number=calls, repeat=3)) / calls * 1e6
+
+    costs = {}
+    for name, (build, prebuilt, params) in HOT_STATEMENTS.items():
+        costs[f"{name}_built_prepare_us"] = per_call(lambda: build(1, 1, CREATED)._generate_cache_key())  # noqa: B023
+        costs[f"{name}_prebuilt_prepare_us"] = per_call(
+            lambda: (params(1, 1, CREATED), prebuilt._generate_cache_key())  # noqa: B023
+        )
+    return costs
+
+
+async def execution_time_us(executions: int) -> tuple[dict[str, float], dict[str, float]]:
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_statements.db")
+    app = create_app(Settigns(DB=DatabaseSettings(URL=f"sqlite+aiosqlite:///{db_path}")))
+
+    timings: dict[str, float] = {}
+    async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://bench") as client:
+        database: Database = app.state.database
+        async with database.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        user_id = (await client.post("/users", json={"email": "bench@statements.com"})).json()["id"]
+        response = await client.post(f"/transactions/{user_id}", json={"amount": 1.0, "currency": CurrencyEnum.USD})
+        transaction_id = response.json()["id"]
+        created = datetime.fromisoformat(response.json()["created"])
+
+        before = {result: SQL_COMPILE_CACHE.value(result) for result in CACHE_RESULTS}
+        async with database.session_maker() as session:
+            for name, (build, prebuilt, params) in HOT_STATEMENTS.items():
+                for variant in ("built", "prebuilt"):
+                    samples = []
+                    for _ in range(executions):
+                        started = time.perf_counter()
+                        if variant == "built":
+                            result = await session.execute(build(user_id, transaction_id, created))
+                        else:
+                            result = await session.execute(prebuilt, params(user_id, transaction_id, created))
+                        result.all()
+                        samples.append(time.perf_counter() - started)
+                        # identity map lookups are the same for both variants, keep them out of the timings
+                        session.expunge_all()
+                    timings[f"{name}_{variant}_execute_us"] = statistics.median(samples) * 1e6
+            await session.rollback()
+        cache = {result: SQL_COMPILE_CACHE.value(result) - before[result] for result in CACHE_RESULTS}
+    return timings, cache
+
+
+def main(calls: int, executions: int) -> None:
+    costs = preparation_cost_us(calls)
+    timings, cache = asyncio.run(execution_time_us(executions))
+
+    print(f"calls={calls} executions={executions}")
+    for name, value in {**costs, **timings}.items():
+        print(f"  {name:<32} {value:10.2f}")
+    for result, count in cache.items():
+        print(f"  {f'cache_{result}':<32} {count:10.0f}")
+    executed = sum(cache.values())
+    print(f"  {'cache_hit_ratio':<32} {cache['hit'] / executed if executed else 0:10.4f}")
+    for request, names in (("create", ("active_user", "balance_lock")), ("rollback", ("active_user", "rollback"))):
+        saved = sum(timings[f"{name}_built_execute_us"] - timings[f"{name}_prebuilt_execute_us"] for name in names)
+        print(f"  {f'{request}_saved_per_request_us':<32} {saved:10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--executions", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.calls, args.executions)
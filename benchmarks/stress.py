@@ -0,0 +1,253 @@
+"""
+Concurrent deposits, withdrawals and rollbacks on a few hot accounts, followed by invariant checks.
+
+Seeds `--accounts` users (every balance starts from seeded deposits), then `--concurrency` clients
+fire `--operations` requests through the ASGI app: deposits, withdrawals (some exceed the balance)
+and rollbacks of random earlier transactions (repeats included, so double rollbacks are attempted).
+
+Reports throughput, request latency and the latency of the balance locking statements
+(`SELECT ... FOR UPDATE`; SQLite has no row locks, there the `UPDATE user_balance` statements wait
+for the database write lock instead). Then verifies:
+
+- every balance equals the sum of its not rolled back transactions;
+- no balance is negative;
+- no transaction was rolled back twice;
+- balance snapshots replay to the live balances.
+
+Exits with 1 when an invariant is violated.
+
+In the `ledger` balance mode (`--balance-mode ledger`) deposits lock nothing, balances are checked
+as their checkpointed amount plus the pending ledger entries.
+
+Usage: python -m benchmarks.stress --accounts 5 --operations 5000 --concurrency 50 [--database-url ...]
+    [--balance-mode ledger]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from decimal import Decimal
+from typing import Any
+
+import httpx
+from sqlalchemy import event, func, select
+
+from benchmarks.api import percentile
+from benchmarks.seed import benchmark_settings, seed_database
+from main import create_app
+from src.database import Database
+from src.transactions.enums import TransactionStatusEnum
+from src.transactions.models import Transaction
+from src.users.enums import CurrencyEnum
+from src.users.models import UserBalance
+from src.users.services.balance_snapshots import AMOUNT_PRECISION, BalanceSnapshotService
+from src.users.services.balances import balance_amount
+
+
+class LockLatency:
+    """Durations of the statements that wait for balance locks."""
+
+    def __init__(self) -> None:
+        self.lock_statements: list[float] = []
+        self.balance_updates: list[float] = []
+
+    def listen(self, database: Database) -> None:
+        engine = database.engine.sync_engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+            conn.info.setdefault("stress_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+            duration = time.perf_counter() - conn.info["stress_started"].pop()
+            if "FOR UPDATE" in statement:
+                self.lock_statements.append(duration)
+            elif statement.startswith("UPDATE user_balance"):
+                self.balance_updates.append(duration)
+
+        @event.listens_for(engine, "handle_error")
+        def error(context: Any) -> None:
+            if context.connection is not None and context.connection.info.get("stress_started"):
+                context.connection.info["stress_started"].pop()
+
+    @staticmethod
+    def summary(durations: list[float]) -> dict[str, Any]:
+        durations = sorted(durations)
+        return {
+            "count": len(durations),
+            "p50_ms": round(percentile(durations, 50) * 1000, 3),
+            "p95_ms": round(percentile(durations, 95) * 1000, 3),
+            "p99_ms": round(percentile(durations, 99) * 1000, 3),
+            "max_ms": round(durations[-1] * 1000, 3) if durations else 0.0,
+        }
+
+
+async def fire(
+    client: httpx.AsyncClient,
+    accounts: int,
+    operations: int,
+    concurrency: int,
+    currencies: list[CurrencyEnum],
+    seed: int,
+) -> dict[str, Any]:
+    rng = random.Random(seed)
+    counter = itertools.count()
+    # transactions created by the run, rollback targets
+    created: list[tuple[int, int]] = []
+    rolled_back: Counter[int] = Counter()
+    outcomes: Counter[str] = Counter()
+    latencies: list[float] = []
+
+    async def operation() -> str:
+        user_id = rng.randint(1, accounts)
+        currency = rng.choice(currencies).value
+        kind = rng.choices(("deposit", "withdrawal", "rollback"), weights=(4, 4, 2))[0]
+        if kind == "rollback" and created:
+            transaction_id, owner_id = rng.choice(created)
+            response = await client.patch(f"/transactions/{transaction_id}/user/{owner_id}/rollback")
+            if response.status_code == httpx.codes.OK:
+                rolled_back[transaction_id] += 1
+            return f"rollback {response.status_code}"
+
+        kind = "withdrawal" if kind == "withdrawal" else "deposit"
+        amount = rng.randint(1, 500) * (-1 if kind == "withdrawal" else 1)
+        response = await client.post(f"/transactions/{user_id}", json={"amount": amount, "currency": currency})
+        if response.status_code == httpx.codes.OK:
+            created.append((response.json()["id"], user_id))
+        return f"{kind} {response.status_code}"
+
+    async def worker() -> None:
+        while next(counter) < operations:
+            started = time.perf_counter()
+            try:
+                outcome = await operation()
+            except Exception as exc:  # reported, the invariants are checked anyway
+                outcome = f"error {type(exc).__name__}"
+            latencies.append(time.perf_counter() - started)
+            outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "operations_per_sec": round(operations / elapsed, 2),
+        "outcomes": dict(sorted(outcomes.items())),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "rolled_back": rolled_back,
+    }
+
+
+async def check_invariants(database: Database, rolled_back: Counter[int]) -> list[str]:
+    violations = []
+    async with database.session_maker() as session:
+        not_rolled_back = Transaction.status != TransactionStatusEnum.ROLL_BACKED
+        expected = (
+            select(
+                Transaction.user_id,
+                Transaction.currency,
+                func.coalesce(func.sum(Transaction.amount).filter(not_rolled_back), 0).label("amount"),
+            )
+            .group_by(Transaction.user_id, Transaction.currency)
+            .subquery()
+        )
+        rows = await session.execute(
+            select(UserBalance.user_id, UserBalance.currency, balance_amount(), expected.c.amount).outerjoin(
+                expected,
+                (expected.c.user_id == UserBalance.user_id) & (expected.c.currency == UserBalance.currency),
+            )
+        )
+        for user_id, currency, amount, expected_amount in rows:
+            if Decimal(str(amount)).quantize(AMOUNT_PRECISION) != Decimal(str(expected_amount or 0)).quantize(
+                AMOUNT_PRECISION
+            ):
+                violations.append(f"balance {user_id}/{currency} is {amount}, transactions sum to {expected_amount}")
+            if amount < 0:
+                violations.append(f"balance {user_id}/{currency} is negative: {amount}")
+
+        for transaction_id, count in rolled_back.items():
+            if count > 1:
+                violations.append(f"transaction {transaction_id} was rolled back {count} times")
+        rolled_back_in_db = await session.scalar(
+            select(func.count()).where(
+                Transaction.id.in_(list(rolled_back)), Transaction.status == TransactionStatusEnum.ROLL_BACKED
+            )
+        )
+        if rolled_back and rolled_back_in_db != len(rolled_back):
+            violations.append(f"{len(rolled_back)} rollbacks succeeded, {rolled_back_in_db} are stored")
+
+    async with database.session_maker() as session:
+        snapshot_service = BalanceSnapshotService(database.settings.BALANCE_SNAPSHOT_INTERVAL)
+        for mismatch in await snapshot_service.check_consistency(session):
+            violations.append(f"snapshot replay mismatch: {mismatch.model_dump()}")
+    return violations
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_stress.db')}"
+    # snapshots are written often, so their replay is checked under contention too
+    settings = benchmark_settings(database_url, args.sqlite_default_pragmas, POOL_SIZE=args.concurrency).model_copy(
+        update={"BALANCE_SNAPSHOT_INTERVAL": 10, "BALANCE_MODE": args.balance_mode}
+    )
+    app = create_app(settings)
+    currencies = list(CurrencyEnum)[: args.currencies]
+
+    async with app.router.lifespan_context(app):
+        database: Database = app.state.database
+        await seed_database(database, args.accounts, args.accounts * len(CurrencyEnum) * 20, args.seed)
+        lock_latency = LockLatency()
+        lock_latency.listen(database)
+
+        transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+            run = await fire(client, args.accounts, args.operations, args.concurrency, currencies, args.seed)
+
+        violations = await check_invariants(database, run.pop("rolled_back"))
+
+    report = {
+        "database": database_url.split("://")[0],
+        "accounts": args.accounts,
+        "operations": args.operations,
+        "concurrency": args.concurrency,
+        "balance_mode": args.balance_mode,
+        **run,
+        "lock_statements": LockLatency.summary(lock_latency.lock_statements),
+        "balance_updates": LockLatency.summary(lock_latency.balance_updates),
+        "violations": violations,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database, the database is recreated")
+    parser.add_argument("--accounts", type=int, default=5, help="hot users")
+    parser.add_argument("--currencies", type=int, default=2, help="hot currencies of every user")
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--sqlite-default-pragmas", action="store_true", help="SQLite defaults instead of the tuned SQLite mode pragmas"
+    )
+    parser.add_argument("--balance-mode", choices=("locking", "ledger"), default="locking")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if report["violations"]:
+        sys.exit(1)
@@ -1,8 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Optional
+
 from fastapi import FastAPI
 
+from src.config import Settigns, get_settings
+from src.database import Database
+from src.monitoring.instrumentation import QueryInstrumentationMiddleware, RequestMetricsMiddleware
+from src.monitoring.routers import metrics_router, router as monitoring_router
+from src.monitoring.tracing import Tracer, TracingMiddleware
 from src.transactions.routers import router as transactions_router
 from src.users.routers.users import router as users_router
+from src.users.services.balance_ledger import run_compactor
+from src.utils.admission import create_admission_controllers
+from src.utils.pubsub import PubSubHub
+from src.utils.rate_limit import create_rate_limiter
+
+
+def create_app(settings: Optional[Settigns] = None) -> FastAPI:
+    """
+    Build the application. Settings are read and the database engines are created on startup
+    (not on import), the pool is warmed up before serving and disposed on shutdown.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        app_settings = settings or get_settings()
+        database = Database(app_settings)
+        await database.warm_up()
+        app.state.database = database
+        app.state.tracer = Tracer(app_settings.TRACING)
+        app.state.pubsub = PubSubHub(app_settings.BALANCE_STREAM_QUEUE_SIZE)
+        app.state.admission = create_admission_controllers(app_settings.ADMISSION)
+        app.state.rate_limiter = create_rate_limiter(app_settings.RATE_LIMIT)
+        compactor = None
+        if app_settings.BALANCE_MODE == "ledger":
+            compactor = asyncio.create_task(
+                run_compactor(
+                    database, app_settings.LEDGER_COMPACT_INTERVAL_SECONDS, app_settings.LEDGER_COMPACT_BATCH_SIZE
+                )
+            )
+        try:
+            yield
+        finally:
+            if compactor is not None:
+                compactor.cancel()
+                with suppress(asyncio.CancelledError):
+                    await compactor
+            app.state.tracer.close()
+            await database.dispose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(QueryInstrumentationMiddleware)
+    app.add_middleware(RequestMetricsMiddleware)
+    app.add_middleware(TracingMiddleware)
+    app.include_router(users_router)
+    app.include_router(transactions_router)
+    app.include_router(monitoring_router)
+    app.include_router(metrics_router)
+    return app
+
 
-app = FastAPI()
-app.include_router(users_router)
-app.include_router(transactions_router)
+app = create_app()
@@ -6,17 +6,29 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
-from src.config import settigns
+from src.analytics.models import ExchangeRate
+from src.config import get_settings
 from src.database import Base
-from src.transactions.models import Transaction
-from src.users.models import User, UserBalance
-
-__all_models__ = [User, UserBalance, Transaction]
+from src.transactions.models import Transaction, TransactionArchive, TransactionImport
+from src.users.models import BalanceLedgerEntry, User, UserBalance, UserBalanceSnapshot, UserPortfolio
+
+
+__all_models__ = [
+    User,
+    BalanceLedgerEntry,
+    UserBalance,
+    UserBalanceSnapshot,
+    UserPortfolio,
+    Transaction,
+    TransactionArchive,
+    TransactionImport,
+    ExchangeRate,
+]
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option("sqlalchemy.url", settigns.DATABASE_URL)
+config.set_main_option("sqlalchemy.url", get_settings().DATABASE_URL)
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,51 @@
+"""transaction archive
+
+Revision ID: a4c9e7b2d815
+Revises: f3b8d1c6a920
+Create Date: 2026-02-10 09:41:27.530118
+
+`transaction_archive` receives the transactions older than the archive horizon,
+moved by `python -m src.cli archive-transactions`.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c9e7b2d815'
+down_revision: Union[str, Sequence[str], None] = 'f3b8d1c6a920'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the enum type is shared with `transaction`, it already exists on Postgres
+    status_enum = postgresql.ENUM('PROCESSED', 'ROLL_BACKED', name='transaction_status_enum', create_type=False)
+    op.create_table('transaction_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('currency', sa.String(), nullable=False),
+    sa.Column('amount', sa.Numeric(), nullable=False),
+    sa.Column('status', status_enum, nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('rollbacked', sa.DateTime(), nullable=True),
+    sa.Column('archived', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transaction_archive_user_id_created', 'transaction_archive', ['user_id', 'created'], unique=False)
+    op.create_index('ix_transaction_archive_created', 'transaction_archive', ['created'], unique=False)
+    op.create_index('ix_transaction_archive_rollbacked', 'transaction_archive', ['rollbacked'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transaction_archive_rollbacked', table_name='transaction_archive')
+    op.drop_index('ix_transaction_archive_created', table_name='transaction_archive')
+    op.drop_index('ix_transaction_archive_user_id_created', table_name='transaction_archive')
+    op.drop_table('transaction_archive')
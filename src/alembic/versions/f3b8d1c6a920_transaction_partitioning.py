@@ -0,0 +1,127 @@
+"""transaction partitioning
+
+Revision ID: f3b8d1c6a920
+Revises: d2a6c4f81e07
+Create Date: 2026-02-03 10:12:44.918305
+
+On Postgres `transaction` becomes a table range-partitioned by `created`, one partition per month
+plus a default partition. The primary key becomes `(id, created)`, as a partitioned table requires.
+Future partitions are created by `python -m src.cli create-partitions`. Other databases keep a single table.
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d1c6a920'
+down_revision: Union[str, Sequence[str], None] = 'd2a6c4f81e07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+COLUMNS = 'id, user_id, currency, amount, status, created, rollbacked'
+
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('UPDATE "transaction" SET created = rollbacked WHERE created IS NULL AND rollbacked IS NOT NULL')
+    op.execute(
+        sa.text('UPDATE "transaction" SET created = :now WHERE created IS NULL').bindparams(
+            now=datetime.now(timezone.utc).replace(tzinfo=None)
+        )
+    )
+
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('transaction') as batch_op:
+            batch_op.alter_column('created', existing_type=sa.DateTime(), nullable=False)
+        op.create_index('ix_transaction_user_id_created', 'transaction', ['user_id', 'created'], unique=False)
+        return
+
+    op.drop_index('ix_transaction_user_id_currency_status_amount_created', table_name='transaction')
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    op.execute(
+        'ALTER TABLE transaction_unpartitioned RENAME CONSTRAINT transaction_pkey TO transaction_unpartitioned_pkey'
+    )
+    op.execute(
+        """
+        CREATE TABLE "transaction" (
+            id INTEGER NOT NULL DEFAULT nextval('transaction_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            currency VARCHAR NOT NULL,
+            amount NUMERIC NOT NULL,
+            status transaction_status_enum,
+            created TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            rollbacked TIMESTAMP WITHOUT TIME ZONE,
+            CONSTRAINT transaction_pkey PRIMARY KEY (id, created)
+        ) PARTITION BY RANGE (created)
+        """
+    )
+
+    oldest = op.get_bind().execute(sa.text('SELECT min(created) FROM transaction_unpartitioned')).scalar()
+    current_month = datetime.now(timezone.utc).date().replace(day=1)
+    month = (oldest.date() if oldest else current_month).replace(day=1)
+    while month <= add_months(current_month, MONTHS_AHEAD):
+        next_month = add_months(month, 1)
+        op.execute(
+            f'CREATE TABLE "transaction_y{month.year:04d}m{month.month:02d}" PARTITION OF "transaction" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    op.execute('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+
+    op.execute(f'INSERT INTO "transaction" ({COLUMNS}) SELECT {COLUMNS} FROM transaction_unpartitioned')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.drop_table('transaction_unpartitioned')
+
+    op.create_index(
+        'ix_transaction_user_id_currency_status_amount_created',
+        'transaction',
+        ['user_id', 'currency', 'status', 'amount', 'created'],
+        unique=False,
+    )
+    op.create_index('ix_transaction_user_id_created', 'transaction', ['user_id', 'created'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_transaction_user_id_created', table_name='transaction')
+        with op.batch_alter_table('transaction') as batch_op:
+            batch_op.alter_column('created', existing_type=sa.DateTime(), nullable=True)
+        return
+
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_partitioned')
+    op.execute('ALTER TABLE transaction_partitioned RENAME CONSTRAINT transaction_pkey TO transaction_partitioned_pkey')
+    op.execute(
+        """
+        CREATE TABLE "transaction" (
+            id INTEGER NOT NULL DEFAULT nextval('transaction_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            currency VARCHAR NOT NULL,
+            amount NUMERIC NOT NULL,
+            status transaction_status_enum,
+            created TIMESTAMP WITHOUT TIME ZONE,
+            rollbacked TIMESTAMP WITHOUT TIME ZONE,
+            CONSTRAINT transaction_pkey PRIMARY KEY (id)
+        )
+        """
+    )
+    op.execute(f'INSERT INTO "transaction" ({COLUMNS}) SELECT {COLUMNS} FROM transaction_partitioned')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    # drops the partitions too
+    op.drop_table('transaction_partitioned')
+    op.create_index(
+        'ix_transaction_user_id_currency_status_amount_created',
+        'transaction',
+        ['user_id', 'currency', 'status', 'amount', 'created'],
+        unique=False,
+    )
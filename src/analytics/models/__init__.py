@@ -0,0 +1,4 @@
+from src.analytics.models.exchange_rate import ExchangeRate
+
+
+__all__ = ["ExchangeRate"]
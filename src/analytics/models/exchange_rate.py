@@ -0,0 +1,15 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, Numeric, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.utils.utils import utc_now
+
+
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rate"
+    currency: Mapped[str] = mapped_column(String, primary_key=True)
+    rate_to_usd: Mapped[Decimal] = mapped_column(Numeric, nullable=False)
+    updated: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
@@ -1,16 +1,22 @@
-from datetime import date, timedelta
+from datetime import date, datetime, time, timedelta
 from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.analytics.models import ExchangeRate
+from src.monitoring.metrics import ANALYTICS_DURATION, timed
+from src.monitoring.tracing import traced
 from src.transactions.enums import TransactionStatusEnum
-from src.transactions.models import Transaction
+from src.transactions.services.archive import TransactionArchiveService
 from src.users.enums import CurrencyEnum
 from src.users.models import User
+from src.utils.singleflight import single_flight
 from src.utils.utils import utc_now
 
 
+# the rates `exchange_rate` starts with (see the portfolio migration), for databases created from the models;
+# the reports and the portfolios read the table, updated by `python -m src.cli set-exchange-rates`
 EXCHANGE_RATES_TO_USD: dict[CurrencyEnum, float] = {
     CurrencyEnum.USD: 1,
     CurrencyEnum.EUR: 0.9342,
@@ -27,19 +33,42 @@ EXCHANGE_RATES_TO_USD: dict[CurrencyEnum, float] = {
 
 class AnalyticsService:
     def __init__(self) -> None:
-        self.exchange_rates: dict[CurrencyEnum, float] = EXCHANGE_RATES_TO_USD
-
+        self.archive_service = TransactionArchiveService()
+
+    @timed(ANALYTICS_DURATION, "weekly")
+    @traced()
+    # reports end today, the date is part of the key
+    @single_flight(
+        "weekly_reports",
+        key=lambda self, session, weeks_count=52: (session.get_bind(), weeks_count, utc_now().date()),
+    )
     async def generate_weekly_reports(self, session: AsyncSession, weeks_count: int = 52) -> list[dict[str, Any]]:
+        """
+        Weekly new users, deposits and withdrawals, amounts in USD at the rates of `exchange_rate`.
+        Transactions in currencies without a rate are counted but not included in the amounts, like in the portfolios.
+        """
         today = utc_now().date()
         oldest_date = today - timedelta(weeks=weeks_count - 1, days=6)
+        # datetime bounds on `created`, so Postgres reads only the partitions of the reported weeks
+        created_from = datetime.combine(oldest_date, time.min)
+        created_to = datetime.combine(today + timedelta(days=1), time.min)
 
-        users_query = select(User.id, User.created).where(User.created >= oldest_date)
+        users_query = select(User.id, User.created).where(User.created >= created_from, User.created < created_to)
         users_result = await session.execute(users_query)
         all_users = [(row.id, row.created.date()) for row in users_result]
 
+        rates_result = await session.execute(select(ExchangeRate.currency, ExchangeRate.rate_to_usd))
+        exchange_rates = {currency: float(rate_to_usd) for currency, rate_to_usd in rates_result.tuples()}
+
+        # the reported weeks can start before the archive horizon
+        transactions = await self.archive_service.transaction_rows_from(session, created_from)
         transactions_query = select(
-            Transaction.user_id, Transaction.amount, Transaction.status, Transaction.currency, Transaction.created
-        ).where(Transaction.created >= oldest_date)
+            transactions.c.user_id,
+            transactions.c.amount,
+            transactions.c.status,
+            transactions.c.currency,
+            transactions.c.created,
+        ).where(transactions.c.created >= created_from, transactions.c.created < created_to)
         transactions_result = await session.execute(transactions_query)
         all_transactions: list[dict[str, Any]] = [
             {
@@ -59,7 +88,7 @@ class AnalyticsService:
             week_start = week_end - timedelta(days=6)
 
             report: dict[str, Any] = await self._generate_single_week_report(
-                week_start, week_end, all_users, all_transactions
+                week_start, week_end, all_users, all_transactions, exchange_rates
             )
             reports.append(report)
 
@@ -68,7 +97,12 @@ class AnalyticsService:
         return reports
 
     async def _generate_single_week_report(
-        self, week_start: date, week_end: date, all_users: list[tuple[Any, ...]], all_transactions: list[dict[str, Any]]
+        self,
+        week_start: date,
+        week_end: date,
+        all_users: list[tuple[Any, ...]],
+        all_transactions: list[dict[str, Any]],
+        exchange_rates: dict[str, float],
     ) -> dict[str, Any]:
         """Generate report for single week"""
         week_users = [user_id for user_id, created in all_users if week_start <= created <= week_end]
@@ -83,13 +117,13 @@ class AnalyticsService:
         users_with_deposit_count = len(week_user_ids & deposit_user_ids)
 
         deposit_amount = sum(
-            transaction["amount"] * self.exchange_rates.get(transaction["currency"], 1.0)
+            transaction["amount"] * exchange_rates.get(transaction["currency"], 0.0)
             for transaction in week_transactions
             if transaction["amount"] > 0 and transaction["status"] != TransactionStatusEnum.ROLL_BACKED
         )
 
         withdraw_amount = sum(
-            abs(transaction["amount"]) * self.exchange_rates.get(transaction["currency"], 1.0)
+            abs(transaction["amount"]) * exchange_rates.get(transaction["currency"], 0.0)
             for transaction in week_transactions
             if transaction["amount"] < 0 and transaction["status"] != TransactionStatusEnum.ROLL_BACKED
         )
@@ -0,0 +1,193 @@
+"""
+Maintenance commands.
+
+Usage: python -m src.cli <command> [options]
+"""
+
+import argparse
+import asyncio
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+
+from src.config import get_settings
+from src.database import Database
+from src.transactions.enums import TransactionImportFormatEnum
+from src.transactions.services.archive import DEFAULT_BATCH_SIZE, TransactionArchiveService
+from src.transactions.services.imports import DEFAULT_CHUNK_SIZE, TransactionImportService, iter_file, iter_lines
+from src.transactions.services.partitions import DEFAULT_MONTHS_AHEAD, TransactionPartitionsService
+from src.users.enums import CurrencyEnum
+from src.users.services.balance_ledger import DEFAULT_COMPACT_BATCH_SIZE, BalanceLedgerService
+from src.users.services.balance_snapshots import BalanceSnapshotService
+from src.users.services.portfolio import PortfolioService
+
+
+async def snapshot_balances(database: Database, args: argparse.Namespace) -> int:
+    async with database.session_maker() as session:
+        written = await BalanceSnapshotService(database.settings.BALANCE_SNAPSHOT_INTERVAL).snapshot_balances(
+            session, user_id=args.user_id
+        )
+    print(f"Written {written} balance snapshots")
+    return 0
+
+
+async def check_snapshots(database: Database, args: argparse.Namespace) -> int:
+    async with database.session_maker() as session:
+        mismatches = await BalanceSnapshotService(database.settings.BALANCE_SNAPSHOT_INTERVAL).check_consistency(
+            session, user_id=args.user_id
+        )
+    for mismatch in mismatches:
+        print(
+            f"user_id={mismatch.user_id} currency={mismatch.currency}: "
+            f"expected {mismatch.expected_amount}, actual {mismatch.actual_amount}"
+        )
+    print(f"Found {len(mismatches)} inconsistent balances")
+    return 1 if mismatches else 0
+
+
+async def create_partitions(database: Database, args: argparse.Namespace) -> int:
+    async with database.session_maker() as session:
+        if not await TransactionPartitionsService().is_partitioned(session):
+            print("The transaction table is not partitioned, nothing to do")
+            return 0
+    async with database.session_maker() as session:
+        created = await TransactionPartitionsService().create_future_partitions(session, args.months_ahead)
+    print(f"Created {len(created)} transaction partitions: {', '.join(created) or '-'}")
+    return 0
+
+
+async def archive_transactions(database: Database, args: argparse.Namespace) -> int:
+    horizon_days = (
+        args.horizon_days if args.horizon_days is not None else database.settings.TRANSACTION_ARCHIVE_HORIZON_DAYS
+    )
+    async with database.session_maker() as session:
+        archived = await TransactionArchiveService().archive_transactions(
+            session, horizon_days, batch_size=args.batch_size
+        )
+    print(f"Archived {archived} transactions older than {horizon_days} days")
+    return 0
+
+
+async def import_transactions(database: Database, args: argparse.Namespace) -> int:
+    file_format = args.format or (
+        TransactionImportFormatEnum.NDJSON
+        if args.file.name.endswith((".ndjson", ".jsonl"))
+        else TransactionImportFormatEnum.CSV
+    )
+    async with database.session_maker() as session:
+        try:
+            result = await TransactionImportService().import_transactions(
+                session,
+                key=args.key or args.file.name,
+                lines=iter_lines(iter_file(args.file)),
+                file_format=file_format,
+                chunk_size=args.chunk_size,
+            )
+        except HTTPException as exc:
+            print(f"Import failed: {exc.detail}")
+            return 1
+    print(
+        f"Imported {result.rows_imported} transactions ({result.rows_skipped} imported by a previous run) "
+        f"in {result.seconds}s, {result.rows_per_sec} rows/s, updated {result.balances_updated} balances"
+    )
+    return 0
+
+
+async def set_exchange_rates(database: Database, args: argparse.Namespace) -> int:
+    rates = dict(args.rates)
+    async with database.session_maker() as session:
+        await PortfolioService().set_exchange_rates(session, rates)
+    print(
+        f"Set {len(rates)} exchange rates: {', '.join(f'{currency.value}={rate}' for currency, rate in rates.items())}"
+    )
+    return 0
+
+
+def exchange_rate(value: str) -> tuple[CurrencyEnum, float]:
+    """`CURRENCY=RATE` argument, the USD value of one unit of the currency."""
+    currency, _, rate = value.partition("=")
+    try:
+        parsed = CurrencyEnum(currency.upper()), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected CURRENCY=RATE with a known currency, got {value!r}") from None
+    if not parsed[1] > 0:
+        raise argparse.ArgumentTypeError(f"the rate of {parsed[0].value} must be positive, got {rate}")
+    return parsed
+
+
+async def compact_ledger(database: Database, args: argparse.Namespace) -> int:
+    async with database.session_maker() as session:
+        folded = await BalanceLedgerService().compact_all(session, batch_size=args.batch_size)
+    print(f"Folded {folded} ledger entries into the balances")
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = commands.add_parser("snapshot-balances", help="Write a snapshot of every balance")
+    snapshot_parser.add_argument("--user-id", type=int, default=None)
+    snapshot_parser.set_defaults(handler=snapshot_balances)
+
+    check_parser = commands.add_parser(
+        "check-snapshots", help="Compare balances replayed from snapshots with the live balances"
+    )
+    check_parser.add_argument("--user-id", type=int, default=None)
+    check_parser.set_defaults(handler=check_snapshots)
+
+    partitions_parser = commands.add_parser(
+        "create-partitions", help="Create the monthly transaction partitions of the next months (Postgres)"
+    )
+    partitions_parser.add_argument("--months-ahead", type=int, default=DEFAULT_MONTHS_AHEAD)
+    partitions_parser.set_defaults(handler=create_partitions)
+
+    archive_parser = commands.add_parser(
+        "archive-transactions", help="Move transactions older than the archive horizon to transaction_archive"
+    )
+    archive_parser.add_argument(
+        "--horizon-days", type=int, default=None, help="defaults to TRANSACTION_ARCHIVE_HORIZON_DAYS"
+    )
+    archive_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    archive_parser.set_defaults(handler=archive_transactions)
+
+    import_parser = commands.add_parser(
+        "import-transactions", help="Bulk import historical transactions from a CSV or NDJSON file"
+    )
+    import_parser.add_argument("file", type=argparse.FileType("rb"))
+    import_parser.add_argument(
+        "--format", choices=list(TransactionImportFormatEnum), default=None, help="defaults to the file extension"
+    )
+    import_parser.add_argument(
+        "--key", default=None, help="resumes the import with this key, defaults to the file path"
+    )
+    import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    import_parser.set_defaults(handler=import_transactions)
+
+    rates_parser = commands.add_parser(
+        "set-exchange-rates", help="Set the USD exchange rates of the portfolios and the analytics reports"
+    )
+    rates_parser.add_argument("rates", nargs="+", type=exchange_rate, metavar="CURRENCY=RATE")
+    rates_parser.set_defaults(handler=set_exchange_rates)
+
+    compact_parser = commands.add_parser(
+        "compact-ledger", help="Fold the pending balance ledger entries into the balances (BALANCE_MODE=ledger)"
+    )
+    compact_parser.add_argument("--batch-size", type=int, default=DEFAULT_COMPACT_BATCH_SIZE)
+    compact_parser.set_defaults(handler=compact_ledger)
+
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+async def run(args: argparse.Namespace) -> int:
+    database = Database(get_settings())
+    try:
+        result: int = await args.handler(database, args)
+    finally:
+        await database.dispose()
+    return result
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,16 +1,206 @@
+from functools import lru_cache
+from typing import Literal, Optional
+
 from dotenv import find_dotenv
+from pydantic import BaseModel, Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class SqliteSettings(BaseModel):
+    """
+    SQLite mode, used when the database URL is a SQLite one. Set with `DB__SQLITE__<NAME>` env variables,
+    e.g. `DB__SQLITE__SYNCHRONOUS=FULL`. Pragmas are applied to every new connection.
+    """
+
+    # WAL lets readers run concurrently with the writer
+    JOURNAL_MODE: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"] = "WAL"
+    # NORMAL is durable against application crashes in WAL mode, FULL against power loss too
+    SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    # page cache per connection, negative values are KiB
+    CACHE_SIZE: int = -64_000
+    # bytes of the database file accessed through memory mapping, 0 disables it
+    MMAP_SIZE: int = 256 * 1024 * 1024
+    # milliseconds a connection waits for the lock of another writer (another process) before failing
+    BUSY_TIMEOUT_MS: int = 5000
+    # serialize the write sessions of the process in a queue, instead of letting them wait in `BUSY_TIMEOUT_MS`
+    WRITER_QUEUE: bool = True
+
+
+class DatabaseSettings(BaseModel):
+    """Engine and pool options, set with `DB__<NAME>` env variables, e.g. `DB__POOL_SIZE=20`."""
+
+    # full URL of the primary database, overrides the POSTGRES_* settings
+    URL: Optional[str] = None
+    # URLs of read replicas used by read-only endpoints, as a JSON list
+    REPLICA_URLS: list[str] = []
+    # seconds a replica that failed to connect is skipped for
+    REPLICA_RETRY_SECONDS: float = 30
+
+    ECHO: bool = False
+    POOL_SIZE: int = 5
+    MAX_OVERFLOW: int = 10
+    # seconds to wait for a free connection before raising
+    POOL_TIMEOUT: float = 30
+    # seconds after which a connection is replaced, -1 disables recycling
+    POOL_RECYCLE: int = 1800
+    POOL_PRE_PING: bool = True
+    # asyncpg prepared statements cached per connection, 0 disables the cache (required behind pgbouncer)
+    PREPARED_STATEMENT_CACHE_SIZE: int = 100
+    # SQLAlchemy compiled statements cache size per engine
+    QUERY_CACHE_SIZE: int = 500
+    # connections opened on startup before the app accepts traffic, capped by POOL_SIZE
+    POOL_WARMUP_CONNECTIONS: int = 2
+    SQLITE: SqliteSettings = SqliteSettings()
+
+
+class MonitoringSettings(BaseModel):
+    """Request instrumentation options, set with `MONITORING__<NAME>` env variables."""
+
+    # add the `Server-Timing` header (DB time and query count) to responses
+    SERVER_TIMING: bool = True
+    # requests slower than this are logged with their query stats, negative disables the log
+    SLOW_REQUEST_MS: float = 500
+    # a request executing one statement more times than this is logged, 0 disables the check
+    REPEATED_QUERY_THRESHOLD: int = 20
+    # fail the request instead of logging when the threshold is crossed (for tests and development)
+    REPEATED_QUERY_RAISE: bool = False
+
+
+class TracingSettings(BaseModel):
+    """Span tracing options, set with `TRACING__<NAME>` env variables."""
+
+    # share of requests traced, requests with a sampled `traceparent` header are always traced
+    SAMPLE_RATE: float = Field(default=0.0, ge=0, le=1)
+    # "memory" keeps the latest spans for `GET /monitoring/traces`, "jsonl" appends them to FILE_PATH
+    EXPORTER: Literal["memory", "jsonl"] = "memory"
+    BUFFER_SIZE: int = 10_000
+    FILE_PATH: str = "traces.jsonl"
+    FILE_MAX_BYTES: int = 10 * 1024 * 1024
+    FILE_BACKUP_COUNT: int = 3
+
+
+class RouteClassLimits(BaseModel):
+    # requests of the class running at the same time
+    CONCURRENCY: int
+    # requests waiting for a free slot, more are rejected right away
+    QUEUE_SIZE: int
+    # seconds a request waits in the queue before it is rejected
+    QUEUE_TIMEOUT: float
+    # Postgres `statement_timeout` of the request DB transactions, 0 disables it
+    STATEMENT_TIMEOUT_MS: int
+
+
+class AdmissionSettings(BaseModel):
+    """
+    Concurrency limits per route class, set with `ADMISSION__<NAME>` env variables,
+    e.g. `ADMISSION__WRITE__CONCURRENCY=10`. Rejected requests get 503 with `Retry-After`.
+    The default concurrencies stay within the default pool size plus overflow.
+    """
+
+    ENABLED: bool = True
+    RETRY_AFTER_SECONDS: int = 1
+    WRITE: RouteClassLimits = RouteClassLimits(CONCURRENCY=6, QUEUE_SIZE=50, QUEUE_TIMEOUT=2, STATEMENT_TIMEOUT_MS=5000)
+    READ: RouteClassLimits = RouteClassLimits(CONCURRENCY=6, QUEUE_SIZE=100, QUEUE_TIMEOUT=1, STATEMENT_TIMEOUT_MS=2000)
+    # analytics, exports and imports
+    ANALYTICS: RouteClassLimits = RouteClassLimits(
+        CONCURRENCY=2, QUEUE_SIZE=8, QUEUE_TIMEOUT=10, STATEMENT_TIMEOUT_MS=60000
+    )
+
+
+class RateLimitSettings(BaseModel):
+    """
+    Token buckets of the users and transactions routes, set with `RATE_LIMIT__<NAME>` env variables.
+    Every request takes a token of its client (IP address) and, on routes with a `user_id` path parameter,
+    a token of that user. Limited requests get 429 with `Retry-After`.
+    """
+
+    ENABLED: bool = True
+    # tokens added per second and bucket capacity of every user
+    USER_RATE: float = Field(default=20, gt=0)
+    USER_BURST: int = Field(default=40, gt=0)
+    # tokens added per second and bucket capacity of every client
+    CLIENT_RATE: float = Field(default=200, gt=0)
+    CLIENT_BURST: int = Field(default=400, gt=0)
+    # buckets kept in memory per scope, the least recently used bucket is dropped beyond it
+    MAX_KEYS: int = 100_000
+
+
+class ServerSettings(BaseModel):
+    """
+    HTTP server of `python -m src.server`, set with `SERVER__<NAME>` env variables, e.g. `SERVER__WORKERS=4`.
+    Every worker is a process with its own engines and pools, so the database sees up to WORKERS times
+    `DB__POOL_SIZE` plus overflow connections. Admission and rate limits, the metrics, coalesced reads
+    and the balance streams are kept per worker: a balance stream misses the changes handled by other workers
+    and the effective limits are WORKERS times the configured ones. Running more than one worker has to be
+    allowed with `ALLOW_PER_WORKER_STATE`.
+    """
+
+    HOST: str = "127.0.0.1"
+    PORT: int = 8000
+    # worker processes, 0 starts one per CPU
+    WORKERS: int = Field(default=1, ge=0)
+    # accept the per worker balance streams and limits described above, required when WORKERS is not 1
+    ALLOW_PER_WORKER_STATE: bool = False
+    # log every request to stdout
+    ACCESS_LOG: bool = True
+
+    @model_validator(mode="after")
+    def validate_workers(self) -> "ServerSettings":
+        if self.WORKERS != 1 and not self.ALLOW_PER_WORKER_STATE:
+            raise ValueError(
+                "Balance streams, rate limits and admission limits are kept per worker, "
+                "set SERVER__ALLOW_PER_WORKER_STATE=true to run more than one worker"
+            )
+        return self
+
+
 class Settigns(BaseSettings):
-    POSTGRES_USER: str
-    POSTGRES_PASSWORD: str
-    POSTGRES_DB: str
-    POSTGRES_HOST: str
-    POSTGRES_PORT: str
+    POSTGRES_USER: Optional[str] = None
+    POSTGRES_PASSWORD: Optional[str] = None
+    POSTGRES_DB: Optional[str] = None
+    POSTGRES_HOST: Optional[str] = None
+    POSTGRES_PORT: Optional[str] = None
+
+    DB: DatabaseSettings = DatabaseSettings()
+    MONITORING: MonitoringSettings = MonitoringSettings()
+    TRACING: TracingSettings = TracingSettings()
+    ADMISSION: AdmissionSettings = AdmissionSettings()
+    RATE_LIMIT: RateLimitSettings = RateLimitSettings()
+    SERVER: ServerSettings = ServerSettings()
+
+    # `locking` updates balances in place under a row lock, `ledger` appends balance changes and folds them later
+    BALANCE_MODE: Literal["locking", "ledger"] = "locking"
+    # seconds between the runs of the ledger compactor (`BALANCE_MODE=ledger`)
+    LEDGER_COMPACT_INTERVAL_SECONDS: float = 1
+    # ledger entries folded into the balances per DB transaction of the compactor
+    LEDGER_COMPACT_BATCH_SIZE: int = 1000
+    # a balance snapshot is written after this many changes of the (user, currency) balance
+    BALANCE_SNAPSHOT_INTERVAL: int = 100
+    # transactions older than this many days are moved to `transaction_archive` by `archive-transactions`,
+    # archived transactions are still listed and exported but can no longer be rolled back
+    TRANSACTION_ARCHIVE_HORIZON_DAYS: int = 180
+    # changes queued for a balance stream client before the client is dropped as too slow
+    BALANCE_STREAM_QUEUE_SIZE: int = 100
+    # seconds without changes after which a keepalive comment is sent on a balance stream
+    BALANCE_STREAM_KEEPALIVE_SECONDS: float = 15
+
+    @model_validator(mode="after")
+    def validate_database(self) -> "Settigns":
+        postgres = (
+            self.POSTGRES_USER,
+            self.POSTGRES_PASSWORD,
+            self.POSTGRES_DB,
+            self.POSTGRES_HOST,
+            self.POSTGRES_PORT,
+        )
+        if self.DB.URL is None and any(value is None for value in postgres):
+            raise ValueError("Either DB__URL or all of the POSTGRES_* settings must be set")
+        return self
 
     @property
     def DATABASE_URL(self) -> str:
+        if self.DB.URL:
+            return self.DB.URL
         return (
             f"postgresql+asyncpg://"
             f"{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@"
@@ -18,7 +208,10 @@ class Settigns(BaseSettings):
             f"{self.POSTGRES_DB}"
         )
 
-    model_config = SettingsConfigDict(env_file=find_dotenv())
+    model_config = SettingsConfigDict(env_file=find_dotenv(), env_nested_delimiter="__")
 
 
-settigns = Settigns()  # type: ignore
+@lru_cache
+def get_settings() -> Settigns:
+    """Settings from env variables and `.env`, read on first use instead of on import."""
+    return Settigns()
@@ -1,19 +1,328 @@
-from typing import AsyncGenerator
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Sequence
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import Connection, event, make_url, text
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Session, SessionTransaction
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from sqlalchemy.util import await_only
+from starlette.requests import Request
 
-from src.config import settigns
+from src.config import DatabaseSettings, Settigns, SqliteSettings
+from src.monitoring.instrumentation import instrument_engine
+from src.monitoring.metrics import DB_POOL_WAIT, DB_WRITER_WAIT
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_async_engine(settigns.DATABASE_URL, echo=True)
-async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+class PoolWaitStats:
+    """Time spent by checkouts waiting for a pooled connection (including opening a new one)"""
 
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
 
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        DB_POOL_WAIT.observe(wait)
+
+
+class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+
+# engine execution option of the write sessions, their SQLite transactions take the write lock on begin
+SQLITE_IMMEDIATE_OPTION = "sqlite_begin_immediate"
+
+
+def configure_sqlite(engine: AsyncEngine, sqlite_settings: SqliteSettings) -> None:
+    """
+    Apply the pragmas of the SQLite mode to every new connection and begin the transactions explicitly.
+    SQLite has no row locks and ignores `with_for_update()`: write sessions begin with `BEGIN IMMEDIATE`,
+    which takes the database write lock up front, so a read-modify-write cannot interleave with
+    another writer. Read sessions begin with a plain `BEGIN` and run concurrently in the WAL mode.
+    """
+    pragmas = (
+        f"PRAGMA journal_mode = {sqlite_settings.JOURNAL_MODE}",
+        f"PRAGMA synchronous = {sqlite_settings.SYNCHRONOUS}",
+        f"PRAGMA cache_size = {int(sqlite_settings.CACHE_SIZE)}",
+        f"PRAGMA mmap_size = {int(sqlite_settings.MMAP_SIZE)}",
+        f"PRAGMA busy_timeout = {int(sqlite_settings.BUSY_TIMEOUT_MS)}",
+    )
+
+    def set_pragmas(dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+        # the driver does not begin transactions on its own, `begin` below does
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    def begin(connection: Connection) -> None:
+        immediate = connection.get_execution_options().get(SQLITE_IMMEDIATE_OPTION)
+        # on the DBAPI cursor, not counted as a statement of the request, like the implicit BEGIN of other drivers
+        cursor = connection.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        cursor.close()
+
+    event.listen(engine.sync_engine, "connect", set_pragmas)
+    event.listen(engine.sync_engine, "begin", begin)
+
+
+# `ConnectionPoolEntry.info` key of the connections holding the writer lock of `queue_sqlite_writers`
+_WRITER_LOCK_KEY = "writer_lock"
+
+
+def queue_sqlite_writers(engine: AsyncEngine, writer_lock: asyncio.Lock) -> None:
+    """
+    Hold `writer_lock` for every write transaction (begun with `BEGIN IMMEDIATE`, see `configure_sqlite`),
+    from its begin until its connection is returned to the pool after the commit or rollback. The write
+    transactions of the process wait for their turn in the lock instead of polling in `busy_timeout`,
+    and nothing is held between the transactions of a request.
+    """
+
+    def begin(connection: Connection) -> None:
+        if not connection.get_execution_options().get(SQLITE_IMMEDIATE_OPTION) or _WRITER_LOCK_KEY in connection.info:
+            return
+        started = time.perf_counter()
+        # events are synchronous, the lock is awaited in the greenlet of the async session
+        await_only(writer_lock.acquire())
+        DB_WRITER_WAIT.observe(time.perf_counter() - started)
+        connection.info[_WRITER_LOCK_KEY] = True
+
+    def checkin(dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+        if connection_record.info.pop(_WRITER_LOCK_KEY, False):
+            writer_lock.release()
+
+    # before the `BEGIN IMMEDIATE` of `configure_sqlite`
+    event.listen(engine.sync_engine, "begin", begin, insert=True)
+    event.listen(engine.sync_engine, "checkin", checkin)
+
+
+# `ConnectionPoolEntry.info` key of the process that opened the connection
+_OWNER_PID_KEY = "owner_pid"
+
+
+def guard_forked_connections(engine: AsyncEngine) -> None:
+    """
+    Keep pooled connections in the process that opened them. Engines are created on startup, after
+    the workers of `python -m src.server` are started, but a pool inherited through a fork (a server
+    importing the app before forking) would share its sockets with the parent. A connection opened by
+    another process is dropped without closing it and a new one is opened, like a disconnected one.
+    """
+
+    def connect(dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+        connection_record.info[_OWNER_PID_KEY] = os.getpid()
+
+    # the pool record and proxy, `ConnectionPoolEntry` does not allow detaching the DBAPI connection
+    def checkout(dbapi_connection: Any, connection_record: Any, connection_proxy: Any) -> None:
+        owner_pid = connection_record.info[_OWNER_PID_KEY]
+        if owner_pid != os.getpid():
+            # closing the connection here would close it for its owner too
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+            raise DisconnectionError(f"Connection opened by process {owner_pid}, checked out in {os.getpid()}")
+
+    event.listen(engine.sync_engine, "connect", connect)
+    event.listen(engine.sync_engine, "checkout", checkout)
+
+
+def create_engine(url: str, db_settings: DatabaseSettings) -> AsyncEngine:
+    connect_args: dict[str, Any] = {}
+    if make_url(url).get_driver_name() == "asyncpg":
+        connect_args["prepared_statement_cache_size"] = db_settings.PREPARED_STATEMENT_CACHE_SIZE
+
+    engine = create_async_engine(
+        url,
+        echo=db_settings.ECHO,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        pool_size=db_settings.POOL_SIZE,
+        max_overflow=db_settings.MAX_OVERFLOW,
+        pool_timeout=db_settings.POOL_TIMEOUT,
+        pool_recycle=db_settings.POOL_RECYCLE,
+        pool_pre_ping=db_settings.POOL_PRE_PING,
+        query_cache_size=db_settings.QUERY_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+    guard_forked_connections(engine)
+    if engine.dialect.name == "sqlite":
+        configure_sqlite(engine, db_settings.SQLITE)
+    instrument_engine(engine)
+    return engine
+
+
+# request header that makes read-only endpoints read from the primary (read-your-writes)
+READ_PRIMARY_HEADER = "X-Read-Primary"
+# `session.info` key of the statement timeout of the session DB transactions, in milliseconds
+STATEMENT_TIMEOUT_KEY = "statement_timeout_ms"
+
+
+class ReadReplicaRouter:
+    """
+    Hands out sessions for read-only work: replicas are used round-robin, a replica that
+    fails to connect is skipped for `retry_after` seconds and the primary is used when no replica works.
+    """
+
+    def __init__(
+        self,
+        primary: async_sessionmaker[AsyncSession],
+        replicas: Sequence[async_sessionmaker[AsyncSession]] = (),
+        retry_after: float = 30,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.retry_after = retry_after
+        self._next_replica = 0
+        self._unavailable_until = [0.0] * len(self.replicas)
+
+    @asynccontextmanager
+    async def session(self, use_primary: bool = False) -> AsyncIterator[AsyncSession]:
+        if not use_primary:
+            for index in self._replicas_order():
+                session = self.replicas[index]()
+                try:
+                    await session.connection()
+                except (TimeoutError, OSError, DBAPIError):
+                    await session.close()
+                    self._unavailable_until[index] = time.monotonic() + self.retry_after
+                    continue
+                async with session:
+                    yield session
+                return
+
+        async with self.primary() as session:
+            yield session
+
+    def _replicas_order(self) -> list[int]:
+        if not self.replicas:
+            return []
+        start = self._next_replica
+        self._next_replica = (start + 1) % len(self.replicas)
+        now = time.monotonic()
+        order = [(start + offset) % len(self.replicas) for offset in range(len(self.replicas))]
+        return [index for index in order if self._unavailable_until[index] <= now]
+
+
+class Database:
+    """
+    Engines and session makers of the primary and replica databases.
+    Created by the app lifespan (see `main.create_app`) and stored in `app.state.database`.
+
+    `session_maker` makes write sessions, on SQLite they begin with `BEGIN IMMEDIATE` (see `configure_sqlite`)
+    and their DB transactions wait for their turn in `writer_lock` (see `queue_sqlite_writers`).
+    """
+
+    def __init__(self, settings: Settigns) -> None:
+        self.settings = settings
+        self.engine = create_engine(settings.DATABASE_URL, settings.DB)
+        self.is_sqlite = self.engine.dialect.name == "sqlite"
+        write_engine = (
+            self.engine.execution_options(**{SQLITE_IMMEDIATE_OPTION: True}) if self.is_sqlite else self.engine
+        )
+        self.session_maker = async_sessionmaker(write_engine, expire_on_commit=False)
+        self.writer_lock = asyncio.Lock() if self.is_sqlite and settings.DB.SQLITE.WRITER_QUEUE else None
+        if self.writer_lock is not None:
+            queue_sqlite_writers(self.engine, self.writer_lock)
+        # read sessions of the primary
+        self.read_session_maker = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.replica_engines = [create_engine(url, settings.DB) for url in settings.DB.REPLICA_URLS]
+        self.read_router = ReadReplicaRouter(
+            self.read_session_maker,
+            [async_sessionmaker(replica_engine, expire_on_commit=False) for replica_engine in self.replica_engines],
+            retry_after=settings.DB.REPLICA_RETRY_SECONDS,
+        )
+
+    async def warm_up(self) -> None:
+        """Open pool connections up front, so the first requests do not pay for connecting."""
+        connections_count = min(self.settings.DB.POOL_WARMUP_CONNECTIONS, self.settings.DB.POOL_SIZE)
+        if connections_count <= 0:
+            return
+
+        async def open_connection(engine: AsyncEngine) -> AsyncConnection:
+            connection = await engine.connect()
+            await connection.execute(text("SELECT 1"))
+            return connection
+
+        connections = await asyncio.gather(
+            *(
+                open_connection(engine)
+                for engine in (self.engine, *self.replica_engines)
+                for _ in range(connections_count)
+            )
+        )
+        for connection in connections:
+            await connection.close()
+
+    async def dispose(self) -> None:
+        for engine in (self.engine, *self.replica_engines):
+            await engine.dispose()
+
+
+def get_database(request: Request) -> Database:
+    database: Database = request.app.state.database
+    return database
+
+
+def _set_statement_timeout(session: Session, transaction: SessionTransaction, connection: Connection) -> None:
+    timeout = session.info.get(STATEMENT_TIMEOUT_KEY)
+    if timeout and connection.dialect.name == "postgresql":
+        # the timeout ends with the DB transaction, pooled connections do not keep it
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+event.listen(Session, "after_begin", _set_statement_timeout)
+
+
+def _with_statement_timeout(session: AsyncSession, request: Request) -> AsyncSession:
+    """Apply the statement timeout of the request route class (see `src.utils.admission`) to the session."""
+    session.info[STATEMENT_TIMEOUT_KEY] = getattr(request.state, "statement_timeout_ms", None)
+    return session
+
+
+async def get_async_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    database = get_database(request)
+    async with database.session_maker() as session:
+        yield _with_statement_timeout(session, request)
+
+
+async def get_read_async_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only endpoints, served by a replica when replicas are configured.
+    Sending `X-Read-Primary: true` reads from the primary instead.
+    """
+    async with read_session(request) as session:
         yield session
+
+
+async def get_primary_read_async_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only endpoints that must not lag behind the writes, served by the primary."""
+    async with read_session(request, use_primary=True) as session:
+        yield session
+
+
+@asynccontextmanager
+async def read_session(request: Request, use_primary: bool = False) -> AsyncIterator[AsyncSession]:
+    """
+    The session of `get_read_async_session`, for response bodies streamed by the endpoint: the dependency
+    sessions are closed when the endpoint returns, before the body is sent.
+    """
+    use_primary = use_primary or request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true", "yes")
+    async with get_database(request).read_router.session(use_primary=use_primary) as session:
+        yield _with_statement_timeout(session, request)
@@ -1,6 +1,27 @@
+import math
+
 from fastapi import HTTPException, status
 
 
 class BadRequestDataException(HTTPException):
     def __init__(self, detail: str):
         super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail)
+
+
+class ServiceOverloadedException(HTTPException):
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is overloaded, retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class RateLimitExceededException(HTTPException):
+    def __init__(self, retry_after: float):
+        # `Retry-After` takes whole seconds, the detail keeps the exact wait
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded, retry in {retry_after:.3f} seconds",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+        )
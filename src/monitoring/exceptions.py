@@ -0,0 +1,9 @@
+from fastapi import HTTPException, status
+
+
+class TracesNotAvailableException(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Traces are kept in memory only with TRACING__EXPORTER=memory",
+        )
@@ -0,0 +1,236 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, ExecutionContext
+from sqlalchemy.engine.default import DefaultExecutionContext
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import MonitoringSettings
+from src.monitoring.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS, SQL_COMPILE_CACHE
+from src.monitoring.tracing import current_span
+
+
+logger = logging.getLogger(__name__)
+
+_QUERY_STARTED_KEY = "query_started"
+_STATEMENT_SPANS_KEY = "statement_spans"
+_CACHE_RESULTS = {
+    CacheStats.CACHE_HIT: "hit",
+    CacheStats.CACHE_MISS: "miss",
+    CacheStats.NO_CACHE_KEY: "no_key",
+    CacheStats.CACHING_DISABLED: "disabled",
+    CacheStats.NO_DIALECT_SUPPORT: "no_dialect_support",
+}
+
+
+class RepeatedQueryError(RuntimeError):
+    """Raised in strict mode when one statement is executed more times per request than allowed."""
+
+
+class QueryStats:
+    """SQL statements executed while collecting, see `collect_queries`."""
+
+    def __init__(self, repeated_threshold: int = 0, raise_on_repeated: bool = False) -> None:
+        self.repeated_threshold = repeated_threshold
+        self.raise_on_repeated = raise_on_repeated
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        # executions by statement text, bound parameters are not part of the text
+        self.statements: Counter[str] = Counter()
+
+    def before_execute(self, statement: str) -> None:
+        self.statements[statement] += 1
+        if self.raise_on_repeated and 0 < self.repeated_threshold < self.statements[statement]:
+            raise RepeatedQueryError(
+                f"Statement executed more than {self.repeated_threshold} times in one request: {statement}"
+            )
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def repeated_statements(self) -> dict[str, int]:
+        """Statements executed more than `repeated_threshold` times, a sign of a per-row (N+1) query."""
+        if self.repeated_threshold <= 0:
+            return {}
+        return {statement: count for statement, count in self.statements.items() if count > self.repeated_threshold}
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def collect_queries(repeated_threshold: int = 0, raise_on_repeated: bool = False) -> Iterator[QueryStats]:
+    """Collect statements executed by instrumented engines in the current context."""
+    stats = QueryStats(repeated_threshold, raise_on_repeated)
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+def _before_cursor_execute(
+    conn: Connection, cursor: Any, statement: str, parameters: Any, context: ExecutionContext, executemany: bool
+) -> None:
+    span = current_span()
+    if span is not None:
+        conn.info.setdefault(_STATEMENT_SPANS_KEY, []).append(span.child("db.statement", {"statement": statement}))
+    stats = _query_stats.get()
+    if stats is None:
+        return
+    conn.info.setdefault(_QUERY_STARTED_KEY, []).append(time.perf_counter())
+    stats.before_execute(statement)
+
+
+def _after_cursor_execute(
+    conn: Connection, cursor: Any, statement: str, parameters: Any, context: ExecutionContext, executemany: bool
+) -> None:
+    spans = conn.info.get(_STATEMENT_SPANS_KEY)
+    if spans:
+        spans.pop().end()
+    # statements sent as driver SQL are not compiled
+    if isinstance(context, DefaultExecutionContext) and context.compiled is not None:
+        SQL_COMPILE_CACHE.inc(_CACHE_RESULTS[context.cache_hit])
+    stats = _query_stats.get()
+    started = conn.info.get(_QUERY_STARTED_KEY)
+    if stats is None or not started:
+        return
+    stats.record(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context: Any) -> None:
+    # the failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is None:
+        return
+    if connection.info.get(_QUERY_STARTED_KEY):
+        connection.info[_QUERY_STARTED_KEY].pop()
+    if connection.info.get(_STATEMENT_SPANS_KEY):
+        span = connection.info[_STATEMENT_SPANS_KEY].pop()
+        span.error = type(exception_context.original_exception).__name__
+        span.end()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Make statements executed by the engine visible to `collect_queries`, traced as `db.statement` spans
+    and counted by compiled cache result.
+    """
+    sync_engine = engine.sync_engine
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+def server_timing(stats: QueryStats, duration: float) -> str:
+    return f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries", app;dur={duration * 1000:.2f}'
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts SQL statements and DB time per HTTP request. Adds a `Server-Timing` header,
+    logs requests slower than `MONITORING__SLOW_REQUEST_MS` and requests repeating a statement
+    more than `MONITORING__REPEATED_QUERY_THRESHOLD` times.
+    Settings are taken from the app database (`app.state.database.settings`) created on startup.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        database = getattr(scope["app"].state, "database", None) if scope["type"] == "http" else None
+        if database is None:
+            await self.app(scope, receive, send)
+            return
+
+        settings: MonitoringSettings = database.settings.MONITORING
+        started = time.perf_counter()
+        status_code = 500
+
+        with collect_queries(settings.REPEATED_QUERY_THRESHOLD, settings.REPEATED_QUERY_RAISE) as stats:
+
+            async def send_with_timing(message: Message) -> None:
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    if settings.SERVER_TIMING:
+                        headers = list(message.get("headers", []))
+                        timing = server_timing(stats, time.perf_counter() - started)
+                        headers.append((b"server-timing", timing.encode("latin-1")))
+                        message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                self._log_request(scope, settings, stats, status_code, time.perf_counter() - started)
+
+    @staticmethod
+    def _log_request(
+        scope: Scope, settings: MonitoringSettings, stats: QueryStats, status_code: int, duration: float
+    ) -> None:
+        repeated = stats.repeated_statements()
+        slow = settings.SLOW_REQUEST_MS >= 0 and duration * 1000 >= settings.SLOW_REQUEST_MS
+        if not slow and not repeated:
+            return
+
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "db_queries": stats.count,
+            "db_time_ms": round(stats.total_time * 1000, 2),
+            "slowest_query_ms": round(stats.slowest_time * 1000, 2),
+            "slowest_query": stats.slowest_statement,
+        }
+        if slow:
+            logger.warning("slow request %s", json.dumps(record), extra={"request_stats": record})
+        if repeated:
+            record = {**record, "repeated_queries": repeated}
+            logger.warning("repeated queries %s", json.dumps(record), extra={"request_stats": record})
+
+
+class RequestMetricsMiddleware:
+    """Records latency and status of HTTP requests by route template, unmatched paths share one label."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status_code))
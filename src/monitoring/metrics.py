@@ -0,0 +1,272 @@
+import functools
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, buckets_count: int) -> None:
+        # per bucket counts (not cumulative), the last one is `+Inf`
+        self.buckets = [0] * (buckets_count + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._values: dict[tuple[str, ...], _HistogramValue] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        histogram_value = self._values.get(labels)
+        if histogram_value is None:
+            histogram_value = self._values[labels] = _HistogramValue(len(self.bounds))
+        histogram_value.buckets[bisect_left(self.bounds, value)] += 1
+        histogram_value.count += 1
+        histogram_value.sum += value
+
+    def count(self, *labels: str) -> int:
+        histogram_value = self._values.get(labels)
+        return histogram_value.count if histogram_value else 0
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, histogram_value in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*map(_format_value, self.bounds), "+Inf"), histogram_value.buckets):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(histogram_value.sum)}")
+            lines.append(f"{self.name}_count{label_text} {histogram_value.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format by `GET /metrics`.
+    Metrics are created once on import, recording is a dict lookup and an addition
+    (see `benchmarks/metrics_overhead.py`).
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self._metrics[metric.name] = metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self.register(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        gauge = Gauge(name, documentation, labelnames)
+        self.register(gauge)
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.register(histogram)
+        return histogram
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")
+)
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+DB_POOL_WAIT = REGISTRY.histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+SQL_COMPILE_CACHE = REGISTRY.counter(
+    "sql_compile_cache_total",
+    "Executed SQLAlchemy statements by compiled cache result (`hit`, `miss`, `no_key`, `disabled`, `no_dialect_support`)",
+    ("result",),
+)
+DB_WRITER_WAIT = REGISTRY.histogram("db_writer_wait_seconds", "Time write sessions waited in the SQLite writer queue")
+TRANSACTION_OPERATIONS = REGISTRY.counter(
+    "transaction_operations_total",
+    "Transaction creations and rollbacks by outcome (`success` or the exception class name)",
+    ("operation", "outcome"),
+)
+ANALYTICS_DURATION = REGISTRY.histogram("analytics_duration_seconds", "Analytics reports computation time", ("report",))
+ADMISSION_LIMIT = REGISTRY.gauge(
+    "admission_limit", "Configured admission limits by route class (`concurrency`, `queue`)", ("route_class", "limit")
+)
+ADMISSION_ACTIVE = REGISTRY.gauge("admission_active_requests", "Admitted requests in progress", ("route_class",))
+ADMISSION_WAITING = REGISTRY.gauge("admission_waiting_requests", "Requests queued for admission", ("route_class",))
+ADMISSION_WAIT = REGISTRY.histogram(
+    "admission_wait_seconds", "Time requests waited in the admission queue", ("route_class",)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "admission_rejected_total",
+    "Requests answered with 503 by reason (`queue_full`, `timeout`)",
+    ("route_class", "reason"),
+)
+LEDGER_ENTRIES_COMPACTED = REGISTRY.counter(
+    "ledger_entries_compacted_total", "Balance ledger entries folded into the balances by the compactor"
+)
+LEDGER_PENDING_ENTRIES = REGISTRY.gauge(
+    "ledger_pending_entries", "Balance ledger entries left after the last compactor run"
+)
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited_requests_total", "Requests answered with 429 by exhausted bucket (`user`, `client`)", ("scope",)
+)
+SINGLE_FLIGHT_CALLS = REGISTRY.counter(
+    "single_flight_calls_total",
+    "Coalesced read operations by role: `leader` calls ran the operation, `shared` calls awaited a leader result",
+    ("operation", "role"),
+)
+PUBSUB_MESSAGES = REGISTRY.counter(
+    "pubsub_messages_total",
+    "Messages published to in-process subscribers by outcome (`delivered`, `dropped`)",
+    ("outcome",),
+)
+
+
+def count_outcomes(
+    counter: Counter, operation: str
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Count calls of the coroutine function by outcome: `success` or the name of the raised exception class."""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as exc:
+                counter.inc(operation, type(exc).__name__)
+                raise
+            counter.inc(operation, "success")
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def timed(histogram: Histogram, *labels: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Observe the duration of the coroutine function calls, including failed ones."""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorator
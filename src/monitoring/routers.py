@@ -0,0 +1,51 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import PlainTextResponse
+
+from src.database import Database, get_database
+from src.monitoring.exceptions import TracesNotAvailableException
+from src.monitoring.metrics import REGISTRY
+from src.monitoring.routing import TracedAPIRoute
+from src.monitoring.schemas import PoolStatusModel, SpanModel
+from src.monitoring.services.monitoring import MonitoringService
+from src.monitoring.tracing import RingBufferExporter, Tracer, get_tracer
+
+
+router = APIRouter(prefix="/monitoring", tags=["Monitoring"], route_class=TracedAPIRoute)
+metrics_router = APIRouter(tags=["Monitoring"], route_class=TracedAPIRoute)
+
+
+@router.get(
+    "/pool",
+    response_model=PoolStatusModel,
+    status_code=status.HTTP_200_OK,
+)
+async def get_pool_status(database: Database = Depends(get_database)) -> PoolStatusModel:
+    return MonitoringService().get_pool_status(database.engine.pool)
+
+
+@router.get(
+    "/traces",
+    response_model=list[SpanModel],
+    status_code=status.HTTP_200_OK,
+)
+async def get_traces(
+    trace_id: Optional[str] = None,
+    limit: int = Query(default=1000, ge=1, le=10_000),
+    tracer: Tracer = Depends(get_tracer),
+) -> list[SpanModel]:
+    """Latest finished spans, newest first, optionally of one trace (the `X-Trace-Id` response header)."""
+    if not isinstance(tracer.exporter, RingBufferExporter):
+        raise TracesNotAvailableException()
+    spans = tracer.exporter.spans(trace_id)
+    return [SpanModel(**span) for span in reversed(spans[-limit:])]
+
+
+@metrics_router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
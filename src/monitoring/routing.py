@@ -0,0 +1,14 @@
+from typing import Any, Callable
+
+from fastapi.routing import APIRoute
+
+from src.monitoring.tracing import traced
+
+
+class TracedAPIRoute(APIRoute):
+    """Route class tracing the endpoint call, so handler time can be told apart from validation and serialization."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, traced(f"handler {endpoint.__name__}")(endpoint), **kwargs)
+        # `include_router` copies routes from their `endpoint`, keep it unwrapped so it is traced once
+        self.endpoint = endpoint
@@ -0,0 +1,26 @@
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+
+class PoolStatusModel(BaseModel):
+    pool_class: str
+    size: Optional[int] = None
+    checked_in: Optional[int] = None
+    checked_out: Optional[int] = None
+    overflow: Optional[int] = None
+    checkouts: Optional[int] = None
+    wait_total_seconds: Optional[float] = None
+    wait_max_seconds: Optional[float] = None
+    wait_avg_seconds: Optional[float] = None
+
+
+class SpanModel(BaseModel):
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    name: str
+    start: float
+    duration_ms: float
+    attributes: dict[str, Any]
+    error: Optional[str] = None
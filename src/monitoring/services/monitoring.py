@@ -0,0 +1,26 @@
+from sqlalchemy import Pool, QueuePool
+
+from src.database import InstrumentedAsyncAdaptedQueuePool
+from src.monitoring.schemas import PoolStatusModel
+
+
+class MonitoringService:
+    def get_pool_status(self, pool: Pool) -> PoolStatusModel:
+        """
+        Live pool usage. Size and overflow are reported for queue pools,
+        checkout wait times only for pools created by `src.database.create_engine`.
+        """
+        status = PoolStatusModel(pool_class=type(pool).__name__)
+        if isinstance(pool, QueuePool):
+            status.size = pool.size()
+            status.checked_in = pool.checkedin()
+            status.checked_out = pool.checkedout()
+            # SQLAlchemy counts overflow from -pool_size
+            status.overflow = max(pool.overflow(), 0)
+        if isinstance(pool, InstrumentedAsyncAdaptedQueuePool):
+            stats = pool.wait_stats
+            status.checkouts = stats.checkouts
+            status.wait_total_seconds = stats.total_wait
+            status.wait_max_seconds = stats.max_wait
+            status.wait_avg_seconds = stats.total_wait / stats.checkouts if stats.checkouts else 0.0
+        return status
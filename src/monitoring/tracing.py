@@ -0,0 +1,242 @@
+import functools
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Awaitable, Callable, Iterator, Optional, Protocol, TypeVar
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import TracingSettings
+
+
+T = TypeVar("T")
+
+TRACE_ID_HEADER = "X-Trace-Id"
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SpanExporter(Protocol):
+    def export(self, span: "Span") -> None: ...
+
+    def close(self) -> None: ...
+
+
+class Span:
+    __slots__ = (
+        "_started",
+        "attributes",
+        "duration",
+        "error",
+        "exporter",
+        "name",
+        "parent_id",
+        "span_id",
+        "start",
+        "trace_id",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        exporter: SpanExporter,
+        parent_id: Optional[str] = None,
+        attributes: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.exporter = exporter
+        self.start = time.time()
+        self.duration = 0.0
+        self._started = time.perf_counter()
+
+    def child(self, name: str, attributes: Optional[dict[str, Any]] = None) -> "Span":
+        return Span(name, self.trace_id, self.exporter, self.span_id, attributes)
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self._started
+        self.exporter.export(self)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class RingBufferExporter:
+    """Keeps the latest finished spans in memory, served by `GET /monitoring/traces`."""
+
+    def __init__(self, capacity: int) -> None:
+        self._spans: deque[dict[str, Any]] = deque(maxlen=capacity)
+
+    def export(self, span: Span) -> None:
+        self._spans.append(span.to_dict())
+
+    def spans(self, trace_id: Optional[str] = None) -> list[dict[str, Any]]:
+        return [span for span in self._spans if trace_id is None or span["trace_id"] == trace_id]
+
+    def close(self) -> None:
+        self._spans.clear()
+
+
+class JsonlFileExporter:
+    """Appends finished spans as JSON lines to a file rotated by size."""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int) -> None:
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def export(self, span: Span) -> None:
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(span.to_dict(), default=str)}))
+
+    def close(self) -> None:
+        self._handler.close()
+
+
+class Tracer:
+    """Samples requests and creates their root spans. Created by the app lifespan from `TRACING__*` settings."""
+
+    def __init__(self, settings: TracingSettings) -> None:
+        self.sample_rate = settings.SAMPLE_RATE
+        self.exporter: SpanExporter
+        if settings.EXPORTER == "jsonl":
+            self.exporter = JsonlFileExporter(settings.FILE_PATH, settings.FILE_MAX_BYTES, settings.FILE_BACKUP_COUNT)
+        else:
+            self.exporter = RingBufferExporter(settings.BUFFER_SIZE)
+
+    def start_request_span(self, name: str, headers: dict[str, str]) -> tuple[Optional[Span], str]:
+        """
+        Root span of a request, `None` when the request is not sampled. The trace id is taken from
+        the W3C `traceparent` header (sampled flag is honoured) or `X-Trace-Id`, otherwise generated.
+        """
+        trace_id, parent_id, sampled = None, None, None
+        traceparent = _TRACEPARENT_RE.match(headers.get("traceparent", ""))
+        if traceparent:
+            trace_id, parent_id = traceparent.group(1), traceparent.group(2)
+            sampled = int(traceparent.group(3), 16) & 1 == 1
+        elif _TRACE_ID_RE.match(headers.get(TRACE_ID_HEADER.lower(), "").lower()):
+            trace_id = headers[TRACE_ID_HEADER.lower()].lower()
+
+        trace_id = trace_id or os.urandom(16).hex()
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return None, trace_id
+        return Span(name, trace_id, self.exporter, parent_id), trace_id
+
+    def close(self) -> None:
+        self.exporter.close()
+
+
+def get_tracer(request: Request) -> Tracer:
+    tracer: Tracer = request.app.state.tracer
+    return tracer
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Child span of the current span, does nothing outside of a sampled request."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    span = parent.child(name, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = type(exc).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Trace the coroutine function calls, the span is named after the function qualified name by default."""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            if _current_span.get() is None:
+                return await func(*args, **kwargs)
+            with trace_span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of sampled requests and returns the trace id in the `X-Trace-Id` response header.
+    The tracer is taken from `app.state.tracer` created on startup.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        tracer: Optional[Tracer] = getattr(scope["app"].state, "tracer", None) if scope["type"] == "http" else None
+        if tracer is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        span, trace_id = tracer.start_request_span(f"{scope['method']} {scope['path']}", headers)
+
+        async def send_with_trace_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if span is not None:
+                    span.attributes["status"] = message["status"]
+                trace_header = (TRACE_ID_HEADER.lower().encode("latin-1"), trace_id.encode("latin-1"))
+                message = {**message, "headers": [*message.get("headers", []), trace_header]}
+            await send(message)
+
+        if span is None:
+            await self.app(scope, receive, send_with_trace_id)
+            return
+
+        token = _current_span.set(span)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as exc:
+            span.error = type(exc).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route is not None:
+                span.name = f"{scope['method']} {route}"
+            span.end()
@@ -0,0 +1,39 @@
+"""
+HTTP server with `SERVER__WORKERS` worker processes.
+
+Usage: python -m src.server
+
+Workers are started by uvicorn as new processes sharing the listening socket. Each worker builds the app
+with `main:create_app`, so its engines and pools are created on its own startup and never cross a fork.
+"""
+
+import os
+
+import uvicorn
+
+from src.config import ServerSettings, get_settings
+
+
+APP_FACTORY = "main:create_app"
+
+
+def worker_count(settings: ServerSettings) -> int:
+    return settings.WORKERS or os.cpu_count() or 1
+
+
+def main() -> None:
+    settings = get_settings().SERVER
+    uvicorn.run(
+        APP_FACTORY,
+        factory=True,
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=worker_count(settings),
+        access_log=settings.ACCESS_LOG,
+        # a worker that fails to start (e.g. the database is unreachable) exits instead of serving errors
+        lifespan="on",
+    )
+
+
+if __name__ == "__main__":
+    main()
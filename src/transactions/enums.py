@@ -4,3 +4,13 @@ from enum import StrEnum
 class TransactionStatusEnum(StrEnum):
     PROCESSED = "PROCESSED"
     ROLL_BACKED = "ROLLBACKED"
+
+
+class TransactionImportFormatEnum(StrEnum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class TransactionImportStatusEnum(StrEnum):
+    RUNNING = "RUNNING"
+    DONE = "DONE"
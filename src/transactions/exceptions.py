@@ -31,3 +31,19 @@ class NotEnoughBalanceException(HTTPException):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Not enough balance",
         )
+
+
+class TransactionArchivedException(HTTPException):
+    def __init__(self, transaction_id: int) -> None:
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Transaction with id=`{transaction_id}` is archived and can not be rollbacked",
+        )
+
+
+class TransactionImportRowException(HTTPException):
+    def __init__(self, line: int, error: str) -> None:
+        super().__init__(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid transaction on line {line}: {error}",
+        )
@@ -1,3 +1,5 @@
 from src.transactions.models.transaction import Transaction
+from src.transactions.models.transaction_archive import TransactionArchive
+from src.transactions.models.transaction_import import TransactionImport
 
-__all__ = ["Transaction"]
+__all__ = ["Transaction", "TransactionArchive", "TransactionImport"]
@@ -1,8 +1,8 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import DateTime, ForeignKey, Integer, Numeric, String
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String
 from sqlalchemy import Enum as saEnum
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -23,9 +23,29 @@ class Transaction(Base):
     status: Mapped[TransactionStatusEnum] = mapped_column(
         saEnum(TransactionStatusEnum, name="transaction_status_enum"), nullable=True, default=None
     )
-    created: Mapped[datetime] = mapped_column(DateTime, nullable=True, default=utc_now)
+    # the partitioning key on Postgres, where the primary key is `(id, created)` (see the partitioning migration)
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+    rollbacked: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=None)
 
     user: Mapped["User"] = relationship(
         "User",
         back_populates="transactions",
     )
+
+    # the identity of the partitioned primary key, so the UPDATEs of the unit of work filter on the partitioning key
+    # and touch a single partition; `id` is unique on SQLite only, lookups by `id` alone probe every partition
+    __mapper_args__ = {"primary_key": [id, created]}
+
+    __table_args__ = (
+        # covers per-user summaries, so they are answered by an index-only scan
+        Index(
+            "ix_transaction_user_id_currency_status_amount_created",
+            "user_id",
+            "currency",
+            "status",
+            "amount",
+            "created",
+        ),
+        # latest transactions of a user, scanned backwards from the newest partition
+        Index("ix_transaction_user_id_created", "user_id", "created"),
+    )
@@ -0,0 +1,37 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String
+from sqlalchemy import Enum as saEnum
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.transactions.enums import TransactionStatusEnum
+from src.utils.utils import utc_now
+
+
+class TransactionArchive(Base):
+    """
+    Transactions moved out of `transaction` once they are older than the archive horizon.
+    Rows keep their ids and are never updated, archived transactions can not be rolled back.
+    """
+
+    __tablename__ = "transaction_archive"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"), nullable=False)
+    currency: Mapped[str] = mapped_column(String, nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Numeric, nullable=False)
+    status: Mapped[TransactionStatusEnum] = mapped_column(
+        saEnum(TransactionStatusEnum, name="transaction_status_enum"), nullable=True
+    )
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    rollbacked: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    archived: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+
+    __table_args__ = (
+        Index("ix_transaction_archive_user_id_created", "user_id", "created"),
+        # max(created) and max(rollbacked) tell whether a balance replay needs the archive at all
+        Index("ix_transaction_archive_created", "created"),
+        Index("ix_transaction_archive_rollbacked", "rollbacked"),
+    )
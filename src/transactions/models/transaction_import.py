@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String
+from sqlalchemy import Enum as saEnum
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.transactions.enums import TransactionImportStatusEnum
+from src.utils.utils import utc_now
+
+
+class TransactionImport(Base):
+    """Progress of a bulk transaction import, so an interrupted import resumes after its last committed chunk."""
+
+    __tablename__ = "transaction_import"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # chosen by the caller, importing again with the same key resumes the import
+    key: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    status: Mapped[TransactionImportStatusEnum] = mapped_column(
+        saEnum(TransactionImportStatusEnum, name="transaction_import_status_enum"), nullable=False
+    )
+    # a resumed import keeps the chunk size of its first run, so chunks_done counts the same rows
+    chunk_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    chunks_done: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rows_imported: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+    updated: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
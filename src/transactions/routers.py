@@ -1,28 +1,137 @@
-from typing import Any, Optional, Sequence
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Any, Optional
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.analytics.services.analytics import AnalyticsService
-from src.database import get_async_session
-from src.transactions.schemas import RequestTransactionModel, TransactionModel
+from src.config import Settigns
+from src.database import get_async_session, get_read_async_session, read_session
+from src.monitoring.routing import TracedAPIRoute
+from src.transactions.enums import TransactionImportFormatEnum
+from src.transactions.schemas import (
+    RequestTransactionModel,
+    TransactionImportResultModel,
+    TransactionModel,
+    TransactionSummaryModel,
+)
+from src.transactions.services.imports import DEFAULT_CHUNK_SIZE, TransactionImportService, iter_lines
 from src.transactions.services.transactions import TransactionsService
-from src.utils.dependencies import validate_positive_id
+from src.utils.admission import RouteClassEnum, admission
+from src.utils.dependencies import get_app_settings, validate_positive_id
+from src.utils.etag import etag_matches, make_etag, not_modified
+from src.utils.pubsub import PubSubHub, get_pubsub
+from src.utils.rate_limit import rate_limit
+from src.utils.responses import NDJSONStreamingResponse, TrustedJSONResponse
+from src.utils.utils import to_naive_utc
 
 
-router = APIRouter(prefix="/transactions", tags=["Transactions"])
+router = APIRouter(
+    prefix="/transactions", tags=["Transactions"], route_class=TracedAPIRoute, dependencies=[Depends(rate_limit)]
+)
 
 
 @router.get(
     "",
     response_model=Optional[list[TransactionModel]],
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
 )
 async def get_transactions(
+    request: Request,
+    user_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_read_async_session),
+    settings: Settigns = Depends(get_app_settings),
+) -> Response:
+    """Supports `If-None-Match`, an unchanged result is answered with 304 without loading it."""
+    service = TransactionsService(settings)
+    filters: dict[str, Any] = {
+        "user_id": user_id,
+        "created_from": to_naive_utc(created_from) if created_from else None,
+        "created_to": to_naive_utc(created_to) if created_to else None,
+    }
+    # the version is read first, the data read after it is never older than the ETag
+    version = await service.get_user_transactions_version(session=session, **filters)
+    etag = make_etag("transactions", *filters.values(), *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    transactions = await service.get_user_transactions(session=session, **filters)
+    return TrustedJSONResponse(transactions, headers={"ETag": etag})
+
+
+@router.get(
+    "/export",
+    response_class=NDJSONStreamingResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.ANALYTICS))],
+)
+async def export_transactions(
+    request: Request,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
     user_id: Optional[int] = None,
+    settings: Settigns = Depends(get_app_settings),
+) -> NDJSONStreamingResponse:
+    """
+    Transactions created in the range as newline delimited JSON, archived transactions included.
+    Streamed from a read session of its own, opened when the body is sent.
+    """
+
+    async def batches() -> AsyncIterator[list[TransactionModel]]:
+        async with read_session(request) as session:
+            async for batch in TransactionsService(settings).export_transactions(
+                session=session,
+                created_from=to_naive_utc(created_from) if created_from else None,
+                created_to=to_naive_utc(created_to) if created_to else None,
+                user_id=user_id,
+            ):
+                yield batch
+
+    return NDJSONStreamingResponse(batches())
+
+
+@router.post(
+    "/import",
+    response_model=TransactionImportResultModel,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.ANALYTICS))],
+)
+async def import_transactions(
+    request: Request,
+    key: str = Query(min_length=1, max_length=255),
+    file_format: TransactionImportFormatEnum = Query(TransactionImportFormatEnum.CSV, alias="format"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, gt=0, le=100_000),
     session: AsyncSession = Depends(get_async_session),
-) -> Sequence[TransactionModel]:
-    return await TransactionsService().get_user_transactions(
+) -> TransactionImportResultModel:
+    """
+    Bulk import of the CSV or NDJSON request body, read as a stream. Sending the same `key` again
+    resumes an interrupted import after its last committed chunk.
+    """
+    return await TransactionImportService().import_transactions(
+        session=session,
+        key=key,
+        lines=iter_lines(request.stream()),
+        file_format=file_format,
+        chunk_size=chunk_size,
+    )
+
+
+@router.get(
+    "/summary",
+    response_model=list[TransactionSummaryModel],
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
+)
+async def get_transactions_summary(
+    user_id: int = Depends(validate_positive_id),
+    session: AsyncSession = Depends(get_read_async_session),
+    settings: Settigns = Depends(get_app_settings),
+) -> list[TransactionSummaryModel]:
+    return await TransactionsService(settings).get_user_transactions_summary(
         session=session,
         user_id=user_id,
     )
@@ -32,13 +141,16 @@ async def get_transactions(
     "/{user_id}",
     response_model=Optional[TransactionModel],
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.WRITE))],
 )
 async def post_transaction(
     transaction: RequestTransactionModel,
     user_id: int = Depends(validate_positive_id),
     session: AsyncSession = Depends(get_async_session),
+    settings: Settigns = Depends(get_app_settings),
+    hub: PubSubHub = Depends(get_pubsub),
 ) -> TransactionModel:
-    return await TransactionsService().create_user_transaction(
+    return await TransactionsService(settings, hub).create_user_transaction(
         session=session,
         transaction=transaction,
         user_id=user_id,
@@ -49,19 +161,31 @@ async def post_transaction(
     "/{transaction_id}/user/{user_id}/rollback",
     response_model=Optional[TransactionModel],
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.WRITE))],
 )
 async def patch_rollback_transaction(
     user_id: int,
     transaction_id: int,
     session: AsyncSession = Depends(get_async_session),
+    settings: Settigns = Depends(get_app_settings),
+    hub: PubSubHub = Depends(get_pubsub),
 ) -> TransactionModel:
-    return await TransactionsService().rollback(
+    """
+    Transactions older than `TRANSACTION_ARCHIVE_HORIZON_DAYS` are archived by `archive-transactions`,
+    their rollback fails with 400 (`TransactionArchivedException`).
+    """
+    return await TransactionsService(settings, hub).rollback(
         session=session,
         transaction_id=transaction_id,
         user_id=user_id,
     )
 
 
-@router.get("/analysis", response_model=Optional[list[dict[str, Any]]] | None, status_code=status.HTTP_200_OK)
-async def get_transaction_analysis(session: AsyncSession = Depends(get_async_session)) -> list[dict[str, Any]]:
+@router.get(
+    "/analysis",
+    response_model=Optional[list[dict[str, Any]]] | None,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.ANALYTICS))],
+)
+async def get_transaction_analysis(session: AsyncSession = Depends(get_read_async_session)) -> list[dict[str, Any]]:
     return await AnalyticsService().generate_weekly_reports(session)
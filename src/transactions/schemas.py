@@ -1,11 +1,14 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Literal, Optional
 
 from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from src.exceptions import BadRequestDataException
-from src.transactions.enums import TransactionStatusEnum
+from src.transactions.enums import TransactionImportStatusEnum, TransactionStatusEnum
 from src.users.enums import CurrencyEnum
+from src.users.schemas import ResponseUserBalanceModel
+from src.utils.utils import to_naive_utc
 
 
 class RequestTransactionModel(BaseModel):
@@ -29,3 +32,57 @@ class TransactionModel(BaseModel):
     created: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class BalanceChangeEventModel(BaseModel):
+    """Published to the balance stream of the user after a transaction or a rollback is committed."""
+
+    type: Literal["transaction", "rollback"]
+    transaction: TransactionModel
+    balance: ResponseUserBalanceModel
+
+
+class TransactionSummaryModel(BaseModel):
+    currency: CurrencyEnum
+    transactions_count: int
+    deposits_count: int
+    deposits_amount: float
+    withdrawals_count: int
+    withdrawals_amount: float
+    rollbacks_count: int
+    rollbacks_amount: float
+    first_transaction: datetime
+    last_transaction: datetime
+
+
+class ImportTransactionModel(BaseModel):
+    """A row of a bulk import file. Transactions with `rollbacked` set are imported as rollbacked."""
+
+    user_id: int = Field(gt=0)
+    currency: CurrencyEnum
+    amount: Decimal = Field(max_digits=12, decimal_places=2)
+    created: datetime
+    rollbacked: Optional[datetime] = None
+
+    @field_validator("amount")
+    @classmethod
+    def amount_not_zero(cls, v: Decimal) -> Decimal:
+        if v == 0:
+            raise ValueError("Transaction can not have zero amount")
+        return v
+
+    @field_validator("created", "rollbacked")
+    @classmethod
+    def naive_utc(cls, v: Optional[datetime]) -> Optional[datetime]:
+        return to_naive_utc(v) if v is not None else None
+
+
+class TransactionImportResultModel(BaseModel):
+    key: str
+    status: TransactionImportStatusEnum
+    rows_imported: int
+    # rows of chunks committed by a previous run of the import
+    rows_skipped: int
+    balances_updated: int
+    seconds: float
+    rows_per_sec: float
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, FromClause, delete, func, insert, literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.monitoring.tracing import traced
+from src.transactions.models import Transaction, TransactionArchive
+from src.utils.utils import utc_now
+
+
+DEFAULT_BATCH_SIZE = 1000
+COLUMNS = ("id", "user_id", "currency", "amount", "status", "created", "rollbacked")
+
+
+def transaction_rows(include_archive: bool) -> FromClause:
+    """
+    `transaction`, or `transaction` and `transaction_archive` combined when `include_archive` is set.
+    Both have the `COLUMNS` columns, queries select them with `.c`.
+    """
+    if not include_archive:
+        return Transaction.__table__
+    return union_all(
+        select(*(Transaction.__table__.c[name] for name in COLUMNS)),
+        select(*(TransactionArchive.__table__.c[name] for name in COLUMNS)),
+    ).subquery("transaction_rows")
+
+
+class TransactionArchiveService:
+    """
+    Moves transactions older than the archive horizon from `transaction` to the append-only
+    `transaction_archive`, so the hot table (and its indexes) only holds the recent months.
+    """
+
+    @traced()
+    async def archive_transactions(
+        self,
+        session: AsyncSession,
+        horizon_days: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        now: Optional[datetime] = None,
+    ) -> int:
+        """
+        Archive transactions created more than `horizon_days` ago, in batches, each batch in its own DB transaction.
+        Rows locked by a rollback in progress are skipped and left for the next run.
+        Returns the number of archived transactions.
+        """
+        cutoff = (now or utc_now()) - timedelta(days=horizon_days)
+        archived = 0
+        while True:
+            async with session.begin():
+                ids = list(
+                    await session.scalars(
+                        select(Transaction.id)
+                        .where(Transaction.created < cutoff)
+                        .order_by(Transaction.id)
+                        .limit(batch_size)
+                        .with_for_update(skip_locked=True)
+                    )
+                )
+                if not ids:
+                    return archived
+
+                # `created < cutoff` is repeated so Postgres only touches the old partitions
+                in_batch = (Transaction.id.in_(ids), Transaction.created < cutoff)
+                await session.execute(
+                    insert(TransactionArchive).from_select(
+                        [*COLUMNS, "archived"],
+                        select(*(getattr(Transaction, name) for name in COLUMNS), literal(utc_now(), DateTime)).where(
+                            *in_batch
+                        ),
+                    )
+                )
+                await session.execute(delete(Transaction).where(*in_batch).execution_options(synchronize_session=False))
+            archived += len(ids)
+
+    async def archived_until(self, session: AsyncSession) -> Optional[datetime]:
+        """
+        Latest creation or rollback time of an archived transaction, None while the archive is empty.
+        Queries about transactions created and rollbacked after it do not need the archive.
+        Both maximums are read from indexes.
+        """
+        row = (
+            await session.execute(select(func.max(TransactionArchive.created), func.max(TransactionArchive.rollbacked)))
+        ).one()
+        created: Optional[datetime] = row[0]
+        rollbacked: Optional[datetime] = row[1]
+        if created is None:
+            return None
+        return max(created, rollbacked) if rollbacked is not None else created
+
+    async def transaction_rows_from(self, session: AsyncSession, created_from: Optional[datetime]) -> FromClause:
+        """
+        `transaction_rows` for queries about transactions created from `created_from` (all of them when None),
+        with the archive only when the range starts before the archive ends.
+        """
+        archived_until = await self.archived_until(session)
+        return transaction_rows(archived_until is not None and (created_from is None or created_from <= archived_until))
+
+    async def is_archived(self, session: AsyncSession, transaction_id: int) -> bool:
+        return await session.get(TransactionArchive, transaction_id) is not None
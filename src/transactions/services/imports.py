@@ -0,0 +1,318 @@
+import csv
+import json
+import time
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from typing import Any, BinaryIO
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import DateTime, case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.monitoring.tracing import traced
+from src.transactions.enums import (
+    TransactionImportFormatEnum,
+    TransactionImportStatusEnum,
+    TransactionStatusEnum,
+)
+from src.transactions.exceptions import TransactionImportRowException
+from src.transactions.models import Transaction, TransactionImport
+from src.transactions.schemas import ImportTransactionModel, TransactionImportResultModel
+from src.transactions.services.archive import transaction_rows
+from src.users.exceptions import UserNotExistsException
+from src.users.models import BalanceLedgerEntry, User, UserBalance, UserBalanceSnapshot
+from src.users.services.portfolio import PortfolioService
+from src.utils.utils import utc_now
+
+
+DEFAULT_CHUNK_SIZE = 10_000
+# bound parameters of the `IN (...)` lists used for the affected users
+USERS_BATCH_SIZE = 5000
+COPY_COLUMNS = ("user_id", "currency", "amount", "status", "created", "rollbacked")
+
+_rows_adapter = TypeAdapter(list[ImportTransactionModel])
+
+
+async def iter_file(file: BinaryIO, size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    while chunk := file.read(size):
+        yield chunk
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Decoded lines of a byte stream, without line endings."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode()
+    if pending:
+        yield pending.rstrip(b"\r").decode()
+
+
+async def iter_records(
+    lines: AsyncIterable[str], file_format: TransactionImportFormatEnum
+) -> AsyncIterator[tuple[int, dict[str, Any]]]:
+    """
+    (line number, raw record) of every not empty line. CSV files start with a header line, a quoted CSV value
+    can span several lines, its record has the number of its first line.
+    """
+    header = None
+    line_number = 0
+    # lines of the current CSV record, read by a single reader once all their quoted values are closed
+    record_lines: deque[str] = deque()
+    record_line_number = 0
+    quotes = 0
+    reader = csv.reader(iter(record_lines.popleft, None))
+    async for line in lines:
+        line_number += 1
+        if not record_lines and not line.strip():
+            continue
+        if file_format == TransactionImportFormatEnum.NDJSON:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise TransactionImportRowException(line_number, f"invalid JSON: {exc}") from exc
+            if not isinstance(record, dict):
+                raise TransactionImportRowException(line_number, "a JSON object is expected")
+            yield line_number, record
+            continue
+
+        if not record_lines:
+            record_line_number = line_number
+        record_lines.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        quotes = 0
+        values = next(reader)
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            raise TransactionImportRowException(record_line_number, f"{len(header)} values expected, got {len(values)}")
+        # empty CSV values are missing values
+        yield record_line_number, {name: value for name, value in zip(header, values) if value != ""}
+    if record_lines:
+        raise TransactionImportRowException(record_line_number, "unclosed quoted value")
+
+
+class TransactionImportService:
+    """
+    Bulk import of historical transactions. Rows are validated and inserted in chunks, every chunk
+    is committed together with the import progress, so an interrupted import resumes after its last chunk.
+    Balances of the imported users are recomputed from all their transactions once every chunk is in.
+    """
+
+    def __init__(self) -> None:
+        self.portfolio_service = PortfolioService()
+
+    @traced()
+    async def import_transactions(
+        self,
+        session: AsyncSession,
+        key: str,
+        lines: AsyncIterable[str],
+        file_format: TransactionImportFormatEnum,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> TransactionImportResultModel:
+        started = time.perf_counter()
+        async with session.begin():
+            progress = await session.scalar(select(TransactionImport).where(TransactionImport.key == key))
+            if progress is None:
+                progress = TransactionImport(key=key, status=TransactionImportStatusEnum.RUNNING, chunk_size=chunk_size)
+                session.add(progress)
+                await session.flush()
+            progress_id = progress.id
+            status = progress.status
+            chunk_size = progress.chunk_size
+            chunks_done = progress.chunks_done
+            rows_done = progress.rows_imported
+        if status == TransactionImportStatusEnum.DONE:
+            return TransactionImportResultModel(
+                key=key,
+                status=status,
+                rows_imported=0,
+                rows_skipped=rows_done,
+                balances_updated=0,
+                seconds=0,
+                rows_per_sec=0,
+            )
+
+        user_ids: set[int] = set()
+        rows_imported = 0
+        rows_skipped = 0
+        chunk_index = 0
+        chunk: list[tuple[int, dict[str, Any]]] = []
+
+        async def flush_chunk() -> None:
+            nonlocal chunk_index, rows_imported, rows_skipped
+            if chunk_index < chunks_done:
+                # committed by a previous run, only its users are needed for the balance update
+                user_ids.update(int(record["user_id"]) for _, record in chunk)
+                rows_skipped += len(chunk)
+            else:
+                user_ids.update(await self._import_chunk(session, progress_id, chunk_index, chunk))
+                rows_imported += len(chunk)
+            chunk_index += 1
+            chunk.clear()
+
+        async for line_number, record in iter_records(lines, file_format):
+            chunk.append((line_number, record))
+            if len(chunk) == chunk_size:
+                await flush_chunk()
+        if chunk:
+            await flush_chunk()
+
+        balances_updated = await self._recompute_balances(session, progress_id, sorted(user_ids))
+        seconds = time.perf_counter() - started
+        return TransactionImportResultModel(
+            key=key,
+            status=TransactionImportStatusEnum.DONE,
+            rows_imported=rows_imported,
+            rows_skipped=rows_skipped,
+            balances_updated=balances_updated,
+            seconds=round(seconds, 3),
+            rows_per_sec=round(rows_imported / seconds, 1) if seconds else 0.0,
+        )
+
+    async def _import_chunk(
+        self, session: AsyncSession, progress_id: int, chunk_index: int, chunk: list[tuple[int, dict[str, Any]]]
+    ) -> set[int]:
+        """Validate and insert the chunk rows, returns the ids of their users."""
+        try:
+            models = _rows_adapter.validate_python([record for _, record in chunk])
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            index, *field = error["loc"]
+            raise TransactionImportRowException(
+                chunk[int(index)][0], f"{'.'.join(map(str, field))}: {error['msg']}"
+            ) from exc
+
+        user_ids = {model.user_id for model in models}
+        rows = [
+            {
+                "user_id": model.user_id,
+                "currency": model.currency.value,
+                "amount": model.amount,
+                "status": TransactionStatusEnum.ROLL_BACKED if model.rollbacked else TransactionStatusEnum.PROCESSED,
+                "created": model.created,
+                "rollbacked": model.rollbacked,
+            }
+            for model in models
+        ]
+        async with session.begin():
+            existing = set(await session.scalars(select(User.id).where(User.id.in_(user_ids))))
+            if missing := user_ids - existing:
+                raise UserNotExistsException(min(missing))
+            await self._insert_rows(session, rows)
+            await session.execute(
+                update(TransactionImport)
+                .where(TransactionImport.id == progress_id)
+                .values(
+                    chunks_done=chunk_index + 1,
+                    rows_imported=TransactionImport.rows_imported + len(rows),
+                    updated=utc_now(),
+                )
+            )
+        return user_ids
+
+    async def _insert_rows(self, session: AsyncSession, rows: list[dict[str, Any]]) -> None:
+        if session.get_bind().dialect.name != "postgresql":
+            # a single executemany
+            await session.execute(insert(Transaction), rows)
+            return
+        # COPY through the asyncpg connection of the session. The DB transaction was already started
+        # by the users check, so the copied rows are committed with the import progress.
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection: Any = raw_connection.driver_connection
+        await driver_connection.copy_records_to_table(
+            "transaction",
+            columns=COPY_COLUMNS,
+            records=[
+                (row["user_id"], row["currency"], row["amount"], row["status"].name, row["created"], row["rollbacked"])
+                for row in rows
+            ],
+        )
+
+    async def _recompute_balances(self, session: AsyncSession, progress_id: int, user_ids: Iterable[int]) -> int:
+        """
+        Set the balances of the users to the sum of their not rollbacked transactions, archived ones included,
+        with one UPDATE per batch of users. Replaces the balance snapshots of the users, which do not include
+        the imported transactions, drops their pending ledger entries, which the sum already includes,
+        and refreshes their portfolios. Returns the number of updated balances.
+        """
+        transactions = transaction_rows(include_archive=True)
+        of_balance = (
+            transactions.c.user_id == UserBalance.user_id,
+            transactions.c.currency == UserBalance.currency,
+        )
+        not_rollbacked = or_(
+            transactions.c.status.is_(None), transactions.c.status != TransactionStatusEnum.ROLL_BACKED
+        )
+        amount = (
+            select(func.coalesce(func.sum(transactions.c.amount), 0))
+            .where(*of_balance, not_rollbacked)
+            .scalar_subquery()
+        )
+        # balances-at-time queries treat a balance as missing before it was created
+        first_created = select(func.min(transactions.c.created)).where(*of_balance).scalar_subquery()
+
+        user_ids = list(user_ids)
+        updated = 0
+        async with session.begin():
+            now = utc_now()
+            for start in range(0, len(user_ids), USERS_BATCH_SIZE):
+                batch = user_ids[start : start + USERS_BATCH_SIZE]
+                # the ledger entries, then the balances, both in id order: the order of the ledger compactor, which
+                # waits for the batch instead of deadlocking with the entries DELETE below
+                await session.execute(
+                    select(BalanceLedgerEntry.id)
+                    .where(BalanceLedgerEntry.user_id.in_(batch))
+                    .order_by(BalanceLedgerEntry.id)
+                    .with_for_update()
+                )
+                # like the balance snapshots, so concurrent balance writers wait for the batch
+                # instead of deadlocking with the UPDATE
+                await session.execute(
+                    select(UserBalance.id)
+                    .where(UserBalance.user_id.in_(batch))
+                    .order_by(UserBalance.id)
+                    .with_for_update()
+                )
+                updated_ids = await session.scalars(
+                    update(UserBalance)
+                    .where(UserBalance.user_id.in_(batch))
+                    .values(
+                        amount=amount,
+                        created=case((first_created < UserBalance.created, first_created), else_=UserBalance.created),
+                        transactions_since_snapshot=0,
+                    )
+                    .returning(UserBalance.id)
+                    .execution_options(synchronize_session=False)
+                )
+                updated += len(updated_ids.all())
+                await session.execute(delete(BalanceLedgerEntry).where(BalanceLedgerEntry.user_id.in_(batch)))
+                await session.execute(delete(UserBalanceSnapshot).where(UserBalanceSnapshot.user_id.in_(batch)))
+                await session.execute(
+                    insert(UserBalanceSnapshot).from_select(
+                        ["user_id", "currency", "amount", "created"],
+                        select(
+                            UserBalance.user_id, UserBalance.currency, UserBalance.amount, literal(now, DateTime)
+                        ).where(UserBalance.user_id.in_(batch)),
+                    )
+                )
+                await session.execute(
+                    update(User)
+                    .where(User.id.in_(batch))
+                    .values(version=User.version + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                await self.portfolio_service.refresh_portfolios(session, batch)
+            await session.execute(
+                update(TransactionImport)
+                .where(TransactionImport.id == progress_id)
+                .values(status=TransactionImportStatusEnum.DONE, updated=now)
+            )
+        return updated
@@ -0,0 +1,97 @@
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.utils.utils import utc_now
+
+
+DEFAULT_MONTHS_AHEAD = 3
+DEFAULT_PARTITION = "transaction_default"
+
+
+def month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transaction_y{month.year:04d}m{month.month:02d}"
+
+
+def monthly_partitions(first_month: date, last_month: date) -> list[tuple[str, date, date]]:
+    """Name and `[from, to)` range of every monthly partition between the two months, inclusive."""
+    partitions = []
+    month = month_start(first_month)
+    while month <= month_start(last_month):
+        next_month = add_months(month, 1)
+        partitions.append((partition_name(month), month, next_month))
+        month = next_month
+    return partitions
+
+
+class TransactionPartitionsService:
+    """
+    Maintenance of the monthly partitions of `transaction` on Postgres (see the `transaction_partitioning`
+    migration). Other databases keep `transaction` as a single table and are left as they are.
+    """
+
+    async def is_partitioned(self, session: AsyncSession) -> bool:
+        if session.get_bind().dialect.name != "postgresql":
+            return False
+        result = await session.scalar(
+            text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('transaction'))")
+        )
+        return bool(result)
+
+    async def create_future_partitions(
+        self, session: AsyncSession, months_ahead: int = DEFAULT_MONTHS_AHEAD, now: Optional[datetime] = None
+    ) -> list[str]:
+        """
+        Create the partitions of the current month and of `months_ahead` next months if they do not exist,
+        so new transactions never land in the default partition. Returns the names of the created partitions.
+        """
+        current_month = month_start((now or utc_now()).date())
+        async with session.begin():
+            if not await self.is_partitioned(session):
+                return []
+            existing = set(
+                await session.scalars(
+                    text(
+                        "SELECT child.relname FROM pg_inherits "
+                        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                        "WHERE pg_inherits.inhparent = to_regclass('transaction')"
+                    )
+                )
+            )
+            created = []
+            for name, range_from, range_to in monthly_partitions(
+                current_month, add_months(current_month, months_ahead)
+            ):
+                if name in existing:
+                    continue
+                # identifiers and bounds are generated from dates, nothing user provided is interpolated.
+                # Rows that already landed in the default partition are moved, attaching would fail otherwise.
+                in_range = f"created >= '{range_from.isoformat()}' AND created < '{range_to.isoformat()}'"
+                await session.execute(
+                    text(f'CREATE TABLE "{name}" (LIKE "transaction" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                )
+                await session.execute(
+                    text(
+                        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE {in_range} RETURNING *) '
+                        f'INSERT INTO "{name}" SELECT * FROM moved'
+                    )
+                )
+                await session.execute(
+                    text(
+                        f'ALTER TABLE "transaction" ATTACH PARTITION "{name}" '
+                        f"FOR VALUES FROM ('{range_from.isoformat()}') TO ('{range_to.isoformat()}')"
+                    )
+                )
+                created.append(name)
+        return created
@@ -1,58 +1,277 @@
+from collections.abc import AsyncIterator
+from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Any, Literal, Optional
 
-from sqlalchemy import desc, select
+from fastapi import HTTPException
+from sqlalchemy import FromClause, Select, bindparam, case, desc, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import Settigns
+from src.monitoring.metrics import TRANSACTION_OPERATIONS, count_outcomes
+from src.monitoring.tracing import trace_span, traced
 from src.transactions.enums import TransactionStatusEnum
 from src.transactions.exceptions import (
     NotEnoughBalanceException,
     TransactionAlreadyRollbackedException,
+    TransactionArchivedException,
     TransactionDoesNotBelongToUserException,
     TransactionNotExistsException,
 )
 from src.transactions.models import Transaction
-from src.transactions.schemas import RequestTransactionModel, TransactionModel
+from src.transactions.schemas import (
+    BalanceChangeEventModel,
+    RequestTransactionModel,
+    TransactionModel,
+    TransactionSummaryModel,
+)
+from src.transactions.services.archive import TransactionArchiveService
+from src.users.enums import CurrencyEnum
 from src.users.exceptions import UserBalanceDoesNotExists
-from src.users.models import UserBalance
+from src.users.models import User, UserBalance
+from src.users.schemas import ResponseUserBalanceModel
+from src.users.services.balance_ledger import BalanceLedgerService
+from src.users.services.balance_snapshots import BalanceSnapshotService
+from src.users.services.balance_stream import balance_topic
+from src.users.services.portfolio import PortfolioService
 from src.users.services.users import UsersService
+from src.utils.pubsub import PubSubHub
 from src.utils.utils import utc_now
 
 
+# rows fetched from the DB and written to the response at a time by `export_transactions`
+EXPORT_BATCH_SIZE = 1000
+
+# hot statements are built once, like `ACTIVE_USER_QUERY` of the users service
+BALANCE_LOCK_QUERY = (
+    select(UserBalance)
+    .where(UserBalance.user_id == bindparam("user_id"), UserBalance.currency == bindparam("currency"))
+    .with_for_update()
+)
+# `id` is not unique across the partitions of `transaction` (its primary key is `(id, created)`), `created`
+# is resolved once by this unlocked lookup, so the locking and the UPDATE of a rollback touch its partition only
+TRANSACTION_CREATED_QUERY = select(Transaction.created).where(
+    (Transaction.user_id == bindparam("user_id")) & (Transaction.id == bindparam("transaction_id"))
+)
+ROLLBACK_QUERY = (
+    select(Transaction, UserBalance)
+    .join(UserBalance, (UserBalance.user_id == Transaction.user_id) & (UserBalance.currency == Transaction.currency))
+    .where(
+        (Transaction.user_id == bindparam("user_id"))
+        & (Transaction.id == bindparam("transaction_id"))
+        & (Transaction.created == bindparam("created"))
+    )
+    .with_for_update(of=(Transaction, UserBalance))
+)
+LEDGER_ROLLBACK_QUERY = (
+    select(Transaction)
+    .where(
+        (Transaction.user_id == bindparam("user_id"))
+        & (Transaction.id == bindparam("transaction_id"))
+        & (Transaction.created == bindparam("created"))
+    )
+    .with_for_update()
+)
+
+
 class TransactionsService:
-    def __init__(self) -> None:
+    def __init__(self, settings: Settigns, hub: Optional[PubSubHub] = None) -> None:
+        """Balance changes are published to the balance stream of the user through `hub` when it is given."""
+        self.hub = hub
+        self.balance_mode = settings.BALANCE_MODE
+        self.ledger_service = BalanceLedgerService()
         self.users_service = UsersService()
+        self.portfolio_service = PortfolioService()
+        self.archive_service = TransactionArchiveService()
+        self.snapshot_service = BalanceSnapshotService(settings.BALANCE_SNAPSHOT_INTERVAL)
 
+    @traced()
     async def get_user_transactions(
         self,
         session: AsyncSession,
         user_id: Optional[int] = None,
         skip: int = 0,
         limit: int = 50,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
     ) -> list[TransactionModel]:
-        query = select(Transaction).order_by(desc(Transaction.created)).offset(skip).limit(limit)
-        if user_id:
-            query = query.where(Transaction.user_id == user_id)
+        """
+        Latest transactions, newest first. `created_from`/`created_to` (inclusive/exclusive) bound `created`,
+        which lets Postgres skip the monthly partitions outside of the range. Archived transactions are
+        included when the range starts before the archive ends.
+        """
+        transactions = await self.archive_service.transaction_rows_from(session, created_from)
+        query = self._transactions_window(
+            transactions, user_id, skip, limit, created_from, created_to
+        ).with_only_columns(
+            transactions.c.id,
+            transactions.c.user_id,
+            transactions.c.currency,
+            transactions.c.amount,
+            transactions.c.status,
+            transactions.c.created,
+        )
         result = await session.execute(query)
-        return [TransactionModel.model_validate(transaction) for transaction in result.scalars().all()]
+        # rows come from our own DB, so the models are constructed without validation
+        return [
+            TransactionModel.model_construct(
+                id=row_id,
+                user_id=row_user_id,
+                currency=CurrencyEnum(currency),
+                amount=float(amount),
+                status=row_status,
+                created=created,
+            )
+            for row_id, row_user_id, currency, amount, row_status, created in result.tuples()
+        ]
 
+    @traced()
+    async def get_user_transactions_version(
+        self,
+        session: AsyncSession,
+        user_id: Optional[int] = None,
+        skip: int = 0,
+        limit: int = 50,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ) -> tuple[Any, ...]:
+        """
+        Cheap version of what `get_user_transactions` returns for the same arguments: the count, max id
+        and latest rollback time of the transactions in the window, read without serializing them.
+        """
+        transactions = await self.archive_service.transaction_rows_from(session, created_from)
+        window = self._transactions_window(transactions, user_id, skip, limit, created_from, created_to).subquery()
+        result = await session.execute(select(func.count(), func.max(window.c.id), func.max(window.c.rollbacked)))
+        return tuple(result.one())
+
+    @staticmethod
+    def _transactions_window(
+        transactions: FromClause,
+        user_id: Optional[int],
+        skip: int,
+        limit: int,
+        created_from: Optional[datetime],
+        created_to: Optional[datetime],
+    ) -> Select[tuple[int, Optional[datetime]]]:
+        query = (
+            select(transactions.c.id, transactions.c.rollbacked)
+            .order_by(desc(transactions.c.created))
+            .offset(skip)
+            .limit(limit)
+        )
+        if user_id:
+            query = query.where(transactions.c.user_id == user_id)
+        if created_from is not None:
+            query = query.where(transactions.c.created >= created_from)
+        if created_to is not None:
+            query = query.where(transactions.c.created < created_to)
+        return query
+
+    async def export_transactions(
+        self,
+        session: AsyncSession,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        user_id: Optional[int] = None,
+    ) -> AsyncIterator[list[TransactionModel]]:
+        """
+        Transactions created in `[created_from, created_to)`, oldest first, streamed from the DB
+        in batches of `EXPORT_BATCH_SIZE`. Archived transactions are included when the range starts
+        before the archive ends.
+        """
+        transactions = await self.archive_service.transaction_rows_from(session, created_from)
+        query = select(
+            transactions.c.id,
+            transactions.c.user_id,
+            transactions.c.currency,
+            transactions.c.amount,
+            transactions.c.status,
+            transactions.c.created,
+        ).order_by(transactions.c.created, transactions.c.id)
+        if user_id is not None:
+            query = query.where(transactions.c.user_id == user_id)
+        if created_from is not None:
+            query = query.where(transactions.c.created >= created_from)
+        if created_to is not None:
+            query = query.where(transactions.c.created < created_to)
+        result = await session.stream(query)
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            yield [
+                TransactionModel.model_construct(
+                    id=row_id,
+                    user_id=row_user_id,
+                    currency=CurrencyEnum(currency),
+                    amount=float(amount),
+                    status=row_status,
+                    created=created,
+                )
+                for row_id, row_user_id, currency, amount, row_status, created in rows
+            ]
+
+    @traced()
+    async def get_user_transactions_summary(
+        self,
+        session: AsyncSession,
+        user_id: int,
+    ) -> list[TransactionSummaryModel]:
+        """
+        Per-currency totals of user transactions computed with one grouped query.
+        Deposits and withdrawals exclude rollbacked transactions, withdrawals are reported as positive amounts
+        and `rollbacks_amount` is the signed sum of rollbacked transactions. Archived transactions are included.
+        """
+        transactions = await self.archive_service.transaction_rows_from(session, None)
+        is_rollbacked = transactions.c.status == TransactionStatusEnum.ROLL_BACKED
+        is_deposit = (transactions.c.amount > 0) & ~is_rollbacked
+        is_withdrawal = (transactions.c.amount < 0) & ~is_rollbacked
+
+        result = await session.execute(
+            select(
+                transactions.c.currency,
+                func.count().label("transactions_count"),
+                func.count().filter(is_deposit).label("deposits_count"),
+                func.coalesce(func.sum(case((is_deposit, transactions.c.amount))), 0).label("deposits_amount"),
+                func.count().filter(is_withdrawal).label("withdrawals_count"),
+                func.coalesce(func.sum(case((is_withdrawal, -transactions.c.amount))), 0).label("withdrawals_amount"),
+                func.count().filter(is_rollbacked).label("rollbacks_count"),
+                func.coalesce(func.sum(case((is_rollbacked, transactions.c.amount))), 0).label("rollbacks_amount"),
+                func.min(transactions.c.created).label("first_transaction"),
+                func.max(transactions.c.created).label("last_transaction"),
+            )
+            .where(transactions.c.user_id == user_id)
+            .group_by(transactions.c.currency)
+            .order_by(transactions.c.currency)
+        )
+        return [
+            TransactionSummaryModel(
+                currency=CurrencyEnum(row.currency),
+                transactions_count=row.transactions_count,
+                deposits_count=row.deposits_count,
+                deposits_amount=float(row.deposits_amount),
+                withdrawals_count=row.withdrawals_count,
+                withdrawals_amount=float(row.withdrawals_amount),
+                rollbacks_count=row.rollbacks_count,
+                rollbacks_amount=float(row.rollbacks_amount),
+                first_transaction=row.first_transaction,
+                last_transaction=row.last_transaction,
+            )
+            for row in result
+        ]
+
+    @traced()
+    @count_outcomes(TRANSACTION_OPERATIONS, "create")
     async def create_user_transaction(
         self,
         session: AsyncSession,
         transaction: RequestTransactionModel,
         user_id: int,
     ) -> TransactionModel:
+        if self.balance_mode == "ledger":
+            return await self._create_ledger_transaction(session, transaction, user_id)
+
         async with session.begin():
             user = await self.users_service.get_active_user(session, user_id)
 
-            balance = await session.scalar(
-                select(UserBalance)
-                .where(
-                    UserBalance.user_id == user.id,
-                    UserBalance.currency == transaction.currency,
-                )
-                .with_for_update()
-            )
+            balance = await session.scalar(BALANCE_LOCK_QUERY, {"user_id": user.id, "currency": transaction.currency})
 
             if not balance:
                 raise UserBalanceDoesNotExists(user_id)
@@ -61,6 +280,7 @@ class TransactionsService:
             if new_amount < 0:
                 raise NotEnoughBalanceException()
             balance.amount = new_amount
+            user.version = User.version + 1
 
             new_transaction = Transaction(
                 user_id=user_id,
@@ -70,49 +290,160 @@ class TransactionsService:
                 created=utc_now(),
             )
             session.add(new_transaction)
+            self.snapshot_service.register_balance_change(session, balance)
 
-            await session.flush()
-            return TransactionModel.model_validate(new_transaction)
+            with trace_span("session.flush"):
+                await session.flush()
+            await self.portfolio_service.refresh_portfolios(session, [user_id])
+            created_transaction = TransactionModel.model_validate(new_transaction)
+            balance_amount = balance.amount
+
+        self._publish_balance_change("transaction", created_transaction, balance_amount)
+        return created_transaction
+
+    async def _create_ledger_transaction(
+        self, session: AsyncSession, transaction: RequestTransactionModel, user_id: int
+    ) -> TransactionModel:
+        """
+        `create_user_transaction` of the `ledger` balance mode: the change is appended to the ledger, deposits
+        lock nothing. Withdrawals lock the balance for the overdraft check of its amount plus pending changes.
+        The user version and portfolio are updated by the compactor, updating them here would lock the user.
+        """
+        amount = Decimal(str(transaction.amount))
+        async with session.begin():
+            user = await self.users_service.get_active_user(session, user_id)
+            balance_amount = await self.ledger_service.get_amount(
+                session, user.id, transaction.currency, lock=amount < 0
+            )
+            balance_amount += amount
+            if balance_amount < 0:
+                raise NotEnoughBalanceException()
 
+            new_transaction = Transaction(
+                user_id=user_id,
+                currency=transaction.currency,
+                amount=transaction.amount,
+                status=TransactionStatusEnum.PROCESSED,
+                created=utc_now(),
+            )
+            session.add(new_transaction)
+            with trace_span("session.flush"):
+                await session.flush()
+            self.ledger_service.append(session, user_id, transaction.currency, amount, new_transaction.id)
+            created_transaction = TransactionModel.model_validate(new_transaction)
+
+        await self._publish_ledger_change(session, "transaction", created_transaction)
+        return created_transaction
+
+    @traced()
+    @count_outcomes(TRANSACTION_OPERATIONS, "rollback")
     async def rollback(
         self,
         session: AsyncSession,
         user_id: int,
         transaction_id: int,
     ) -> TransactionModel:
-        user = await self.users_service.get_active_user(session, user_id)
+        if self.balance_mode == "ledger":
+            return await self._rollback_ledger_transaction(session, user_id, transaction_id)
 
-        result = await session.execute(
-            select(Transaction, UserBalance)
-            .join(UserBalance, (UserBalance.user_id == user.id) & (UserBalance.currency == Transaction.currency))
-            .where((Transaction.user_id == user.id) & (Transaction.id == transaction_id))
-            .with_for_update(of=(Transaction, UserBalance))
-        )
+        user = await self.users_service.get_active_user(session, user_id)
 
-        row = result.first()
+        params = await self._rollback_params(session, user.id, transaction_id)
+        row = (await session.execute(ROLLBACK_QUERY, params)).first()
         if not row:
-            transaction_exists = await session.get(Transaction, transaction_id)
-            if not transaction_exists:
-                raise TransactionNotExistsException(transaction_id)
-            raise TransactionDoesNotBelongToUserException(transaction_id, user_id)
+            raise await self._transaction_not_found(session, user_id, transaction_id)
 
         transaction, balance = row
 
         if transaction.status == TransactionStatusEnum.ROLL_BACKED:
             raise TransactionAlreadyRollbackedException(transaction_id)
 
-        current_amount = float(balance.amount)
-        transaction_amount = float(transaction.amount)
-
-        if transaction.amount < 0:
-            new_amount = current_amount + abs(transaction_amount)
-        else:
-            new_amount = current_amount - transaction_amount
-
-        balance.amount = new_amount
+        # reverting the transaction amount works for both deposits and withdrawals
+        balance.amount = balance.amount - transaction.amount
         transaction.status = TransactionStatusEnum.ROLL_BACKED
+        transaction.rollbacked = utc_now()
+        user.version = User.version + 1
+        self.snapshot_service.register_balance_change(session, balance)
 
+        with trace_span("session.flush"):
+            await session.flush()
+        await self.portfolio_service.refresh_portfolios(session, [user_id])
+        balance_amount = balance.amount
         await session.commit()
         await session.refresh(transaction)
 
-        return TransactionModel.model_validate(transaction)
+        rollbacked_transaction = TransactionModel.model_validate(transaction)
+        self._publish_balance_change("rollback", rollbacked_transaction, balance_amount)
+        return rollbacked_transaction
+
+    async def _rollback_ledger_transaction(
+        self, session: AsyncSession, user_id: int, transaction_id: int
+    ) -> TransactionModel:
+        """
+        `rollback` of the `ledger` balance mode: the reverted amount is appended to the ledger. Reverting
+        a deposit decreases the balance, so it locks the balance like a withdrawal does.
+        """
+        async with session.begin():
+            user = await self.users_service.get_active_user(session, user_id)
+            params = await self._rollback_params(session, user.id, transaction_id)
+            transaction = await session.scalar(LEDGER_ROLLBACK_QUERY, params)
+            if transaction is None:
+                raise await self._transaction_not_found(session, user_id, transaction_id)
+            if transaction.status == TransactionStatusEnum.ROLL_BACKED:
+                raise TransactionAlreadyRollbackedException(transaction_id)
+
+            amount = -transaction.amount
+            if amount < 0:
+                await self.ledger_service.get_amount(session, user.id, transaction.currency, lock=True)
+            transaction.status = TransactionStatusEnum.ROLL_BACKED
+            transaction.rollbacked = utc_now()
+            self.ledger_service.append(session, user_id, transaction.currency, amount, transaction.id)
+            with trace_span("session.flush"):
+                await session.flush()
+            rollbacked_transaction = TransactionModel.model_validate(transaction)
+
+        await self._publish_ledger_change(session, "rollback", rollbacked_transaction)
+        return rollbacked_transaction
+
+    async def _publish_ledger_change(
+        self, session: AsyncSession, change: Literal["transaction", "rollback"], transaction: TransactionModel
+    ) -> None:
+        """
+        `_publish_balance_change` of the `ledger` balance mode, with the amount read again after the commit.
+        The amount read before the commit misses the changes committed meanwhile, deposits lock nothing.
+        """
+        if self.hub is None:
+            return
+        async with session.begin():
+            balance_amount = await self.ledger_service.get_amount(session, transaction.user_id, transaction.currency)
+        self._publish_balance_change(change, transaction, balance_amount)
+
+    async def _rollback_params(self, session: AsyncSession, user_id: int, transaction_id: int) -> dict[str, Any]:
+        """Parameters of the rollback queries, `created` is None when the user has no such transaction."""
+        params: dict[str, Any] = {"user_id": user_id, "transaction_id": transaction_id}
+        params["created"] = await session.scalar(TRANSACTION_CREATED_QUERY, params)
+        return params
+
+    async def _transaction_not_found(self, session: AsyncSession, user_id: int, transaction_id: int) -> HTTPException:
+        """The error explaining why a transaction of the user was not found."""
+        transaction_exists = await session.scalar(select(Transaction.id).where(Transaction.id == transaction_id))
+        if transaction_exists is None:
+            if await self.archive_service.is_archived(session, transaction_id):
+                return TransactionArchivedException(transaction_id)
+            return TransactionNotExistsException(transaction_id)
+        return TransactionDoesNotBelongToUserException(transaction_id, user_id)
+
+    def _publish_balance_change(
+        self, change: Literal["transaction", "rollback"], transaction: TransactionModel, balance_amount: Decimal
+    ) -> None:
+        # called after the commit only, subscribers never see a change that could still be rolled back
+        if self.hub is None:
+            return
+        self.hub.publish(
+            balance_topic(transaction.user_id),
+            BalanceChangeEventModel(
+                type=change,
+                transaction=transaction,
+                balance=ResponseUserBalanceModel(currency=transaction.currency, amount=float(balance_amount)),
+            ),
+        )
@@ -17,3 +17,9 @@ class CurrencyEnum(StrEnum):
     ETH = "ETH"
     DOGE = "DOGE"
     USDT = "USDT"
+
+
+class UserStatusUpdateResultEnum(StrEnum):
+    CHANGED = "CHANGED"
+    ALREADY_IN_STATUS = "ALREADY_IN_STATUS"
+    NOT_FOUND = "NOT_FOUND"
@@ -41,6 +41,14 @@ class UserIsBlockedException(HTTPException):
         )
 
 
+class UsersFilterTooBroadException(HTTPException):
+    def __init__(self, limit: int) -> None:
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Filter matches more than {limit} users, at most {limit} can be updated at once",
+        )
+
+
 class UserBalanceDoesNotExists(HTTPException):
     def __init__(self, user_id: int) -> None:
         super().__init__(
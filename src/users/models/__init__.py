@@ -1,4 +1,8 @@
+from src.users.models.balance_ledger_entry import BalanceLedgerEntry
 from src.users.models.user import User
 from src.users.models.user_balance import UserBalance
+from src.users.models.user_balance_snapshot import UserBalanceSnapshot
+from src.users.models.user_portfolio import UserPortfolio
 
-__all__ = ["User", "UserBalance"]
+
+__all__ = ["BalanceLedgerEntry", "User", "UserBalance", "UserBalanceSnapshot", "UserPortfolio"]
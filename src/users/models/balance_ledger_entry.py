@@ -0,0 +1,29 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.utils.utils import utc_now
+
+
+class BalanceLedgerEntry(Base):
+    """
+    Change of the (user, currency) balance not folded into `UserBalance.amount` yet (`BALANCE_MODE=ledger`).
+
+    Written once per transaction or rollback, without locking the balance, and deleted by the compactor
+    when it adds the entry amount to the balance. The current balance is `UserBalance.amount` plus the
+    amounts of its entries.
+    """
+
+    __tablename__ = "balance_ledger_entry"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"), nullable=False)
+    currency: Mapped[str] = mapped_column(String, nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Numeric, nullable=False)
+    # the created or rollbacked transaction, not a foreign key: the primary key of `transaction` is (id, created)
+    transaction_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+
+    __table_args__ = (Index("ix_balance_ledger_entry_user_id_currency", "user_id", "currency"),)
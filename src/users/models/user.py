@@ -23,6 +23,8 @@ class User(Base):
         default=UserStatusEnum.ACTIVE,
     )
     created: Mapped[datetime] = mapped_column(DateTime, default=utc_now)
+    # bumped by every balance and status change of the user, the ETag of `GET /users?user_id=` is derived from it
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     user_balance: Mapped[list["UserBalance"]] = relationship(
         "UserBalance",
@@ -14,6 +14,7 @@ class UserBalance(Base):
     currency: Mapped[str] = mapped_column(String, nullable=False)
     amount: Mapped[Decimal] = mapped_column(Numeric, nullable=False)
     created: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    transactions_since_snapshot: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (UniqueConstraint("user_id", "currency", name="user_balance_user_currency_unique"),)
 
@@ -0,0 +1,25 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.utils.utils import utc_now
+
+
+class UserBalanceSnapshot(Base):
+    """
+    Balance amount of (user, currency) as of `created`.
+
+    Every transaction created and every rollback done after `created` is not included in `amount`.
+    """
+
+    __tablename__ = "user_balance_snapshot"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"), nullable=False)
+    currency: Mapped[str] = mapped_column(String, nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Numeric, nullable=False)
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+
+    __table_args__ = (Index("ix_user_balance_snapshot_user_id_currency_created", "user_id", "currency", "created"),)
@@ -0,0 +1,24 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+from src.utils.utils import utc_now
+
+
+class UserPortfolio(Base):
+    """
+    USD valuation of all user balances, kept up to date on every balance write.
+
+    Materialized so that "top N richest users" is a backward scan of
+    `ix_user_portfolio_total_usd_user_id` instead of aggregating and sorting all balances.
+    """
+
+    __tablename__ = "user_portfolio"
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"), primary_key=True)
+    total_usd: Mapped[Decimal] = mapped_column(Numeric, nullable=False, default=0)
+    updated: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utc_now)
+
+    __table_args__ = (Index("ix_user_portfolio_total_usd_user_id", "total_usd", "user_id"),)
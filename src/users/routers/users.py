@@ -1,45 +1,175 @@
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import get_async_session
+from src.config import Settigns
+from src.database import get_async_session, get_primary_read_async_session, get_read_async_session
+from src.monitoring.routing import TracedAPIRoute
 from src.users.enums import UserStatusEnum
-from src.users.schemas import RequestUserModel, RequestUserUpdateModel, ResponseUserModel, UserModel
+from src.users.schemas import (
+    RequestUserModel,
+    RequestUsersStatusUpdateModel,
+    RequestUserUpdateModel,
+    ResponsePortfolioRankModel,
+    ResponseUserBalanceModel,
+    ResponseUserModel,
+    ResponseUserPortfolioModel,
+    ResponseUsersStatusUpdateModel,
+    UserModel,
+)
+from src.users.services.balance_snapshots import BalanceSnapshotService
+from src.users.services.balance_stream import balance_events, balance_topic
+from src.users.services.portfolio import PortfolioService
 from src.users.services.users import UsersService
-from src.utils.dependencies import validate_positive_id
+from src.utils.admission import RouteClassEnum, admission
+from src.utils.dependencies import get_app_settings, validate_positive_id
+from src.utils.etag import etag_matches, make_etag, not_modified
+from src.utils.pubsub import PubSubHub, get_pubsub
+from src.utils.rate_limit import rate_limit
+from src.utils.responses import TrustedJSONResponse
+from src.utils.utils import to_naive_utc
+
 
-router = APIRouter(prefix="/users", tags=["Users"])
+router = APIRouter(prefix="/users", tags=["Users"], route_class=TracedAPIRoute, dependencies=[Depends(rate_limit)])
 
 
 @router.get(
     "",
     response_model=Optional[list[ResponseUserModel]],
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
 )
 async def get_users(
+    request: Request,
     user_id: Optional[int] = None,
     email: Optional[EmailStr] = None,
     user_status: Optional[UserStatusEnum] = None,
-    session: AsyncSession = Depends(get_async_session),
-) -> list[ResponseUserModel]:
-    return await UsersService().get_users_with_relations(session, user_id=user_id, email=email, user_status=user_status)
+    session: AsyncSession = Depends(get_read_async_session),
+) -> Response:
+    """Supports `If-None-Match`, an unchanged result is answered with 304 without loading it."""
+    service = UsersService()
+    # the version is read first, the data read after it is never older than the ETag
+    version = await service.get_users_version(session, user_id=user_id, email=email, user_status=user_status)
+    etag = make_etag("users", user_id, email, user_status, *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    users = await service.get_users_with_relations(
+        session, user_id=user_id, email=email, user_status=user_status, version=version
+    )
+    return TrustedJSONResponse(users, headers={"ETag": etag})
+
+
+@router.get(
+    "/portfolio",
+    response_model=list[ResponsePortfolioRankModel],
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
+)
+async def get_top_portfolios(
+    top: int = Query(default=10, ge=1, le=100),
+    skip: int = Query(default=0, ge=0),
+    session: AsyncSession = Depends(get_read_async_session),
+) -> TrustedJSONResponse:
+    portfolios = await PortfolioService().get_top_portfolios(session, top=top, skip=skip)
+    return TrustedJSONResponse(portfolios)
+
+
+@router.get(
+    "/{user_id}/portfolio",
+    response_model=ResponseUserPortfolioModel,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
+)
+async def get_user_portfolio(
+    user_id: int = Depends(validate_positive_id),
+    session: AsyncSession = Depends(get_read_async_session),
+) -> ResponseUserPortfolioModel:
+    return await PortfolioService().get_user_portfolio(session, user_id=user_id)
+
+
+@router.get(
+    "/{user_id}/balances",
+    response_model=list[ResponseUserBalanceModel],
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
+)
+async def get_user_balances(
+    at: Optional[datetime] = None,
+    user_id: int = Depends(validate_positive_id),
+    session: AsyncSession = Depends(get_read_async_session),
+    settings: Settigns = Depends(get_app_settings),
+) -> list[ResponseUserBalanceModel]:
+    return await BalanceSnapshotService(settings.BALANCE_SNAPSHOT_INTERVAL).get_balances_at(
+        session, user_id=user_id, at=to_naive_utc(at) if at is not None else None
+    )
+
+
+@router.get(
+    "/{user_id}/balances/stream",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.READ))],
+)
+async def stream_user_balances(
+    user_id: int = Depends(validate_positive_id),
+    # the primary, a lagging replica could miss changes published after the subscription
+    session: AsyncSession = Depends(get_primary_read_async_session),
+    hub: PubSubHub = Depends(get_pubsub),
+    settings: Settigns = Depends(get_app_settings),
+) -> StreamingResponse:
+    """
+    Server-Sent Events stream of the user balances: a `balances` event with the current balances,
+    then a `transaction` or `rollback` event with the changed balance after every committed change.
+    """
+    # subscribed before reading the balances, so no change is lost in between
+    subscription = hub.subscribe(balance_topic(user_id))
+    try:
+        balances = await BalanceSnapshotService(settings.BALANCE_SNAPSHOT_INTERVAL).get_balances_at(
+            session, user_id=user_id
+        )
+    except BaseException:
+        subscription.close()
+        raise
+    return StreamingResponse(
+        balance_events(subscription, balances, settings.BALANCE_STREAM_KEEPALIVE_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post(
     "",
     response_model=UserModel,
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.WRITE))],
 )
 async def post_user(user: RequestUserModel, session: AsyncSession = Depends(get_async_session)) -> UserModel:
     return await UsersService().create_user_with_balance(session, user=user)
 
 
+@router.patch(
+    "/status",
+    response_model=ResponseUsersStatusUpdateModel,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.WRITE))],
+)
+async def patch_users_status(
+    update_data: RequestUsersStatusUpdateModel,
+    session: AsyncSession = Depends(get_async_session),
+) -> ResponseUsersStatusUpdateModel:
+    return await UsersService().patch_users_status(session, update_data=update_data)
+
+
 @router.patch(
     "/{user_id}",
     response_model=Optional[UserModel],
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission(RouteClassEnum.WRITE))],
 )
 async def patch_user(
     update_data: RequestUserUpdateModel,
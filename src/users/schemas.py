@@ -1,9 +1,13 @@
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
 
-from pydantic import BaseModel, ConfigDict, EmailStr, model_validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
 
-from src.users.enums import CurrencyEnum, UserStatusEnum
+from src.users.enums import CurrencyEnum, UserStatusEnum, UserStatusUpdateResultEnum
+
+
+# users a single bulk status update can select, by ids or by filter
+MAX_STATUS_UPDATE_USERS = 1000
 
 
 class RequestUserModel(BaseModel):
@@ -14,6 +18,31 @@ class RequestUserUpdateModel(BaseModel):
     status: UserStatusEnum
 
 
+class UsersStatusFilterModel(BaseModel):
+    # matched case-insensitively, `%` and `_` are not wildcards
+    email: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def validate_not_empty(self) -> "UsersStatusFilterModel":
+        if self.email is None and self.created_from is None and self.created_to is None:
+            raise ValueError("Filter must contain at least one condition")
+        return self
+
+
+class RequestUsersStatusUpdateModel(BaseModel):
+    status: UserStatusEnum
+    user_ids: Optional[list[int]] = Field(default=None, min_length=1, max_length=MAX_STATUS_UPDATE_USERS)
+    filter: Optional[UsersStatusFilterModel] = None
+
+    @model_validator(mode="after")
+    def validate_ids_or_filter(self) -> "RequestUsersStatusUpdateModel":
+        if (self.user_ids is None) == (self.filter is None):
+            raise ValueError("Exactly one of `user_ids` or `filter` must be provided")
+        return self
+
+
 class ResponseUserBalanceModel(BaseModel):
     currency: CurrencyEnum
     amount: float
@@ -52,3 +81,40 @@ class UserBalanceModel(BaseModel):
             raise ValueError("Amount cannot be negative")
 
         return data
+
+
+class UserStatusUpdateResultModel(BaseModel):
+    user_id: int
+    result: UserStatusUpdateResultEnum
+    detail: Optional[str] = None
+
+
+class ResponseUsersStatusUpdateModel(BaseModel):
+    status: UserStatusEnum
+    results: list[UserStatusUpdateResultModel]
+
+
+class ResponsePortfolioBalanceModel(BaseModel):
+    currency: CurrencyEnum
+    amount: float
+    rate_to_usd: float
+    amount_usd: float
+
+
+class ResponseUserPortfolioModel(BaseModel):
+    user_id: int
+    total_usd: float
+    balances: list[ResponsePortfolioBalanceModel]
+
+
+class ResponsePortfolioRankModel(BaseModel):
+    user_id: int
+    email: EmailStr
+    total_usd: float
+
+
+class BalanceSnapshotMismatchModel(BaseModel):
+    user_id: int
+    currency: CurrencyEnum
+    expected_amount: float
+    actual_amount: float
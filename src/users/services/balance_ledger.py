@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import Numeric, bindparam, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import Base, Database
+from src.monitoring.metrics import LEDGER_ENTRIES_COMPACTED, LEDGER_PENDING_ENTRIES
+from src.monitoring.tracing import traced
+from src.users.exceptions import UserBalanceDoesNotExists
+from src.users.models import BalanceLedgerEntry, User, UserBalance
+from src.users.services.balances import balance_amount
+from src.users.services.portfolio import PortfolioService
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPACT_BATCH_SIZE = 1000
+
+_of_balance = (UserBalance.user_id == bindparam("user_id"), UserBalance.currency == bindparam("currency"))
+# built once, like the hot statements of the transactions service
+BALANCE_LOCK_QUERY = select(UserBalance.id).where(*_of_balance).with_for_update()
+BALANCE_AMOUNT_QUERY = select(balance_amount()).where(*_of_balance)
+
+
+class BalanceLedgerService:
+    """
+    Balance changes of the `ledger` balance mode. A change is appended as a `BalanceLedgerEntry` instead of
+    updating the `UserBalance` row, so concurrent deposits to an account do not wait for each other.
+    Changes that decrease a balance escalate to the row lock of the balance, which keeps the overdraft
+    checks serialized. The compactor periodically folds the entries into `UserBalance.amount`.
+    """
+
+    def __init__(self) -> None:
+        self.portfolio_service = PortfolioService()
+
+    async def get_amount(self, session: AsyncSession, user_id: int, currency: str, lock: bool = False) -> Decimal:
+        """Current balance amount, with `lock` the balance is locked until the end of the DB transaction."""
+        params = {"user_id": user_id, "currency": currency}
+        if lock:
+            # the amount is read by the next statement: under READ COMMITTED it then sees
+            # the entries committed by the previous holder of the lock
+            locked = await session.scalar(BALANCE_LOCK_QUERY, params)
+            if locked is None:
+                raise UserBalanceDoesNotExists(user_id)
+        amount = await session.scalar(BALANCE_AMOUNT_QUERY, params)
+        if amount is None:
+            raise UserBalanceDoesNotExists(user_id)
+        return Decimal(amount)
+
+    def append(self, session: AsyncSession, user_id: int, currency: str, amount: Decimal, transaction_id: int) -> None:
+        session.add(
+            BalanceLedgerEntry(user_id=user_id, currency=currency, amount=amount, transaction_id=transaction_id)
+        )
+
+    @traced()
+    async def compact(self, session: AsyncSession, batch_size: int = DEFAULT_COMPACT_BATCH_SIZE) -> int:
+        """
+        Fold the oldest `batch_size` entries into their balances and delete them, in one DB transaction.
+        Entries locked by a concurrent compaction are skipped. Bumps the version and refreshes the portfolio
+        of the users of the folded entries. Returns the number of folded entries.
+        """
+        async with session.begin():
+            rows = (
+                await session.execute(
+                    select(
+                        BalanceLedgerEntry.id,
+                        BalanceLedgerEntry.user_id,
+                        BalanceLedgerEntry.currency,
+                        BalanceLedgerEntry.amount,
+                    )
+                    .order_by(BalanceLedgerEntry.id)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+            if not rows:
+                return 0
+
+            deltas: defaultdict[tuple[int, str], Decimal] = defaultdict(Decimal)
+            for _, user_id, currency, amount in rows:
+                deltas[(user_id, currency)] += Decimal(amount)
+            balance = Base.metadata.tables[UserBalance.__tablename__]
+            # balances are updated in a fixed order, concurrent compactions do not deadlock
+            await session.execute(
+                update(balance)
+                .where(balance.c.user_id == bindparam("b_user_id"), balance.c.currency == bindparam("b_currency"))
+                .values(amount=balance.c.amount + bindparam("delta", type_=Numeric)),
+                [
+                    {"b_user_id": user_id, "b_currency": currency, "delta": delta}
+                    for (user_id, currency), delta in sorted(deltas.items())
+                ],
+            )
+            await session.execute(delete(BalanceLedgerEntry).where(BalanceLedgerEntry.id.in_([row.id for row in rows])))
+
+            user_ids = sorted({user_id for user_id, _ in deltas})
+            # the folded entries no longer change the version of `GET /users`, the user versions do
+            await session.execute(
+                update(User)
+                .where(User.id.in_(user_ids))
+                .values(version=User.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            await self.portfolio_service.refresh_portfolios(session, user_ids)
+        LEDGER_ENTRIES_COMPACTED.inc(amount=len(rows))
+        return len(rows)
+
+    async def compact_all(self, session: AsyncSession, batch_size: int = DEFAULT_COMPACT_BATCH_SIZE) -> int:
+        """Fold the entries batch by batch until none is left. Returns the number of folded entries."""
+        folded = 0
+        while compacted := await self.compact(session, batch_size):
+            folded += compacted
+            if compacted < batch_size:
+                break
+        async with session.begin():
+            pending = await session.scalar(select(func.count()).select_from(BalanceLedgerEntry))
+        LEDGER_PENDING_ENTRIES.set(pending or 0)
+        return folded
+
+
+async def run_compactor(database: Database, interval: float, batch_size: int) -> None:
+    """
+    Fold the ledger entries every `interval` seconds until cancelled, a failed run is logged and retried.
+    On SQLite every compaction transaction waits for its turn in the writer lock of `database`
+    (see `queue_sqlite_writers`), like the write transactions of the requests.
+    """
+    service = BalanceLedgerService()
+    while True:
+        try:
+            async with database.session_maker() as session:
+                await service.compact_all(session, batch_size)
+        except Exception:
+            logger.exception("Ledger compaction failed")
+        await asyncio.sleep(interval)
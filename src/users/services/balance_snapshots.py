@@ -0,0 +1,224 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.transactions.services.archive import TransactionArchiveService, transaction_rows
+from src.users.enums import CurrencyEnum
+from src.users.exceptions import UserNotExistsException
+from src.users.models import UserBalance, UserBalanceSnapshot
+from src.users.schemas import BalanceSnapshotMismatchModel, ResponseUserBalanceModel
+from src.users.services.balances import balance_amount
+from src.utils.utils import utc_now
+
+
+AMOUNT_PRECISION = Decimal("0.01")
+
+
+class BalanceSnapshotService:
+    def __init__(self, snapshot_interval: int) -> None:
+        """`snapshot_interval` is the `BALANCE_SNAPSHOT_INTERVAL` setting."""
+        self.snapshot_interval = snapshot_interval
+        self.archive_service = TransactionArchiveService()
+
+    def register_balance_change(self, session: AsyncSession, balance: UserBalance) -> None:
+        """
+        Count a change of the locked `balance` and write a snapshot every `snapshot_interval` changes.
+        Must be called after the transaction (or rollback) timestamp was taken, so the snapshot includes it.
+        """
+        balance.transactions_since_snapshot += 1
+        if balance.transactions_since_snapshot >= self.snapshot_interval:
+            session.add(
+                UserBalanceSnapshot(
+                    user_id=balance.user_id,
+                    currency=balance.currency,
+                    amount=balance.amount,
+                    created=utc_now(),
+                )
+            )
+            balance.transactions_since_snapshot = 0
+
+    async def snapshot_balances(
+        self, session: AsyncSession, user_id: Optional[int] = None, batch_size: int = 1000
+    ) -> int:
+        """
+        Write a snapshot of every balance (or of every balance of one user).
+        Balances are locked and snapshotted in batches, each batch in its own DB transaction.
+        Returns the number of written snapshots.
+        """
+        written = 0
+        last_id = 0
+        while True:
+            async with session.begin():
+                query = (
+                    select(UserBalance.id, UserBalance.user_id, UserBalance.currency, balance_amount())
+                    .where(UserBalance.id > last_id)
+                    .order_by(UserBalance.id)
+                    .limit(batch_size)
+                    .with_for_update()
+                )
+                if user_id is not None:
+                    query = query.where(UserBalance.user_id == user_id)
+                rows = (await session.execute(query)).all()
+                if not rows:
+                    return written
+
+                now = utc_now()
+                await session.execute(
+                    insert(UserBalanceSnapshot),
+                    [
+                        {"user_id": row.user_id, "currency": row.currency, "amount": row.amount, "created": now}
+                        for row in rows
+                    ],
+                )
+                await session.execute(
+                    update(UserBalance)
+                    .where(UserBalance.id.in_([row.id for row in rows]))
+                    .values(transactions_since_snapshot=0)
+                )
+            written += len(rows)
+            last_id = rows[-1].id
+
+    async def get_balances_at(
+        self, session: AsyncSession, user_id: int, at: Optional[datetime] = None
+    ) -> list[ResponseUserBalanceModel]:
+        """
+        User balances as of `at`: the nearest snapshot taken at or before `at`
+        plus the transactions and rollbacks done between the snapshot and `at`.
+        Current balances are returned when `at` is None.
+        """
+        balances = await self._get_balances(session, user_id)
+        if not balances:
+            raise UserNotExistsException(user_id)
+
+        if at is None:
+            amounts = {(user_id, currency): Decimal(amount) for _, currency, amount, _ in balances}
+        else:
+            amounts = await self._replay_balances(session, at, balances, user_id=user_id)
+        response = [
+            ResponseUserBalanceModel(
+                currency=CurrencyEnum(currency),
+                amount=float(amounts.get((user_id, currency), Decimal(0))) if at is None or created <= at else 0.0,
+            )
+            for _, currency, _, created in balances
+        ]
+        response.sort(key=lambda balance: balance.amount, reverse=True)
+        return response
+
+    async def check_consistency(
+        self, session: AsyncSession, user_id: Optional[int] = None
+    ) -> list[BalanceSnapshotMismatchModel]:
+        """
+        Compare balances replayed from the latest snapshots with the live `UserBalance` amounts.
+        Returns the balances that do not match.
+        """
+        async with session.begin():
+            balances = await self._get_balances(session, user_id)
+            replayed = await self._replay_balances(session, utc_now(), balances, user_id=user_id)
+
+        mismatches: list[BalanceSnapshotMismatchModel] = []
+        for balance_user_id, currency, amount, _ in balances:
+            expected = replayed.get((balance_user_id, currency), Decimal(0))
+            if Decimal(amount).quantize(AMOUNT_PRECISION) != Decimal(expected).quantize(AMOUNT_PRECISION):
+                mismatches.append(
+                    BalanceSnapshotMismatchModel(
+                        user_id=balance_user_id,
+                        currency=CurrencyEnum(currency),
+                        expected_amount=float(expected),
+                        actual_amount=float(amount),
+                    )
+                )
+        return mismatches
+
+    async def _get_balances(
+        self, session: AsyncSession, user_id: Optional[int] = None
+    ) -> list[tuple[int, str, Decimal, datetime]]:
+        query = select(UserBalance.user_id, UserBalance.currency, balance_amount(), UserBalance.created).order_by(
+            UserBalance.user_id, UserBalance.currency
+        )
+        if user_id is not None:
+            query = query.where(UserBalance.user_id == user_id)
+        result = await session.execute(query)
+        return list(result.tuples())
+
+    async def _replay_balances(
+        self,
+        session: AsyncSession,
+        at: datetime,
+        balances: list[tuple[int, str, Decimal, datetime]],
+        user_id: Optional[int] = None,
+    ) -> dict[tuple[int, str], Decimal]:
+        """
+        Balance amounts as of `at` keyed by (user_id, currency).
+        Replays only transactions created or rollbacked after the nearest snapshot, or all of them
+        when there is no snapshot before `at`. Archived transactions are replayed too when a replay
+        of one of the `balances` starts before the archive ends.
+        """
+        latest_snapshot_query = (
+            select(func.max(UserBalanceSnapshot.id).label("id"))
+            .where(UserBalanceSnapshot.created <= at)
+            .group_by(UserBalanceSnapshot.user_id, UserBalanceSnapshot.currency)
+        )
+        if user_id is not None:
+            latest_snapshot_query = latest_snapshot_query.where(UserBalanceSnapshot.user_id == user_id)
+        snapshot = (
+            select(
+                UserBalanceSnapshot.user_id,
+                UserBalanceSnapshot.currency,
+                UserBalanceSnapshot.amount,
+                UserBalanceSnapshot.created,
+            )
+            .where(UserBalanceSnapshot.id.in_(latest_snapshot_query))
+            .subquery()
+        )
+
+        amounts: dict[tuple[int, str], Decimal] = {}
+        snapshot_times: dict[tuple[int, str], datetime] = {}
+        snapshots_result = await session.execute(
+            select(snapshot.c.user_id, snapshot.c.currency, snapshot.c.amount, snapshot.c.created)
+        )
+        for snapshot_user_id, currency, amount, created in snapshots_result.tuples():
+            amounts[(snapshot_user_id, currency)] = Decimal(amount)
+            snapshot_times[(snapshot_user_id, currency)] = created
+
+        archived_until = await self.archive_service.archived_until(session)
+        include_archive = archived_until is not None and any(
+            (balance_user_id, currency) not in snapshot_times
+            or snapshot_times[(balance_user_id, currency)] < archived_until
+            for balance_user_id, currency, _, _ in balances
+        )
+        transactions = transaction_rows(include_archive)
+
+        created_after_snapshot = or_(snapshot.c.created.is_(None), transactions.c.created > snapshot.c.created)
+        rollbacked_in_window = and_(
+            transactions.c.rollbacked.is_not(None),
+            or_(snapshot.c.created.is_(None), transactions.c.rollbacked > snapshot.c.created),
+            transactions.c.rollbacked <= at,
+        )
+        deltas_query = (
+            select(
+                transactions.c.user_id,
+                transactions.c.currency,
+                func.sum(
+                    case((created_after_snapshot, transactions.c.amount), else_=0)
+                    - case((rollbacked_in_window, transactions.c.amount), else_=0)
+                ),
+            )
+            .select_from(transactions)
+            .outerjoin(
+                snapshot,
+                and_(snapshot.c.user_id == transactions.c.user_id, snapshot.c.currency == transactions.c.currency),
+            )
+            .where(transactions.c.created <= at, or_(created_after_snapshot, rollbacked_in_window))
+            .group_by(transactions.c.user_id, transactions.c.currency)
+        )
+        if user_id is not None:
+            deltas_query = deltas_query.where(transactions.c.user_id == user_id)
+
+        deltas_result = await session.execute(deltas_query)
+        for delta_user_id, currency, delta in deltas_result.tuples():
+            key = (delta_user_id, currency)
+            amounts[key] = amounts.get(key, Decimal(0)) + Decimal(delta or 0)
+        return amounts
@@ -0,0 +1,40 @@
+from collections.abc import AsyncIterator
+from typing import Any
+
+from pydantic_core import to_json
+
+from src.utils.pubsub import Subscription, SubscriptionOverflowError
+
+
+def balance_topic(user_id: int) -> tuple[str, int]:
+    """Topic of the balance changes of a user, messages are `BalanceChangeEventModel`."""
+    return ("balances", user_id)
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + to_json(data) + b"\n\n"
+
+
+async def balance_events(
+    subscription: Subscription, balances: list[Any], keepalive_seconds: float
+) -> AsyncIterator[bytes]:
+    """
+    Server-Sent Events of a balance stream: the current `balances` first, then every published change.
+    A comment line is sent when nothing happened for `keepalive_seconds`, so proxies keep the connection open.
+    A subscriber dropped for being too slow gets an `overflow` event and the stream ends,
+    the client reconnects and starts again from the current balances.
+    """
+    try:
+        yield sse_event("balances", balances)
+        while True:
+            try:
+                event = await subscription.get(timeout=keepalive_seconds)
+            except TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            except SubscriptionOverflowError:
+                yield sse_event("overflow", {})
+                return
+            yield sse_event(event.type, event)
+    finally:
+        subscription.close()
@@ -0,0 +1,18 @@
+from decimal import Decimal
+
+from sqlalchemy import ColumnElement, func, select
+
+from src.users.models import BalanceLedgerEntry, UserBalance
+
+
+def balance_amount() -> ColumnElement[Decimal]:
+    """
+    Current amount of the `UserBalance` row: the checkpointed `amount` plus its pending ledger entries.
+    Correct in both balance modes, there are no entries in the `locking` mode.
+    """
+    pending = (
+        select(func.sum(BalanceLedgerEntry.amount))
+        .where(BalanceLedgerEntry.user_id == UserBalance.user_id, BalanceLedgerEntry.currency == UserBalance.currency)
+        .scalar_subquery()
+    )
+    return (UserBalance.amount + func.coalesce(pending, 0)).label("amount")
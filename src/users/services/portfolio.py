@@ -0,0 +1,114 @@
+from decimal import Decimal
+from typing import Mapping, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.analytics.models import ExchangeRate
+from src.monitoring.tracing import traced
+from src.users.enums import CurrencyEnum
+from src.users.exceptions import UserNotExistsException
+from src.users.models import User, UserBalance, UserPortfolio
+from src.users.schemas import ResponsePortfolioBalanceModel, ResponsePortfolioRankModel, ResponseUserPortfolioModel
+from src.users.services.balances import balance_amount
+from src.utils.utils import utc_now
+
+
+class PortfolioService:
+    @traced()
+    async def get_user_portfolio(self, session: AsyncSession, user_id: int) -> ResponseUserPortfolioModel:
+        """
+        Value every balance of the user in USD by joining `user_balance` with `exchange_rate`.
+        Balances in currencies without a rate are not included.
+        """
+        amount = balance_amount()
+        amount_usd = amount * ExchangeRate.rate_to_usd
+        result = await session.execute(
+            select(
+                UserBalance.currency,
+                amount,
+                ExchangeRate.rate_to_usd,
+                amount_usd.label("amount_usd"),
+                func.sum(amount_usd).over().label("total_usd"),
+            )
+            .select_from(UserBalance)
+            .join(ExchangeRate, ExchangeRate.currency == UserBalance.currency)
+            .where(UserBalance.user_id == user_id)
+            .order_by(amount_usd.desc())
+        )
+        rows = result.all()
+        if not rows and not await session.scalar(select(User.id).where(User.id == user_id)):
+            raise UserNotExistsException(user_id)
+
+        return ResponseUserPortfolioModel(
+            user_id=user_id,
+            total_usd=float(rows[0].total_usd) if rows else 0.0,
+            balances=[
+                ResponsePortfolioBalanceModel(
+                    currency=CurrencyEnum(row.currency),
+                    amount=float(row.amount),
+                    rate_to_usd=float(row.rate_to_usd),
+                    amount_usd=float(row.amount_usd),
+                )
+                for row in rows
+            ],
+        )
+
+    @traced()
+    async def get_top_portfolios(
+        self, session: AsyncSession, top: int = 10, skip: int = 0
+    ) -> list[ResponsePortfolioRankModel]:
+        """
+        Richest users first. Reads the materialized `user_portfolio` totals, so the
+        ordering is served by `ix_user_portfolio_total_usd_user_id`.
+        """
+        result = await session.execute(
+            select(UserPortfolio.user_id, User.email, UserPortfolio.total_usd)
+            .join(User, User.id == UserPortfolio.user_id)
+            .order_by(UserPortfolio.total_usd.desc(), UserPortfolio.user_id.desc())
+            .offset(skip)
+            .limit(top)
+        )
+        # rows come from our own DB, so the models are constructed without validation
+        return [
+            ResponsePortfolioRankModel.model_construct(user_id=user_id, email=email, total_usd=float(total_usd))
+            for user_id, email, total_usd in result.tuples()
+        ]
+
+    @traced()
+    async def refresh_portfolios(self, session: AsyncSession, user_ids: Optional[Sequence[int]] = None) -> None:
+        """
+        Recompute `user_portfolio.total_usd` from current balances and rates.
+        Must run in the same transaction as the balance change, after it was flushed.
+        All portfolios are refreshed when `user_ids` is None.
+        """
+        total_usd = (
+            select(func.coalesce(func.sum(balance_amount() * ExchangeRate.rate_to_usd), 0))
+            .select_from(UserBalance)
+            .join(ExchangeRate, ExchangeRate.currency == UserBalance.currency)
+            .where(UserBalance.user_id == UserPortfolio.user_id)
+            .scalar_subquery()
+        )
+        query = update(UserPortfolio).values(total_usd=total_usd, updated=utc_now())
+        if user_ids is not None:
+            query = query.where(UserPortfolio.user_id.in_(user_ids))
+        await session.execute(query.execution_options(synchronize_session=False))
+
+    @traced()
+    async def set_exchange_rates(self, session: AsyncSession, rates: Mapping[CurrencyEnum, float]) -> None:
+        """
+        Set the rates of the given currencies in `exchange_rate`, the other rates are kept, and revalue all portfolios.
+        """
+        async with session.begin():
+            now = utc_now()
+            await session.execute(
+                delete(ExchangeRate).where(ExchangeRate.currency.in_([currency.value for currency in rates]))
+            )
+            await session.execute(
+                insert(ExchangeRate),
+                [
+                    {"currency": currency.value, "rate_to_usd": Decimal(str(rate)), "updated": now}
+                    for currency, rate in rates.items()
+                ],
+            )
+            await self.refresh_portfolios(session)
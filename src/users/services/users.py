@@ -1,36 +1,55 @@
+import re
+from datetime import datetime
 from typing import Any, Optional
 
-from sqlalchemy import insert, select
+from fastapi import HTTPException
+from sqlalchemy import ColumnElement, Select, and_, bindparam, func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from src.users.enums import CurrencyEnum, UserStatusEnum
+from src.monitoring.tracing import traced
+from src.users.enums import CurrencyEnum, UserStatusEnum, UserStatusUpdateResultEnum
 from src.users.exceptions import (
     UserAlreadyActiveException,
     UserAlreadyBlockedException,
     UserAlreadyExistsException,
     UserIsBlockedException,
     UserNotExistsException,
+    UsersFilterTooBroadException,
 )
+from src.users.models.balance_ledger_entry import BalanceLedgerEntry
 from src.users.models.user import User
 from src.users.models.user_balance import UserBalance
+from src.users.models.user_portfolio import UserPortfolio
 from src.users.schemas import (
+    MAX_STATUS_UPDATE_USERS,
     RequestUserModel,
+    RequestUsersStatusUpdateModel,
     RequestUserUpdateModel,
     ResponseUserBalanceModel,
     ResponseUserModel,
+    ResponseUsersStatusUpdateModel,
     UserModel,
+    UsersStatusFilterModel,
+    UserStatusUpdateResultModel,
 )
+from src.users.services.balances import balance_amount
+from src.utils.singleflight import single_flight
 from src.utils.utils import utc_now
 
 
+# built once: the cache key of a prebuilt statement is memoized, so a call skips building
+# the statement and its cache key and goes straight to the compiled statement cache
+ACTIVE_USER_QUERY = select(User).where(User.id == bindparam("user_id"))
+
+
 class UsersService:
+    @traced()
     async def get_active_user(self, session: AsyncSession, user_id: int) -> User:
         """
         Retrieve a single user by ID. Raises UserNotExistsException if not found.
         Does NOT load related data.
         """
-        user = await session.scalar(select(User).where(User.id == user_id))
+        user = await session.scalar(ACTIVE_USER_QUERY, {"user_id": user_id})
         if not user:
             raise UserNotExistsException(user_id)
 
@@ -39,12 +58,26 @@ class UsersService:
 
         return user
 
+    @traced()
+    @single_flight(
+        "users_with_relations",
+        # engine of the session (primary or replica), the filters (emails are matched case-insensitively)
+        # and the version read by the caller
+        key=lambda self, session, user_id=None, email=None, user_status=None, version=None: (
+            session.get_bind(),
+            user_id,
+            email.lower() if email is not None else None,
+            user_status,
+            version,
+        ),
+    )
     async def get_users_with_relations(
         self,
         session: AsyncSession,
         user_id: Optional[int] = None,
         email: Optional[str] = None,
         user_status: Optional[str] = None,
+        version: Optional[tuple[Any, ...]] = None,
     ) -> list[ResponseUserModel]:
         """
         Retrieve users with their associated balance information.
@@ -52,33 +85,84 @@ class UsersService:
         This method fetches user data along with their account balances. It supports
         filtering by various criteria. When multiple filters are provided, they are
         combined using AND logic.
+
+        `version` is the `get_users_version` the caller read before. Concurrent calls share one query only
+        when they read the same version, so a caller never gets a query started before a change it has seen
+        (a newer ETag, or its own write when reading from the primary).
         """
-        q = select(User).options(selectinload(User.user_balance)).order_by(User.created.desc())
-        if user_id is not None:
-            q = q.where(User.id == user_id)
-        if email is not None:
-            q = q.where(User.email.ilike(email))
-        if user_status is not None:
-            q = q.where(User.status == user_status)
-
-        result = await session.execute(q)
-        users = result.scalars().all()
-
-        response_users: list[ResponseUserModel] = []
-        for user in users:
-            balances = [ResponseUserBalanceModel.model_validate(balance) for balance in user.user_balance]
-            response_users.append(
-                ResponseUserModel(
-                    id=user.id,
-                    email=user.email,
-                    status=UserStatusEnum(user.status),
-                    created=user.created,
-                    balances=balances,
-                )
+        users_query = self._users_query(user_id, email, user_status).order_by(User.created.desc())
+        users_result = await session.execute(users_query)
+        users = users_result.all()
+        if not users:
+            return []
+
+        current_amount = balance_amount()
+        balances_query = (
+            select(UserBalance.user_id, UserBalance.currency, current_amount)
+            .where(UserBalance.user_id.in_(users_query.with_only_columns(User.id).order_by(None)))
+            .order_by(UserBalance.user_id, current_amount.desc())
+        )
+        balances_result = await session.execute(balances_query)
+
+        # rows come from our own DB, so the models are constructed without validation
+        balances: dict[int, list[ResponseUserBalanceModel]] = {}
+        for balance_user_id, currency, amount in balances_result.tuples():
+            balances.setdefault(balance_user_id, []).append(
+                ResponseUserBalanceModel.model_construct(currency=CurrencyEnum(currency), amount=float(amount))
+            )
+
+        response_users: list[ResponseUserModel] = [
+            ResponseUserModel.model_construct(
+                id=row_user_id,
+                email=row_email,
+                status=UserStatusEnum(row_status),
+                created=row_created,
+                balances=balances.get(row_user_id, []),
             )
+            for row_user_id, row_email, row_status, row_created in users
+        ]
 
         return response_users
 
+    @traced()
+    async def get_users_version(
+        self,
+        session: AsyncSession,
+        user_id: Optional[int] = None,
+        email: Optional[str] = None,
+        user_status: Optional[str] = None,
+    ) -> tuple[Any, ...]:
+        """
+        Cheap version of what `get_users_with_relations` returns for the same filters, changed by every
+        balance or status change: the `version` of the user when filtering by `user_id`
+        (a primary key lookup), otherwise the count, max id and sum of versions of the matched users.
+        The latest pending ledger entry is part of the version, ledger writes do not bump the user version
+        (the compactor does when it folds the entries).
+        """
+        latest_entry = select(func.max(BalanceLedgerEntry.id))
+        if user_id is not None:
+            latest_entry = latest_entry.where(BalanceLedgerEntry.user_id == user_id)
+            query = select(User.version, latest_entry.scalar_subquery()).where(User.id == user_id)
+            return tuple((await session.execute(query)).one_or_none() or (None, None))
+        query = self._users_query(user_id, email, user_status).with_only_columns(
+            func.count(), func.max(User.id), func.sum(User.version), latest_entry.scalar_subquery()
+        )
+        return tuple((await session.execute(query)).one())
+
+    @staticmethod
+    def _users_query(
+        user_id: Optional[int] = None, email: Optional[str] = None, user_status: Optional[str] = None
+    ) -> Select[tuple[int, str, UserStatusEnum, datetime]]:
+        users_query = select(User.id, User.email, User.status, User.created)
+        if user_id is not None:
+            users_query = users_query.where(User.id == user_id)
+        if email is not None:
+            users_query = users_query.where(User.email.ilike(email))
+        if user_status is not None:
+            users_query = users_query.where(User.status == user_status)
+        return users_query
+
+    @traced()
     async def create_user_with_balance(
         self,
         session: AsyncSession,
@@ -88,7 +172,8 @@ class UsersService:
         Creates a new user with zero-initialized balances for all supported currencies.
         1. Checks if a user with the given email already exists.
         2. If not, inserts a new active user.
-        3. Immediately creates initial balance records (amount = 0.0) for all currencies in `CurrencyEnum`.
+        3. Immediately creates initial balance records (amount = 0.0) for all currencies in `CurrencyEnum`
+           and an empty USD portfolio valuation.
         """
         async with session.begin():
             existing_user = await session.scalar(select(User.id).where(User.email == user.email))
@@ -112,6 +197,7 @@ class UsersService:
                 insert(UserBalance),
                 balance_data,
             )
+            await session.execute(insert(UserPortfolio).values(user_id=db_user.id, total_usd=0, updated=now))
 
             return UserModel(
                 id=db_user.id,
@@ -120,6 +206,7 @@ class UsersService:
                 created=db_user.created,
             )
 
+    @traced()
     async def patch_user_status(
         self,
         session: AsyncSession,
@@ -139,12 +226,10 @@ class UsersService:
             new_status = update_data.status
 
             if current_status == new_status:
-                if current_status == UserStatusEnum.BLOCKED:
-                    raise UserAlreadyBlockedException(user_id)
-                elif current_status == UserStatusEnum.ACTIVE:
-                    raise UserAlreadyActiveException(user_id)
+                raise self._already_in_status_exception(user_id, current_status)
 
             db_user.status = new_status
+            db_user.version = User.version + 1
 
             return UserModel(
                 id=db_user.id,
@@ -152,3 +237,92 @@ class UsersService:
                 status=UserStatusEnum(db_user.status),
                 created=db_user.created,
             )
+
+    @traced()
+    async def patch_users_status(
+        self,
+        session: AsyncSession,
+        update_data: RequestUsersStatusUpdateModel,
+    ) -> ResponseUsersStatusUpdateModel:
+        """
+        Set the same status for many users with a single `UPDATE ... RETURNING`.
+
+        Users are selected either by `user_ids` or by `filter`. Every matched user gets
+        a per-id outcome: CHANGED, ALREADY_IN_STATUS (with the detail of
+        UserAlreadyBlockedException/UserAlreadyActiveException) or NOT_FOUND. A filter may match
+        at most `MAX_STATUS_UPDATE_USERS` users, like `user_ids`, otherwise nothing is updated.
+        """
+        new_status = update_data.status
+        users_filter = update_data.filter
+        if users_filter is None:
+            # the model requires either `user_ids` or `filter`
+            user_ids = list(dict.fromkeys(update_data.user_ids or ()))
+            condition: ColumnElement[bool] = User.id.in_(user_ids)
+        else:
+            # one user more than the limit tells a too broad filter, the statements never touch more users
+            condition = User.id.in_(
+                select(User.id)
+                .where(self._status_filter_condition(users_filter))
+                .order_by(User.id)
+                .limit(MAX_STATUS_UPDATE_USERS + 1)
+            )
+
+        async with session.begin():
+            changed_result = await session.execute(
+                update(User)
+                .where(condition, User.status != new_status)
+                .values(status=new_status, version=User.version + 1)
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
+            )
+            changed_ids = set(changed_result.scalars().all())
+
+            already_result = await session.execute(select(User.id).where(condition, User.status == new_status))
+            # rows changed by the UPDATE above also match the new status now
+            already_ids = set(already_result.scalars().all()) - changed_ids
+            if users_filter is not None:
+                user_ids = sorted(changed_ids | already_ids)
+                if len(user_ids) > MAX_STATUS_UPDATE_USERS:
+                    # rolls the UPDATE back
+                    raise UsersFilterTooBroadException(MAX_STATUS_UPDATE_USERS)
+
+        results: list[UserStatusUpdateResultModel] = []
+        for user_id in user_ids:
+            if user_id in changed_ids:
+                results.append(UserStatusUpdateResultModel(user_id=user_id, result=UserStatusUpdateResultEnum.CHANGED))
+            elif user_id in already_ids:
+                results.append(
+                    UserStatusUpdateResultModel(
+                        user_id=user_id,
+                        result=UserStatusUpdateResultEnum.ALREADY_IN_STATUS,
+                        detail=self._already_in_status_exception(user_id, new_status).detail,
+                    )
+                )
+            else:
+                results.append(
+                    UserStatusUpdateResultModel(
+                        user_id=user_id,
+                        result=UserStatusUpdateResultEnum.NOT_FOUND,
+                        detail=UserNotExistsException(user_id).detail,
+                    )
+                )
+
+        return ResponseUsersStatusUpdateModel(status=new_status, results=results)
+
+    @staticmethod
+    def _status_filter_condition(users_filter: UsersStatusFilterModel) -> ColumnElement[bool]:
+        conditions: list[ColumnElement[bool]] = []
+        if users_filter.email is not None:
+            escaped = re.sub(r"([\\%_])", r"\\\1", users_filter.email)
+            conditions.append(User.email.ilike(escaped, escape="\\"))
+        if users_filter.created_from is not None:
+            conditions.append(User.created >= users_filter.created_from)
+        if users_filter.created_to is not None:
+            conditions.append(User.created <= users_filter.created_to)
+        return and_(*conditions)
+
+    @staticmethod
+    def _already_in_status_exception(user_id: int, user_status: UserStatusEnum) -> HTTPException:
+        if user_status == UserStatusEnum.BLOCKED:
+            return UserAlreadyBlockedException(user_id)
+        return UserAlreadyActiveException(user_id)
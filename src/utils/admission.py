@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from enum import StrEnum
+
+from fastapi import Request
+
+from src.config import AdmissionSettings, RouteClassLimits
+from src.exceptions import ServiceOverloadedException
+from src.monitoring.metrics import (
+    ADMISSION_ACTIVE,
+    ADMISSION_LIMIT,
+    ADMISSION_REJECTED,
+    ADMISSION_WAIT,
+    ADMISSION_WAITING,
+)
+
+
+class RouteClassEnum(StrEnum):
+    WRITE = "write"
+    READ = "read"
+    ANALYTICS = "analytics"
+
+
+class AdmissionController:
+    """
+    Concurrency limit of a route class with a bounded wait queue. Requests over the limit wait
+    for a slot at most `QUEUE_TIMEOUT` seconds; when the queue is full or the wait times out
+    they fail fast with 503, instead of piling up on the DB pool and slowing every other route.
+    """
+
+    def __init__(self, route_class: RouteClassEnum, limits: RouteClassLimits, retry_after: int) -> None:
+        self.route_class = route_class
+        self.limits = limits
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limits.CONCURRENCY)
+        ADMISSION_LIMIT.set(limits.CONCURRENCY, route_class, "concurrency")
+        ADMISSION_LIMIT.set(limits.QUEUE_SIZE, route_class, "queue")
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._slots.locked() or self.waiting:
+            await self._wait_for_slot()
+        else:
+            await self._slots.acquire()
+        ADMISSION_ACTIVE.inc(self.route_class)
+        try:
+            yield
+        finally:
+            ADMISSION_ACTIVE.dec(self.route_class)
+            self._slots.release()
+
+    async def _wait_for_slot(self) -> None:
+        if self.waiting >= self.limits.QUEUE_SIZE:
+            ADMISSION_REJECTED.inc(self.route_class, "queue_full")
+            raise ServiceOverloadedException(self.retry_after)
+        self.waiting += 1
+        ADMISSION_WAITING.inc(self.route_class)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.limits.QUEUE_TIMEOUT)
+        except TimeoutError:
+            ADMISSION_REJECTED.inc(self.route_class, "timeout")
+            raise ServiceOverloadedException(self.retry_after) from None
+        finally:
+            self.waiting -= 1
+            ADMISSION_WAITING.dec(self.route_class)
+            ADMISSION_WAIT.observe(time.perf_counter() - started, self.route_class)
+
+
+def create_admission_controllers(settings: AdmissionSettings) -> dict[RouteClassEnum, AdmissionController]:
+    if not settings.ENABLED:
+        return {}
+    limits = {
+        RouteClassEnum.WRITE: settings.WRITE,
+        RouteClassEnum.READ: settings.READ,
+        RouteClassEnum.ANALYTICS: settings.ANALYTICS,
+    }
+    return {
+        route_class: AdmissionController(route_class, route_limits, settings.RETRY_AFTER_SECONDS)
+        for route_class, route_limits in limits.items()
+    }
+
+
+def admission(route_class: RouteClassEnum) -> Callable[[Request], AsyncIterator[None]]:
+    """
+    Dependency admitting the request in the budget of `route_class`, used in the `dependencies`
+    of the route decorator, so it is solved before the session dependencies. The slot is held
+    until the endpoint returns.
+    """
+
+    async def admit(request: Request) -> AsyncIterator[None]:
+        controller = request.app.state.admission.get(route_class)
+        if controller is None:
+            yield
+            return
+        # applied to the DB transactions of the request sessions, see `src.database`
+        request.state.statement_timeout_ms = controller.limits.STATEMENT_TIMEOUT_MS
+        async with controller.admit():
+            yield
+
+    return admit
@@ -1,3 +1,7 @@
+from fastapi import Request
+
+from src.config import Settigns
+from src.database import get_database
 from src.exceptions import BadRequestDataException
 
 
@@ -5,3 +9,7 @@ def validate_positive_id(user_id: int) -> int:
     if user_id <= 0:
         raise BadRequestDataException(detail="Unprocessable data in request")
     return user_id
+
+
+def get_app_settings(request: Request) -> Settigns:
+    return get_database(request).settings
@@ -0,0 +1,86 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Hashable
+from typing import Any, Optional
+
+from fastapi import Request
+
+from src.monitoring.metrics import PUBSUB_MESSAGES
+
+
+DEFAULT_QUEUE_SIZE = 100
+
+
+class SubscriptionOverflowError(Exception):
+    """The subscriber did not keep up with the published messages and was dropped."""
+
+
+class Subscription:
+    def __init__(self, hub: "PubSubHub", topic: Hashable, queue_size: int) -> None:
+        self.hub = hub
+        self.topic = topic
+        self.queue: asyncio.Queue[Any] = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Next message. Raises `TimeoutError` when nothing was published in `timeout` seconds and
+        `SubscriptionOverflowError` once the messages queued before an overflow are consumed.
+        """
+        if self.overflowed and self.queue.empty():
+            raise SubscriptionOverflowError()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class PubSubHub:
+    """
+    In-process fan-out of messages to the subscribers of a topic. Every subscriber has a bounded queue;
+    publishing never waits, a subscriber whose queue is full is dropped (backpressure is on the slow
+    consumer, not on the publisher) and has to subscribe again.
+
+    Only subscribers of the same process receive the messages.
+    """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+        self._subscriptions: defaultdict[Hashable, set[Subscription]] = defaultdict(set)
+
+    def subscribe(self, topic: Hashable) -> Subscription:
+        subscription = Subscription(self, topic, self.queue_size)
+        self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.topic)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.topic]
+
+    def subscribers(self, topic: Hashable) -> int:
+        return len(self._subscriptions.get(topic, ()))
+
+    def publish(self, topic: Hashable, message: Any) -> int:
+        """Queue the message for every subscriber of the topic, returns the number of subscribers reached."""
+        delivered = 0
+        for subscription in list(self._subscriptions.get(topic, ())):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+                PUBSUB_MESSAGES.inc("dropped")
+                continue
+            delivered += 1
+        if delivered:
+            PUBSUB_MESSAGES.inc("delivered", amount=delivered)
+        return delivered
+
+
+def get_pubsub(request: Request) -> PubSubHub:
+    hub: PubSubHub = request.app.state.pubsub
+    return hub
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Optional
+
+from fastapi import Request
+
+from src.config import RateLimitSettings
+from src.exceptions import RateLimitExceededException
+from src.monitoring.metrics import RATE_LIMITED
+
+
+# idle buckets checked for expiry on every take, keeps the cleanup O(1)
+EXPIRE_PER_TAKE = 2
+
+
+class TokenBucketStore:
+    """
+    Token buckets of `burst` tokens refilled at `rate` tokens per second, one per key. Buckets are kept
+    in least recently used order: a bucket idle long enough to be full again is the same as a missing one
+    and is dropped, and beyond `max_keys` buckets the least recently used one is dropped.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, last update]
+        self._buckets: OrderedDict[Hashable, list[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Take a token of the key bucket. Returns 0 when taken, otherwise the seconds until a token is available."""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        retry_after = 0.0
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+        else:
+            retry_after = (1 - bucket[0]) / self.rate
+        self._expire(now)
+        return retry_after
+
+    def _expire(self, now: float) -> None:
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        expired = 0
+        while self._buckets and expired < EXPIRE_PER_TAKE:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if updated + (self.burst - tokens) / self.rate > now:
+                break
+            del self._buckets[key]
+            expired += 1
+
+
+class RateLimiter:
+    """Buckets of the users and of the clients, see `RateLimitSettings`."""
+
+    def __init__(self, settings: RateLimitSettings) -> None:
+        self.users = TokenBucketStore(settings.USER_RATE, settings.USER_BURST, settings.MAX_KEYS)
+        self.clients = TokenBucketStore(settings.CLIENT_RATE, settings.CLIENT_BURST, settings.MAX_KEYS)
+
+    def check(self, client: str, user_id: Optional[int] = None) -> None:
+        # the user bucket first, a request limited by its user does not spend a token of the client
+        if user_id is not None and (retry_after := self.users.take(user_id)):
+            RATE_LIMITED.inc("user")
+            raise RateLimitExceededException(retry_after)
+        if retry_after := self.clients.take(client):
+            RATE_LIMITED.inc("client")
+            raise RateLimitExceededException(retry_after)
+
+
+def create_rate_limiter(settings: RateLimitSettings) -> Optional[RateLimiter]:
+    return RateLimiter(settings) if settings.ENABLED else None
+
+
+async def rate_limit(request: Request) -> None:
+    """Router dependency, solved before the dependencies of the routes (admission included)."""
+    limiter: Optional[RateLimiter] = request.app.state.rate_limiter
+    if limiter is None:
+        return
+    client = request.client.host if request.client else "unknown"
+    limiter.check(client, _user_id(request.path_params.get("user_id")))
+
+
+def _user_id(path_param: Optional[str]) -> Optional[int]:
+    """
+    The user id of the path, as the route parses it: `7`, `07` and `007` share the bucket of user 7.
+    An invalid id is rejected by the route, its request is only limited by the client bucket.
+    """
+    if path_param is None:
+        return None
+    try:
+        return int(path_param)
+    except ValueError:
+        return None
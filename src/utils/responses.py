@@ -0,0 +1,35 @@
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from typing import Any
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_core import to_json
+
+
+class TrustedJSONResponse(JSONResponse):
+    """
+    JSON response for content built from trusted, DB-sourced values.
+
+    Returning it from an endpoint bypasses the `response_model` validation done by FastAPI,
+    so the content has to be constructed with `model_construct` (or plain data) beforehand.
+    Serialization is done by pydantic-core in a single pass.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Newline delimited JSON streamed from batches of items, one line per item and one chunk per batch.
+    Same trust rules as `TrustedJSONResponse`.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self, batches: AsyncIterable[Iterable[Any]], **kwargs: Any) -> None:
+        super().__init__(self._render(batches), **kwargs)
+
+    @staticmethod
+    async def _render(batches: AsyncIterable[Iterable[Any]]) -> AsyncIterator[bytes]:
+        async for batch in batches:
+            yield b"".join(to_json(item) + b"\n" for item in batch)
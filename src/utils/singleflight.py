@@ -0,0 +1,76 @@
+import asyncio
+import functools
+from collections.abc import Hashable
+from typing import Any, Awaitable, Callable, TypeVar
+
+from src.monitoring.metrics import SINGLE_FLIGHT_CALLS
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls of an operation with the same key: the first call (the leader) runs it,
+    calls made while it runs await the leader result instead of running it again.
+
+    The result object is shared by all the callers, so it must not be modified.
+    A caller cancelled while waiting does not affect the others; when the leader is cancelled
+    a waiting caller runs the operation itself.
+    """
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self._calls: dict[Hashable, asyncio.Future[Any]] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        while (shared := self._calls.get(key)) is not None:
+            try:
+                result: T = await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                current = asyncio.current_task()
+                if shared.cancelled() and current is not None and not current.cancelling():
+                    # the leader was cancelled, not this caller
+                    continue
+                raise
+            SINGLE_FLIGHT_CALLS.inc(self.operation, "shared")
+            return result
+
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        SINGLE_FLIGHT_CALLS.inc(self.operation, "leader")
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # marks the exception as retrieved, there may be no waiting caller to do it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+def single_flight(
+    operation: str, key: Callable[..., Hashable]
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Coalesce concurrent calls of the decorated coroutine function. `key` is called with the same arguments
+    and returns the normalized key of the call; calls with equal keys share one execution.
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        flight = SingleFlight(operation)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            return await flight.do(key(*args, **kwargs), lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
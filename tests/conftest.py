@@ -6,34 +6,28 @@ from typing import AsyncGenerator
 import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from main import app
-from src.database import Base, get_async_session
+from main import create_app
+from src.analytics.services.analytics import EXCHANGE_RATES_TO_USD
+from src.config import DatabaseSettings, MonitoringSettings, RateLimitSettings, Settigns
+from src.database import Base, Database
+from src.users.services.portfolio import PortfolioService
 
 
 TEST_DB_PATH = os.path.join(tempfile.gettempdir(), "test_fastapi.db")
 TEST_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DB_PATH}"
 
-test_engine = create_async_engine(
-    TEST_DATABASE_URL,
-    poolclass=NullPool,
-    echo=False,
+# requests repeating a statement (N+1 queries) fail the tests, the tests requests are not rate limited.
+# `TEST_BALANCE_MODE=ledger` runs the tests in the ledger balance mode, the tests compact the ledger themselves.
+test_settings = Settigns(
+    DB=DatabaseSettings(URL=TEST_DATABASE_URL),
+    BALANCE_MODE=os.environ.get("TEST_BALANCE_MODE", "locking"),
+    LEDGER_COMPACT_INTERVAL_SECONDS=3600,
+    MONITORING=MonitoringSettings(REPEATED_QUERY_RAISE=True),
+    RATE_LIMIT=RateLimitSettings(USER_BURST=1_000_000, CLIENT_BURST=1_000_000),
 )
 
-TestingSessionLocal = async_sessionmaker(
-    bind=test_engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autoflush=False,
-)
-
-
-async def override_get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with TestingSessionLocal() as session:
-        yield session
-
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -43,19 +37,33 @@ def event_loop():
 
 
 @pytest.fixture(scope="session")
-async def create_test_tables():
-    async with test_engine.begin() as conn:
+async def test_app() -> AsyncGenerator[FastAPI, None]:
+    app = create_app(test_settings)
+    async with app.router.lifespan_context(app):
+        yield app
+
+
+@pytest.fixture(scope="session")
+def database(test_app: FastAPI) -> Database:
+    return test_app.state.database
+
+
+@pytest.fixture(scope="session")
+async def create_test_tables(database: Database):
+    async with database.engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    async with database.session_maker() as session:
+        await PortfolioService().set_exchange_rates(session, EXCHANGE_RATES_TO_USD)
     yield
 
-    async with test_engine.begin() as conn:
+    async with database.engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
 
-@pytest.fixture(scope="session")
-def test_app() -> FastAPI:
-    app.dependency_overrides[get_async_session] = override_get_async_session
-    return app
+@pytest.fixture
+async def db_session(database: Database, create_test_tables) -> AsyncGenerator[AsyncSession, None]:
+    async with database.session_maker() as session:
+        yield session
 
 
 @pytest.fixture
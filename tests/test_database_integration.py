@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import tempfile
+from typing import AsyncGenerator
+
+import httpx
+import pytest
+from httpx import AsyncClient
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from main import create_app
+from src.config import DatabaseSettings, ServerSettings, Settigns
+from src.database import READ_PRIMARY_HEADER, Base, Database, ReadReplicaRouter, create_engine
+from src.server import worker_count
+from tests.conftest import TEST_DATABASE_URL
+
+
+REPLICA_DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'test_fastapi_replica.db')}"
+
+
+@pytest.fixture
+async def replica_session_maker() -> AsyncGenerator[async_sessionmaker[AsyncSession], None]:
+    replica_engine = create_async_engine(REPLICA_DATABASE_URL, poolclass=NullPool)
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(replica_engine, expire_on_commit=False)
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await replica_engine.dispose()
+
+
+@pytest.mark.asyncio
+class TestDatabase:
+    async def test_reads_are_routed_to_replica(
+        self, create_test_tables, replica_session_maker: async_sessionmaker[AsyncSession]
+    ):
+        settings = Settigns(DB=DatabaseSettings(URL=TEST_DATABASE_URL, REPLICA_URLS=[REPLICA_DATABASE_URL]))
+        app = create_app(settings)
+        async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://test") as client:
+            user_id = (await client.post("/users", json={"email": "replica@test.com"})).json()["id"]
+
+            # the replica is a separate empty database, the write only went to the primary
+            r = await client.get("/users", params={"user_id": user_id})
+            assert r.status_code == httpx.codes.OK
+            assert r.json() == []
+
+            r = await client.get("/users", params={"user_id": user_id}, headers={READ_PRIMARY_HEADER: "true"})
+            assert [user["id"] for user in r.json()] == [user_id]
+
+    async def test_round_robin_and_fallback_to_primary(
+        self, database: Database, replica_session_maker: async_sessionmaker[AsyncSession]
+    ):
+        broken_engine = create_async_engine("sqlite+aiosqlite:////nonexistent/dir/replica.db", poolclass=NullPool)
+        broken_session_maker = async_sessionmaker(broken_engine, expire_on_commit=False)
+        router = ReadReplicaRouter(
+            database.read_session_maker, [replica_session_maker, broken_session_maker], retry_after=60
+        )
+
+        async with router.session() as session:
+            assert session.bind is replica_session_maker.kw["bind"]
+        # the broken replica is skipped in favor of the next working one
+        async with router.session() as session:
+            assert session.bind is replica_session_maker.kw["bind"]
+
+        router = ReadReplicaRouter(database.read_session_maker, [broken_session_maker])
+        async with router.session() as session:
+            assert session.bind is database.engine
+        await broken_engine.dispose()
+
+    async def test_lifespan_warms_up_and_disposes_pool(self, tmp_path):
+        settings = Settigns(
+            DB=DatabaseSettings(URL=f"sqlite+aiosqlite:///{tmp_path / 'warm.db'}", POOL_WARMUP_CONNECTIONS=3)
+        )
+        app = create_app(settings)
+        async with app.router.lifespan_context(app):
+            pool = app.state.database.engine.pool
+            assert pool.checkedin() == 3
+            assert pool.checkedout() == 0
+        assert pool.checkedin() == 0
+
+    async def test_settings_require_database(self, monkeypatch: pytest.MonkeyPatch):
+        for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB", "POSTGRES_HOST", "POSTGRES_PORT", "DB__URL"):
+            monkeypatch.delenv(name, raising=False)
+        with pytest.raises(ValueError):
+            Settigns(_env_file=None)
+
+    async def test_sqlite_pragmas(self, database: Database):
+        async with database.engine.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+            # NORMAL
+            assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1
+            assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+            assert (await conn.execute(text("PRAGMA mmap_size"))).scalar() == 256 * 1024 * 1024
+
+    async def test_forked_pool_opens_own_connections(self, tmp_path, monkeypatch: pytest.MonkeyPatch):
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'fork.db'}", DatabaseSettings(POOL_SIZE=1))
+        async with engine.connect() as conn:
+            parent_connection = (await conn.get_raw_connection()).driver_connection
+
+        # the pooled connection was opened by the parent process
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("SELECT 1"))).scalar() == 1
+            assert (await conn.get_raw_connection()).driver_connection is not parent_connection
+        await engine.dispose()
+        # dropped by the pool without closing, its owner closes it
+        await parent_connection.close()
+
+    async def test_worker_count(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(os, "cpu_count", lambda: 3)
+        assert worker_count(ServerSettings(WORKERS=2, ALLOW_PER_WORKER_STATE=True)) == 2
+        assert worker_count(ServerSettings(WORKERS=0, ALLOW_PER_WORKER_STATE=True)) == 3
+        with pytest.raises(ValidationError):
+            ServerSettings(WORKERS=2)
+
+    async def test_migrations_apply_on_sqlite(self, tmp_path):
+        env = {**os.environ, "DB__URL": f"sqlite+aiosqlite:///{tmp_path / 'migrations.db'}"}
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for command in (("upgrade", "head"), ("check",), ("downgrade", "base"), ("upgrade", "head")):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "alembic", *command, cwd=root, env=env, stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            assert process.returncode == 0, stderr.decode()
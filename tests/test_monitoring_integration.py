@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import DatabaseSettings, MonitoringSettings, RouteClassLimits, TracingSettings
+from src.database import Database, create_engine
+from src.monitoring.instrumentation import RepeatedQueryError, collect_queries
+from src.monitoring.metrics import SQL_COMPILE_CACHE, MetricsRegistry
+from src.monitoring.services.monitoring import MonitoringService
+from src.monitoring.tracing import Tracer
+from src.users.models import User
+from src.users.services.users import UsersService
+from src.utils.admission import AdmissionController, RouteClassEnum
+
+
+@pytest.mark.asyncio
+class TestMonitoring:
+    base_url = "/monitoring"
+
+    async def test_get_pool_status(self, client: httpx.AsyncClient):
+        response = await client.get(f"{self.base_url}/pool")
+        assert response.status_code == httpx.codes.OK
+        data = response.json()
+        assert data["pool_class"] == "InstrumentedAsyncAdaptedQueuePool"
+        assert data["size"] == DatabaseSettings().POOL_SIZE
+        assert data["checked_out"] == 0
+
+    async def test_pool_status_records_checkouts(self, tmp_path):
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", DatabaseSettings(POOL_SIZE=2))
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            pool_status = MonitoringService().get_pool_status(engine.pool)
+            assert pool_status.checked_out == 1
+        await engine.dispose()
+
+        assert pool_status.checkouts == 1
+        assert pool_status.wait_max_seconds is not None and pool_status.wait_max_seconds >= 0
+
+    async def test_server_timing_header(self, client: httpx.AsyncClient):
+        response = await client.get("/users")
+        assert response.status_code == httpx.codes.OK
+        db_timing, app_timing = response.headers["server-timing"].split(", ")
+        assert db_timing.startswith("db;dur=")
+        assert app_timing.startswith("app;dur=")
+        queries_count = int(db_timing.split('desc="')[1].split()[0])
+        assert queries_count >= 1
+
+        for index in range(3):
+            await client.post("/users", json={"email": f"timing_{index}@example.com"})
+
+        # users and their balances are loaded with a fixed number of queries
+        response = await client.get("/users")
+        assert f'desc="{queries_count} queries"' in response.headers["server-timing"]
+
+    async def test_slow_request_log(
+        self, client: httpx.AsyncClient, database: Database, monkeypatch, caplog: pytest.LogCaptureFixture
+    ):
+        monkeypatch.setattr(database.settings, "MONITORING", MonitoringSettings(SLOW_REQUEST_MS=0))
+        with caplog.at_level(logging.WARNING, logger="src.monitoring.instrumentation"):
+            response = await client.get("/users", params={"email": "slow_request@example.com"})
+
+        assert response.status_code == httpx.codes.OK
+        [record] = caplog.records
+        stats = record.request_stats
+        assert stats["method"] == "GET"
+        assert stats["path"] == "/users"
+        assert stats["status"] == httpx.codes.OK
+        assert stats["db_queries"] >= 1
+        assert stats["slowest_query"] is not None
+
+    async def test_repeated_queries_detected(self, database: Database):
+        async with database.engine.connect() as conn:
+            with collect_queries(repeated_threshold=2) as stats:
+                for _ in range(3):
+                    await conn.execute(text("SELECT 1"))
+                await conn.execute(text("SELECT 2"))
+
+            assert stats.count == 4
+            assert stats.repeated_statements() == {"SELECT 1": 3}
+
+            with pytest.raises(RepeatedQueryError), collect_queries(repeated_threshold=2, raise_on_repeated=True):
+                for _ in range(3):
+                    await conn.execute(text("SELECT 1"))
+
+    async def test_compile_cache_counted(self, tmp_path):
+        statement = select(literal(1))
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}", DatabaseSettings())
+        uncached_engine = create_engine(
+            f"sqlite+aiosqlite:///{tmp_path / 'uncached.db'}", DatabaseSettings(QUERY_CACHE_SIZE=0)
+        )
+        before = {result: SQL_COMPILE_CACHE.value(result) for result in ("hit", "miss", "disabled")}
+
+        async with engine.connect() as conn:
+            for _ in range(3):
+                await conn.execute(statement)
+        async with uncached_engine.connect() as conn:
+            await conn.execute(statement)
+        await engine.dispose()
+        await uncached_engine.dispose()
+
+        assert SQL_COMPILE_CACHE.value("miss") - before["miss"] == 1
+        assert SQL_COMPILE_CACHE.value("hit") - before["hit"] == 2
+        assert SQL_COMPILE_CACHE.value("disabled") - before["disabled"] == 1
+
+    async def test_hot_statements_cached(self, db_session: AsyncSession):
+        user = User(email="compile_cache@example.com")
+        db_session.add(user)
+        await db_session.commit()
+
+        users_service = UsersService()
+        await users_service.get_active_user(db_session, user.id)
+        hits = SQL_COMPILE_CACHE.value("hit")
+        misses = SQL_COMPILE_CACHE.value("miss")
+        assert (await users_service.get_active_user(db_session, user.id)).id == user.id
+        await db_session.commit()
+
+        assert SQL_COMPILE_CACHE.value("hit") == hits + 1
+        assert SQL_COMPILE_CACHE.value("miss") == misses
+
+    async def test_metrics_registry_render(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "Test counter", ("kind",))
+        histogram = registry.histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0))
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        assert registry.render().splitlines() == [
+            "# HELP test_total Test counter",
+            "# TYPE test_total counter",
+            'test_total{kind="a\\"b"} 3',
+            "# HELP test_seconds Test histogram",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            "test_seconds_sum 3.65",
+            "test_seconds_count 4",
+        ]
+        with pytest.raises(ValueError):
+            registry.counter("test_total", "Duplicate")
+
+    async def test_traces_of_sampled_request(self, client: httpx.AsyncClient):
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        response = await client.get("/users", headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"})
+        assert response.status_code == httpx.codes.OK
+        assert response.headers["x-trace-id"] == trace_id
+
+        response = await client.get(f"{self.base_url}/traces", params={"trace_id": trace_id})
+        assert response.status_code == httpx.codes.OK
+        spans = {span["name"]: span for span in response.json()}
+        root = spans["GET /users"]
+        assert root["parent_id"] == "00f067aa0ba902b7"
+        assert root["attributes"]["status"] == httpx.codes.OK
+        handler = spans["handler get_users"]
+        assert handler["parent_id"] == root["span_id"]
+        service = spans["UsersService.get_users_with_relations"]
+        assert service["parent_id"] == handler["span_id"]
+        version = spans["UsersService.get_users_version"]
+        assert version["parent_id"] == handler["span_id"]
+        statements = [span for span in response.json() if span["name"] == "db.statement"]
+        assert statements and all(span["parent_id"] in (service["span_id"], version["span_id"]) for span in statements)
+        assert all(span["trace_id"] == trace_id for span in response.json())
+
+    async def test_traces_not_sampled(self, client: httpx.AsyncClient):
+        trace_id = "0af7651916cd43dd8448eb211c80319c"
+        response = await client.get("/users", headers={"X-Trace-Id": trace_id})
+        assert response.headers["x-trace-id"] == trace_id
+
+        response = await client.get(f"{self.base_url}/traces", params={"trace_id": trace_id})
+        assert response.status_code == httpx.codes.OK
+        assert response.json() == []
+
+    async def test_jsonl_exporter_rotation(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        tracer = Tracer(TracingSettings(SAMPLE_RATE=1, EXPORTER="jsonl", FILE_PATH=str(path), FILE_MAX_BYTES=2000))
+        for _ in range(20):
+            root, _trace_id = tracer.start_request_span("GET /test", {})
+            assert root is not None
+            root.child("child", {"key": "value"}).end()
+            root.end()
+        tracer.close()
+
+        assert (tmp_path / "traces.jsonl.1").exists()
+        span = json.loads(path.read_text().splitlines()[-1])
+        assert span["name"] == "GET /test"
+        assert span["parent_id"] is None
+        assert span["duration_ms"] >= 0
+
+    async def test_admission_queue_limits(self):
+        limits = RouteClassLimits(CONCURRENCY=1, QUEUE_SIZE=1, QUEUE_TIMEOUT=0.05, STATEMENT_TIMEOUT_MS=0)
+        controller = AdmissionController(RouteClassEnum.WRITE, limits, retry_after=3)
+        released = asyncio.Event()
+
+        async def hold_slot() -> None:
+            async with controller.admit():
+                await released.wait()
+
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        assert controller.waiting == 1
+
+        # the queue is full
+        with pytest.raises(HTTPException) as exc_info:
+            async with controller.admit():
+                pass
+        assert exc_info.value.status_code == 503
+        assert exc_info.value.headers == {"Retry-After": "3"}
+
+        # the queued request times out while the slot is held
+        with pytest.raises(HTTPException):
+            await waiter
+        assert controller.waiting == 0
+
+        released.set()
+        await holder
+        async with controller.admit():
+            pass
+
+    async def test_overloaded_route_class_rejected(self, client: httpx.AsyncClient, test_app: FastAPI):
+        controllers = test_app.state.admission
+        limits = RouteClassLimits(CONCURRENCY=0, QUEUE_SIZE=0, QUEUE_TIMEOUT=0, STATEMENT_TIMEOUT_MS=0)
+        test_app.state.admission = {
+            **controllers,
+            RouteClassEnum.ANALYTICS: AdmissionController(RouteClassEnum.ANALYTICS, limits, retry_after=1),
+        }
+        try:
+            response = await client.get("/transactions/analysis")
+            assert response.status_code == httpx.codes.SERVICE_UNAVAILABLE
+            assert response.headers["retry-after"] == "1"
+            # other route classes are not affected
+            assert (await client.get("/users")).status_code == httpx.codes.OK
+        finally:
+            test_app.state.admission = controllers
+
+        metrics = (await client.get("/metrics")).text
+        assert 'admission_rejected_total{route_class="analytics",reason="queue_full"}' in metrics
+        assert 'admission_limit{route_class="read",limit="concurrency"}' in metrics
@@ -0,0 +1,33 @@
+import pytest
+from pydantic import ValidationError
+
+from src.config import RateLimitSettings
+from src.utils.rate_limit import TokenBucketStore
+
+
+class TestRateLimit:
+    def test_token_bucket_store(self):
+        store = TokenBucketStore(rate=2, burst=2, max_keys=3)
+        assert store.take("a", now=0) == 0
+        assert store.take("a", now=0) == 0
+        assert store.take("a", now=0) == pytest.approx(0.5)
+        assert store.take("a", now=0.25) == pytest.approx(0.25)
+        assert store.take("a", now=0.5) == 0
+
+        # the least recently used buckets are dropped beyond `max_keys`
+        for key in ("b", "c", "d"):
+            store.take(key, now=0.5)
+        assert len(store) == 3
+        assert store.take("a", now=0.5) == 0  # a new full bucket
+        # idle buckets are dropped once refilled
+        store.take("e", now=10)
+        store.take("e", now=10)
+        assert len(store) <= 2
+
+        # every bucket dropped by the expiry
+        assert TokenBucketStore(rate=1, burst=1, max_keys=0).take("a", now=0) == 0
+
+    def test_rate_limit_settings(self):
+        for invalid in ({"USER_RATE": 0}, {"CLIENT_BURST": 0}):
+            with pytest.raises(ValidationError):
+                RateLimitSettings(**invalid)
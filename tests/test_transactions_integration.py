@@ -1,8 +1,53 @@
+import argparse
+import asyncio
+import json
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any
+
 import httpx
 import pytest
+from fastapi import FastAPI
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.analytics.services.analytics import EXCHANGE_RATES_TO_USD
+from src.cli import exchange_rate, set_exchange_rates
+from src.config import RateLimitSettings
+from src.database import Database
+from src.monitoring.metrics import HTTP_REQUESTS, RATE_LIMITED, TRANSACTION_OPERATIONS
 from src.transactions.enums import TransactionStatusEnum
+from src.transactions.models import Transaction
+from src.transactions.schemas import RequestTransactionModel
+from src.transactions.services.archive import TransactionArchiveService
+from src.transactions.services.partitions import TransactionPartitionsService, monthly_partitions
+from src.transactions.services.transactions import TransactionsService
 from src.users.enums import CurrencyEnum
+from src.users.models import BalanceLedgerEntry, UserBalance
+from src.users.services.balance_ledger import BalanceLedgerService, run_compactor
+from src.users.services.balance_snapshots import BalanceSnapshotService
+from src.users.services.balance_stream import balance_topic
+from src.utils.pubsub import PubSubHub
+from src.utils.rate_limit import RateLimiter
+from src.utils.utils import utc_now
+from tests.conftest import test_settings
+
+
+@contextmanager
+def collect_statements(database: Database) -> Iterator[list[str]]:
+    """SQL statements sent to the database meanwhile."""
+    statements: list[str] = []
+
+    def collect(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(database.engine.sync_engine, "before_cursor_execute", collect)
+    try:
+        yield statements
+    finally:
+        event.remove(database.engine.sync_engine, "before_cursor_execute", collect)
 
 
 @pytest.mark.asyncio
@@ -74,19 +119,506 @@ class TestTransactions:
         assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
         assert "XYZ" in str(response.json()) or "currency" in str(response.json())
 
-    async def test_patch_rollback_transaction_success(self, client: httpx.AsyncClient):
+    async def test_patch_rollback_transaction_success(self, client: httpx.AsyncClient, database: Database):
         user_id = (await client.post("/users", json={"email": "rollback@test.com"})).json()["id"]
         tx_id = (
             await client.post(f"{self.base_url}/{user_id}", json={"amount": 100.0, "currency": CurrencyEnum.USD})
         ).json()["id"]
 
-        response = await client.patch(f"{self.base_url}/{tx_id}/user/{user_id}/rollback")
+        with collect_statements(database) as statements:
+            response = await client.patch(f"{self.base_url}/{tx_id}/user/{user_id}/rollback")
         assert response.status_code == httpx.codes.OK
         data = response.json()
         assert data["id"] == tx_id
         assert data["status"] == TransactionStatusEnum.ROLL_BACKED
+        # the partitioning key narrows the locked and updated transaction to its partition
+        updates = [statement for statement in statements if statement.startswith('UPDATE "transaction"')]
+        assert len(updates) == 1
+        assert 'WHERE "transaction".id = ? AND "transaction".created = ?' in updates[0]
 
     async def test_patch_rollback_nonexistent_transaction(self, client: httpx.AsyncClient):
         user_id = (await client.post("/users", json={"email": "no_tx@test.com"})).json()["id"]
         response = await client.patch(f"{self.base_url}/99999/user/{user_id}/rollback")
         assert response.status_code == httpx.codes.BAD_REQUEST
+
+    async def test_get_transactions_summary(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "summary@test.com"})).json()["id"]
+        for amount in (100.0, 50.0, -30.0):
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": amount, "currency": CurrencyEnum.USD})
+        tx_id = (
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 20.0, "currency": CurrencyEnum.USD})
+        ).json()["id"]
+        await client.patch(f"{self.base_url}/{tx_id}/user/{user_id}/rollback")
+        await client.post(f"{self.base_url}/{user_id}", json={"amount": 5.0, "currency": CurrencyEnum.EUR})
+
+        response = await client.get(f"{self.base_url}/summary", params={"user_id": user_id})
+        assert response.status_code == httpx.codes.OK
+        eur, usd = response.json()
+        assert eur["currency"] == CurrencyEnum.EUR
+        assert eur["transactions_count"] == 1
+        assert usd["transactions_count"] == 4
+        assert usd["deposits_count"] == 2
+        assert usd["deposits_amount"] == 150.0
+        assert usd["withdrawals_count"] == 1
+        assert usd["withdrawals_amount"] == 30.0
+        assert usd["rollbacks_count"] == 1
+        assert usd["rollbacks_amount"] == 20.0
+        assert usd["first_transaction"] <= usd["last_transaction"]
+
+    async def test_get_transactions_summary_invalid_user_id(self, client: httpx.AsyncClient):
+        response = await client.get(f"{self.base_url}/summary", params={"user_id": 0})
+        assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+
+    async def test_metrics_record_transaction_outcomes(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "metrics@example.com"})).json()["id"]
+        created_before = TRANSACTION_OPERATIONS.value("create", "success")
+        rejected_before = TRANSACTION_OPERATIONS.value("create", "NotEnoughBalanceException")
+        requests_before = HTTP_REQUESTS.value("POST", "/transactions/{user_id}", "400")
+
+        response = await client.post(f"/transactions/{user_id}", json={"amount": 10.0, "currency": CurrencyEnum.USD})
+        assert response.status_code == httpx.codes.OK
+        response = await client.post(f"/transactions/{user_id}", json={"amount": -50.0, "currency": CurrencyEnum.USD})
+        assert response.status_code == httpx.codes.BAD_REQUEST
+
+        assert TRANSACTION_OPERATIONS.value("create", "success") == created_before + 1
+        assert TRANSACTION_OPERATIONS.value("create", "NotEnoughBalanceException") == rejected_before + 1
+        assert HTTP_REQUESTS.value("POST", "/transactions/{user_id}", "400") == requests_before + 1
+
+        response = await client.get("/metrics")
+        assert response.status_code == httpx.codes.OK
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text_format = response.text
+        assert "# TYPE http_request_duration_seconds histogram" in text_format
+        assert 'http_request_duration_seconds_bucket{method="POST",route="/transactions/{user_id}",le="+Inf"}' in (
+            text_format
+        )
+        assert 'transaction_operations_total{operation="create",outcome="NotEnoughBalanceException"}' in text_format
+        assert "db_pool_wait_seconds_count" in text_format
+
+    async def test_post_transaction_trace(self, client: httpx.AsyncClient, database: Database):
+        user_id = (await client.post("/users", json={"email": "traced@test.com"})).json()["id"]
+        trace_id = "5c1e2b7a9d3f4e6a8b0c1d2e3f4a5b6c"
+
+        response = await client.post(
+            f"{self.base_url}/{user_id}",
+            json={"amount": 10.0, "currency": CurrencyEnum.USD},
+            headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"},
+        )
+        assert response.status_code == httpx.codes.OK
+
+        spans = (await client.get("/monitoring/traces", params={"trace_id": trace_id})).json()
+        by_id = {span["span_id"]: span for span in spans}
+        names = {span["name"] for span in spans}
+        assert {
+            "POST /transactions/{user_id}",
+            "handler post_transaction",
+            "TransactionsService.create_user_transaction",
+            "UsersService.get_active_user",
+            "session.flush",
+        } <= names
+        # the ledger compactor refreshes the portfolios
+        assert ("PortfolioService.refresh_portfolios" in names) == (database.settings.BALANCE_MODE == "locking")
+        flush = next(span for span in spans if span["name"] == "session.flush")
+        assert by_id[flush["parent_id"]]["name"] == "TransactionsService.create_user_transaction"
+        assert any(
+            by_id[span["parent_id"]]["name"] == "session.flush" for span in spans if span["name"] == "db.statement"
+        )
+
+    async def test_get_transactions_created_range(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "range@test.com"})).json()["id"]
+        transaction = (
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 5.0, "currency": CurrencyEnum.USD})
+        ).json()
+        created = datetime.fromisoformat(transaction["created"])
+
+        params = {
+            "user_id": user_id,
+            "created_from": (created - timedelta(minutes=1)).isoformat(),
+            "created_to": (created + timedelta(minutes=1)).isoformat(),
+        }
+        response = await client.get(self.base_url, params=params)
+        assert response.status_code == httpx.codes.OK
+        assert [row["id"] for row in response.json()] == [transaction["id"]]
+
+        params["created_from"] = (created + timedelta(minutes=1)).isoformat() + "+00:00"
+        params["created_to"] = (created + timedelta(days=40)).isoformat() + "+00:00"
+        response = await client.get(self.base_url, params=params)
+        assert response.json() == []
+
+    async def test_weekly_reports_exchange_rates(self, client: httpx.AsyncClient, database: Database):
+        user_id = (await client.post("/users", json={"email": "reported_rates@test.com"})).json()["id"]
+        # a week of its own within the archive horizon, the reports sum the transactions of every user
+        created = utc_now().date() - timedelta(weeks=20)
+        body = f"user_id,currency,amount,created\n{user_id},ARS,1000,{created.isoformat()}T12:00:00\n"
+        await client.post(f"{self.base_url}/import", params={"key": f"rates-{user_id}"}, content=body)
+
+        async def deposit_amount_usd() -> float:
+            reports = (await client.get(f"{self.base_url}/analysis")).json()
+            (report,) = (
+                report for report in reports if report["week_start"] <= created.isoformat() <= report["week_end"]
+            )
+            return report["deposit_amount_usd"]
+
+        assert await deposit_amount_usd() == round(1000 * EXCHANGE_RATES_TO_USD[CurrencyEnum.ARS], 2)
+        # the rates of `exchange_rate`, set by the CLI, are the rates of the reports
+        await set_exchange_rates(database, argparse.Namespace(rates=[exchange_rate("ARS=0.002")]))
+        try:
+            assert await deposit_amount_usd() == 2.0
+            assert (await client.get(f"/users/{user_id}/portfolio")).json()["balances"][0]["rate_to_usd"] == 0.002
+        finally:
+            rates = {CurrencyEnum.ARS: EXCHANGE_RATES_TO_USD[CurrencyEnum.ARS]}
+            await set_exchange_rates(database, argparse.Namespace(rates=rates.items()))
+
+    async def test_transaction_partitions(self, db_session: AsyncSession):
+        assert monthly_partitions(date(2025, 11, 15), date(2026, 2, 1)) == [
+            ("transaction_y2025m11", date(2025, 11, 1), date(2025, 12, 1)),
+            ("transaction_y2025m12", date(2025, 12, 1), date(2026, 1, 1)),
+            ("transaction_y2026m01", date(2026, 1, 1), date(2026, 2, 1)),
+            ("transaction_y2026m02", date(2026, 2, 1), date(2026, 3, 1)),
+        ]
+        # SQLite keeps a single transaction table
+        assert await TransactionPartitionsService().create_future_partitions(db_session) == []
+
+    async def test_archive_transactions(self, client: httpx.AsyncClient, db_session: AsyncSession):
+        user_id = (await client.post("/users", json={"email": "archived@test.com"})).json()["id"]
+        deposit = (
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 100.0, "currency": CurrencyEnum.USD})
+        ).json()
+        rollbacked = (
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 50.0, "currency": CurrencyEnum.USD})
+        ).json()
+        await client.patch(f"{self.base_url}/{rollbacked['id']}/user/{user_id}/rollback")
+
+        # older than the archive horizon, still in the weekly reports
+        old = utc_now() - timedelta(days=200)
+        async with db_session.begin():
+            await db_session.execute(update(UserBalance).where(UserBalance.user_id == user_id).values(created=old))
+            await db_session.execute(
+                update(Transaction).where(Transaction.id == deposit["id"]).values(created=old + timedelta(days=1))
+            )
+            await db_session.execute(
+                update(Transaction)
+                .where(Transaction.id == rollbacked["id"])
+                .values(created=old + timedelta(days=2), rollbacked=old + timedelta(days=3))
+            )
+
+        reports = (await client.get(f"{self.base_url}/analysis")).json()
+        summary = (await client.get(f"{self.base_url}/summary", params={"user_id": user_id})).json()
+
+        archived = await TransactionArchiveService().archive_transactions(db_session, horizon_days=180)
+        assert archived == 2
+        response = await client.get(self.base_url, params={"user_id": user_id})
+        assert [row["id"] for row in response.json()] == [rollbacked["id"], deposit["id"]]
+        response = await client.get(
+            self.base_url, params={"user_id": user_id, "created_from": (utc_now() - timedelta(days=1)).isoformat()}
+        )
+        assert response.json() == []
+        assert (await client.get(f"{self.base_url}/analysis")).json() == reports
+        assert (await client.get(f"{self.base_url}/summary", params={"user_id": user_id})).json() == summary
+        assert summary[0]["transactions_count"] == 2
+
+        response = await client.get(
+            f"{self.base_url}/export", params={"user_id": user_id, "created_from": old.isoformat()}
+        )
+        assert response.status_code == httpx.codes.OK
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [(row["id"], row["status"]) for row in rows] == [
+            (deposit["id"], TransactionStatusEnum.PROCESSED),
+            (rollbacked["id"], TransactionStatusEnum.ROLL_BACKED),
+        ]
+
+        for at, expected in ((old + timedelta(days=2, hours=1), 150.0), (old + timedelta(days=4), 100.0)):
+            balances = (await client.get(f"/users/{user_id}/balances", params={"at": at.isoformat()})).json()
+            assert {"currency": CurrencyEnum.USD, "amount": expected} in balances
+        async with AsyncSession(db_session.bind) as session:
+            assert (
+                await BalanceSnapshotService(test_settings.BALANCE_SNAPSHOT_INTERVAL).check_consistency(
+                    session, user_id=user_id
+                )
+                == []
+            )
+
+        response = await client.patch(f"{self.base_url}/{deposit['id']}/user/{user_id}/rollback")
+        assert response.status_code == httpx.codes.BAD_REQUEST
+        assert "archived" in response.json()["detail"]
+
+    async def test_export_transactions_in_batches(self, client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch):
+        user_id = (await client.post("/users", json={"email": "export@test.com"})).json()["id"]
+        ids = [
+            (
+                await client.post(f"{self.base_url}/{user_id}", json={"amount": amount, "currency": CurrencyEnum.USD})
+            ).json()["id"]
+            for amount in (10.0, 20.0, 30.0)
+        ]
+        monkeypatch.setattr("src.transactions.services.transactions.EXPORT_BATCH_SIZE", 2)
+
+        response = await client.get(f"{self.base_url}/export", params={"user_id": user_id})
+        assert response.status_code == httpx.codes.OK
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [(row["id"], row["amount"]) for row in rows] == list(zip(ids, (10.0, 20.0, 30.0)))
+
+    async def test_import_transactions(self, client: httpx.AsyncClient, database: Database, db_session: AsyncSession):
+        user_id = (await client.post("/users", json={"email": "imported@test.com"})).json()["id"]
+        body = (
+            "user_id,currency,amount,created,rollbacked\n"
+            f"{user_id},USD,100.50,2024-01-10T10:00:00,\n"
+            f"{user_id},USD,-20,2024-01-11T10:00:00+02:00,\n"
+            f"{user_id},EUR,30,2024-01-12T10:00:00,2024-01-13T10:00:00\n"
+        )
+        params = {"key": f"partner-{user_id}", "chunk_size": 2}
+
+        with collect_statements(database) as statements:
+            response = await client.post(f"{self.base_url}/import", params=params, content=body)
+        assert response.status_code == httpx.codes.OK
+        result = response.json()
+        assert (result["status"], result["rows_imported"], result["rows_skipped"]) == ("DONE", 3, 0)
+        # the recomputation locks the ledger entries before the balances, in the order of the ledger compactor
+        locks = [
+            statement.split()[1]
+            for statement in statements
+            if statement.startswith(("SELECT balance_ledger_entry.id", "SELECT user_balance.id"))
+        ]
+        assert locks == ["balance_ledger_entry.id", "user_balance.id"]
+        assert result["balances_updated"] == len(CurrencyEnum)
+
+        balances = (await client.get(f"/users/{user_id}/balances")).json()
+        assert {"currency": CurrencyEnum.USD, "amount": 80.5} in balances
+        assert {"currency": CurrencyEnum.EUR, "amount": 0.0} in balances
+        balances = (await client.get(f"/users/{user_id}/balances", params={"at": "2024-01-10T12:00:00"})).json()
+        assert {"currency": CurrencyEnum.USD, "amount": 100.5} in balances
+        async with AsyncSession(db_session.bind) as session:
+            assert (
+                await BalanceSnapshotService(test_settings.BALANCE_SNAPSHOT_INTERVAL).check_consistency(
+                    session, user_id=user_id
+                )
+                == []
+            )
+
+        # a finished import is not imported again
+        response = await client.post(f"{self.base_url}/import", params=params, content=body)
+        assert (response.json()["rows_imported"], response.json()["rows_skipped"]) == (0, 3)
+
+    async def test_import_transactions_resume(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "resumed@test.com"})).json()["id"]
+        rows = [
+            {"user_id": user_id, "currency": "USD", "amount": 10, "created": "2024-02-01T00:00:00"},
+            {"user_id": user_id, "currency": "USD", "amount": 20, "created": "2024-02-02T00:00:00"},
+            {"user_id": user_id, "currency": "USD", "amount": 0, "created": "2024-02-03T00:00:00"},
+        ]
+        params = {"key": f"partner-{user_id}", "format": "ndjson", "chunk_size": 2}
+
+        response = await client.post(
+            f"{self.base_url}/import", params=params, content="\n".join(json.dumps(row) for row in rows)
+        )
+        assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+        assert response.json()["detail"].startswith("Invalid transaction on line 3: amount")
+
+        rows[2]["amount"] = 30
+        response = await client.post(
+            f"{self.base_url}/import", params=params, content="\n".join(json.dumps(row) for row in rows)
+        )
+        assert (response.json()["rows_imported"], response.json()["rows_skipped"]) == (1, 2)
+        balances = (await client.get(f"/users/{user_id}/balances")).json()
+        assert {"currency": CurrencyEnum.USD, "amount": 60.0} in balances
+
+    async def test_import_transactions_multiline_csv(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "multiline@test.com"})).json()["id"]
+        rows = (
+            "user_id,currency,amount,created,reference\n"
+            f'{user_id},USD,10,2024-03-01T00:00:00,"invoice 1\n\nsee ""notes"""\n'
+            f"{user_id},USD,5,2024-03-02T00:00:00,invoice 2\n"
+        )
+        params = {"key": f"partner-{user_id}", "chunk_size": 2}
+
+        response = await client.post(f"{self.base_url}/import", params=params, content=rows + f"{user_id},USD,0,,\n")
+        assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+        assert response.json()["detail"].startswith("Invalid transaction on line 6: amount")
+
+        response = await client.post(f"{self.base_url}/import", params=params, content=rows)
+        assert (response.json()["rows_imported"], response.json()["rows_skipped"]) == (0, 2)
+        balances = (await client.get(f"/users/{user_id}/balances")).json()
+        assert {"currency": CurrencyEnum.USD, "amount": 15.0} in balances
+
+        response = await client.post(
+            f"{self.base_url}/import", params={"key": f"unclosed-{user_id}"}, content=rows + f'{user_id},USD,1,"\n'
+        )
+        assert response.json()["detail"] == "Invalid transaction on line 6: unclosed quoted value"
+
+    async def test_get_transactions_not_modified(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "etag_transactions@test.com"})).json()["id"]
+        transaction = (
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 5.0, "currency": CurrencyEnum.USD})
+        ).json()
+        params = {"user_id": user_id}
+        etag = (await client.get(self.base_url, params=params)).headers["etag"]
+
+        response = await client.get(self.base_url, params=params, headers={"If-None-Match": f'"other", {etag}'})
+        assert response.status_code == httpx.codes.NOT_MODIFIED
+
+        await client.patch(f"{self.base_url}/{transaction['id']}/user/{user_id}/rollback")
+        response = await client.get(self.base_url, params=params, headers={"If-None-Match": etag})
+        assert response.status_code == httpx.codes.OK
+        assert response.json()[0]["status"] == TransactionStatusEnum.ROLL_BACKED
+        etag = response.headers["etag"]
+
+        await client.post(f"{self.base_url}/{user_id}", json={"amount": 1.0, "currency": CurrencyEnum.USD})
+        response = await client.get(self.base_url, params=params, headers={"If-None-Match": etag})
+        assert response.status_code == httpx.codes.OK
+        assert len(response.json()) == 2
+
+    async def test_post_transaction_rate_limited(self, client: httpx.AsyncClient, test_app: FastAPI):
+        user_id = (await client.post("/users", json={"email": "rate_limited@test.com"})).json()["id"]
+        other_user_id = (await client.post("/users", json={"email": "not_rate_limited@test.com"})).json()["id"]
+        limiter = test_app.state.rate_limiter
+        test_app.state.rate_limiter = RateLimiter(
+            RateLimitSettings(USER_RATE=0.5, USER_BURST=1, CLIENT_RATE=1000, CLIENT_BURST=1000)
+        )
+        limited_before = RATE_LIMITED.value("user")
+        tx_data = {"amount": 10.0, "currency": CurrencyEnum.USD}
+        try:
+            assert (await client.post(f"{self.base_url}/{user_id}", json=tx_data)).status_code == httpx.codes.OK
+            response = await client.post(f"{self.base_url}/{user_id}", json=tx_data)
+            assert response.status_code == httpx.codes.TOO_MANY_REQUESTS
+            assert response.headers["retry-after"] == "2"
+            # the same user, whatever the spelling of its id
+            response = await client.post(f"{self.base_url}/00{user_id}", json=tx_data)
+            assert response.status_code == httpx.codes.TOO_MANY_REQUESTS
+            # the other users are not limited
+            response = await client.post(f"{self.base_url}/{other_user_id}", json=tx_data)
+            assert response.status_code == httpx.codes.OK
+        finally:
+            test_app.state.rate_limiter = limiter
+        assert RATE_LIMITED.value("user") == limited_before + 2
+
+    async def test_ledger_balance_mode(self, client: httpx.AsyncClient, database: Database, db_session: AsyncSession):
+        settings = database.settings
+        database.settings = settings.model_copy(update={"BALANCE_MODE": "ledger"})
+        try:
+            user_id = (await client.post("/users", json={"email": "ledger@test.com"})).json()["id"]
+            responses = await asyncio.gather(
+                *(
+                    client.post(f"{self.base_url}/{user_id}", json={"amount": 10.0, "currency": CurrencyEnum.EUR})
+                    for _ in range(5)
+                )
+            )
+            assert all(response.status_code == httpx.codes.OK for response in responses)
+            withdrawal = await client.post(f"{self.base_url}/{user_id}", json={"amount": -20.0, "currency": "EUR"})
+            assert withdrawal.status_code == httpx.codes.OK
+            # the checked amount includes the pending entries
+            response = await client.post(f"{self.base_url}/{user_id}", json={"amount": -31.0, "currency": "EUR"})
+            assert response.status_code == httpx.codes.BAD_REQUEST
+            response = await client.patch(f"{self.base_url}/{responses[0].json()['id']}/user/{user_id}/rollback")
+            assert response.status_code == httpx.codes.OK
+
+            balance_query = select(UserBalance.amount).where(
+                UserBalance.user_id == user_id, UserBalance.currency == CurrencyEnum.EUR
+            )
+            entries_query = select(func.count()).where(BalanceLedgerEntry.user_id == user_id)
+            async with db_session.begin():
+                assert await db_session.scalar(balance_query) == 0
+                assert await db_session.scalar(entries_query) == 7
+            balances = (await client.get("/users", params={"user_id": user_id})).json()[0]["balances"]
+            assert balances[0] == {"currency": "EUR", "amount": 20.0}
+
+            assert await BalanceLedgerService().compact_all(db_session) >= 7
+            async with db_session.begin():
+                assert await db_session.scalar(balance_query) == 20
+                assert await db_session.scalar(entries_query) == 0
+            assert (
+                await BalanceSnapshotService(test_settings.BALANCE_SNAPSHOT_INTERVAL).check_consistency(
+                    db_session, user_id=user_id
+                )
+                == []
+            )
+            portfolio = (await client.get(f"/users/{user_id}/portfolio")).json()
+            assert portfolio["balances"][0]["amount"] == 20.0
+        finally:
+            database.settings = settings
+
+    async def test_compactor_queues_with_sqlite_writers(self, client: httpx.AsyncClient, database: Database):
+        if database.writer_lock is None:
+            pytest.skip("SQLite writer queue")
+        settings = database.settings
+        database.settings = settings.model_copy(update={"BALANCE_MODE": "ledger"})
+        try:
+            user_id = (await client.post("/users", json={"email": "ledger_compactor@test.com"})).json()["id"]
+            await client.post(f"{self.base_url}/{user_id}", json={"amount": 10.0, "currency": CurrencyEnum.EUR})
+        finally:
+            database.settings = settings
+
+        async def pending_entries() -> int:
+            async with database.read_session_maker() as session:
+                return await session.scalar(select(func.count()).where(BalanceLedgerEntry.user_id == user_id)) or 0
+
+        # the compaction transactions take their turn in the writer lock like the request writers
+        async with database.writer_lock:
+            compactor = asyncio.create_task(run_compactor(database, interval=3600, batch_size=100))
+            await asyncio.sleep(0.2)
+            assert await pending_entries() == 1
+        try:
+            for _ in range(50):
+                if not await pending_entries():
+                    break
+                await asyncio.sleep(0.05)
+            else:
+                pytest.fail("the ledger entries were not compacted")
+        finally:
+            compactor.cancel()
+
+    async def test_ledger_publishes_committed_amount(
+        self, client: httpx.AsyncClient, database: Database, monkeypatch: pytest.MonkeyPatch
+    ):
+        user_id = (await client.post("/users", json={"email": "ledger_publish@test.com"})).json()["id"]
+        await client.post(f"{self.base_url}/{user_id}", json={"amount": 10.0, "currency": CurrencyEnum.EUR})
+        hub = PubSubHub(10)
+        subscription = hub.subscribe(balance_topic(user_id))
+        service = TransactionsService(database.settings.model_copy(update={"BALANCE_MODE": "ledger"}), hub)
+
+        # the amount read before the commit misses a concurrent deposit, here the previous one
+        get_amount = service.ledger_service.get_amount
+        stale_reads = [Decimal(0)]
+
+        async def get_amount_missing_deposit(*args, **kwargs):
+            return stale_reads.pop() if stale_reads else await get_amount(*args, **kwargs)
+
+        monkeypatch.setattr(service.ledger_service, "get_amount", get_amount_missing_deposit)
+        async with database.session_maker() as session:
+            created = await service.create_user_transaction(
+                session, RequestTransactionModel(amount=5.0, currency=CurrencyEnum.EUR), user_id
+            )
+            await service.rollback(session, user_id, created.id)
+
+        assert (await subscription.get(timeout=1)).balance.amount == 15.0
+        assert (await subscription.get(timeout=1)).balance.amount == 10.0
+        subscription.close()
+
+    async def test_sqlite_serializes_writes(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "sqlite_writer@test.com"})).json()["id"]
+        await client.post(f"/transactions/{user_id}", json={"amount": 100.0, "currency": "USD"})
+
+        # `with_for_update()` is a no-op on SQLite, the writer queue and `BEGIN IMMEDIATE` prevent the overdraft
+        responses = await asyncio.gather(
+            *(client.post(f"/transactions/{user_id}", json={"amount": -30.0, "currency": "USD"}) for _ in range(10))
+        )
+        assert sorted(response.status_code for response in responses) == [200] * 3 + [400] * 7
+        balances = (await client.get(f"/users/{user_id}/balances")).json()
+        assert {"currency": "USD", "amount": 10.0} in balances
+
+    async def test_sqlite_writer_queue_per_transaction(self, client: httpx.AsyncClient):
+        user_id = (await client.post("/users", json={"email": "sqlite_import@test.com"})).json()["id"]
+
+        async def body() -> AsyncIterator[bytes]:
+            yield b"user_id,currency,amount,created\n"
+            yield f"{user_id},USD,100,2024-01-10T10:00:00\n".encode()
+            # the import waits for the rest of its body between its write transactions, other writers are not queued
+            response = await asyncio.wait_for(
+                client.post(f"/transactions/{user_id}", json={"amount": 5.0, "currency": "USD"}), timeout=5
+            )
+            assert response.status_code == httpx.codes.OK
+            yield f"{user_id},USD,20,2024-01-11T10:00:00\n".encode()
+
+        params = {"key": f"slow-{user_id}", "chunk_size": 1}
+        response = await client.post(f"{self.base_url}/import", params=params, content=body())
+        assert response.json()["rows_imported"] == 2
@@ -1,7 +1,25 @@
+import asyncio
+import json
+
 import httpx
 import pytest
+from fastapi import FastAPI
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.users.enums import UserStatusEnum
+from src.database import Database
+from src.monitoring.instrumentation import collect_queries
+from src.monitoring.metrics import SINGLE_FLIGHT_CALLS
+from src.users.enums import CurrencyEnum, UserStatusEnum, UserStatusUpdateResultEnum
+from src.users.models import UserBalanceSnapshot
+from src.users.services.balance_ledger import BalanceLedgerService
+from src.users.services.balance_snapshots import BalanceSnapshotService
+from src.users.services.balance_stream import balance_events, balance_topic
+from src.users.services.users import UsersService
+from src.utils.pubsub import PubSubHub, SubscriptionOverflowError
+from src.utils.singleflight import SingleFlight
+from src.utils.utils import utc_now
+from tests.conftest import test_settings
 
 
 @pytest.mark.asyncio
@@ -155,3 +173,344 @@ class TestUsers:
         users = r.json()
         assert isinstance(users, list)
         assert len(users) >= 3
+
+    async def test_patch_users_status_bulk(self, client: httpx.AsyncClient):
+        """Test bulk status update reports changed, already-in-status and missing ids."""
+        u1 = (await client.post(self.base_url, json={"email": "bulk1@test.com"})).json()["id"]
+        u2 = (await client.post(self.base_url, json={"email": "bulk2@test.com"})).json()["id"]
+        await client.patch(f"{self.base_url}/{u2}", json={"status": "BLOCKED"})
+
+        r = await client.patch(f"{self.base_url}/status", json={"status": "BLOCKED", "user_ids": [u1, u2, 999999]})
+        assert r.status_code == httpx.codes.OK
+        data = r.json()
+        assert data["status"] == UserStatusEnum.BLOCKED
+        results = {item["user_id"]: item for item in data["results"]}
+        assert results[u1]["result"] == UserStatusUpdateResultEnum.CHANGED
+        assert results[u2]["result"] == UserStatusUpdateResultEnum.ALREADY_IN_STATUS
+        assert "already blocked" in results[u2]["detail"].lower()
+        assert results[999999]["result"] == UserStatusUpdateResultEnum.NOT_FOUND
+
+        users = (await client.get(self.base_url, params={"user_id": u1})).json()
+        assert users[0]["status"] == UserStatusEnum.BLOCKED
+
+    async def test_patch_users_status_by_filter(self, client: httpx.AsyncClient):
+        """Test bulk status update selecting users by creation time."""
+        users = [(await client.post(self.base_url, json={"email": f"wave{i}@fraud.com"})).json() for i in range(3)]
+        users_filter = {"created_from": users[0]["created"], "created_to": users[-1]["created"]}
+
+        r = await client.patch(f"{self.base_url}/status", json={"status": "BLOCKED", "filter": users_filter})
+        assert r.status_code == httpx.codes.OK
+        assert [item["user_id"] for item in r.json()["results"]] == [user["id"] for user in users]
+        assert {item["result"] for item in r.json()["results"]} == {UserStatusUpdateResultEnum.CHANGED}
+
+        r = await client.patch(f"{self.base_url}/status", json={"status": "BLOCKED", "filter": users_filter})
+        assert {item["result"] for item in r.json()["results"]} == {UserStatusUpdateResultEnum.ALREADY_IN_STATUS}
+
+    async def test_patch_users_status_filter_limits(self, client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch):
+        """Test the filter email is not a pattern and a filter matching too many users updates nothing."""
+        ids = [(await client.post(self.base_url, json={"email": f"limit_{i}@test.com"})).json()["id"] for i in range(3)]
+
+        for email in ("%", "limit\\_0@test.com", "limit%@test.com"):
+            r = await client.patch(f"{self.base_url}/status", json={"status": "BLOCKED", "filter": {"email": email}})
+            assert r.json()["results"] == []
+        r = await client.patch(
+            f"{self.base_url}/status", json={"status": "BLOCKED", "filter": {"email": "LIMIT_0@test.com"}}
+        )
+        assert [item["user_id"] for item in r.json()["results"]] == [ids[0]]
+
+        monkeypatch.setattr("src.users.services.users.MAX_STATUS_UPDATE_USERS", 2)
+        r = await client.patch(
+            f"{self.base_url}/status", json={"status": "BLOCKED", "filter": {"created_from": "2000-01-01T00:00:00"}}
+        )
+        assert r.status_code == httpx.codes.BAD_REQUEST
+        assert r.json()["detail"] == "Filter matches more than 2 users, at most 2 can be updated at once"
+        users = (await client.get(self.base_url, params={"user_id": ids[1]})).json()
+        assert users[0]["status"] == UserStatusEnum.ACTIVE
+
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            {"status": "BLOCKED"},
+            {"status": "BLOCKED", "user_ids": []},
+            {"status": "BLOCKED", "user_ids": [1], "filter": {"email": "%"}},
+            {"status": "BLOCKED", "filter": {}},
+        ],
+    )
+    async def test_patch_users_status_invalid_selection(self, client: httpx.AsyncClient, payload: dict):
+        """Test bulk status update requires exactly one non-empty selection."""
+        r = await client.patch(f"{self.base_url}/status", json=payload)
+        assert r.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+
+    async def test_get_user_portfolio(self, client: httpx.AsyncClient):
+        """Test USD valuation of user balances."""
+        user_id = (await client.post(self.base_url, json={"email": "portfolio@test.com"})).json()["id"]
+        await client.post(f"/transactions/{user_id}", json={"amount": 100.0, "currency": "USD"})
+        await client.post(f"/transactions/{user_id}", json={"amount": 10.0, "currency": "EUR"})
+
+        r = await client.get(f"{self.base_url}/{user_id}/portfolio")
+        assert r.status_code == httpx.codes.OK
+        portfolio = r.json()
+        assert portfolio["user_id"] == user_id
+        assert portfolio["total_usd"] == pytest.approx(109.342)
+        assert portfolio["balances"][0]["currency"] == "USD"
+        assert portfolio["balances"][1]["amount_usd"] == pytest.approx(9.342)
+
+    async def test_get_user_portfolio_nonexistent_user(self, client: httpx.AsyncClient):
+        """Test portfolio of a non-existent user returns 404 Not Found."""
+        r = await client.get(f"{self.base_url}/999999/portfolio")
+        assert r.status_code == httpx.codes.NOT_FOUND
+
+    async def test_get_top_portfolios(self, client: httpx.AsyncClient, db_session: AsyncSession):
+        """Test richest users are listed first and the list is paginated."""
+        rich = (await client.post(self.base_url, json={"email": "rich@test.com"})).json()["id"]
+        richer = (await client.post(self.base_url, json={"email": "richer@test.com"})).json()["id"]
+        await client.post(f"/transactions/{rich}", json={"amount": 1.0, "currency": "BTC"})
+        tx_id = (await client.post(f"/transactions/{richer}", json={"amount": 3.0, "currency": "BTC"})).json()["id"]
+        # the materialized totals include ledger entries once they are compacted (`BALANCE_MODE=ledger`)
+        await BalanceLedgerService().compact_all(db_session)
+
+        r = await client.get(f"{self.base_url}/portfolio", params={"top": 2})
+        assert r.status_code == httpx.codes.OK
+        assert [item["user_id"] for item in r.json()] == [richer, rich]
+        assert r.json()[0]["total_usd"] == pytest.approx(300000.0)
+
+        r = await client.get(f"{self.base_url}/portfolio", params={"top": 1, "skip": 1})
+        assert [item["user_id"] for item in r.json()] == [rich]
+
+        await client.patch(f"/transactions/{tx_id}/user/{richer}/rollback")
+        await BalanceLedgerService().compact_all(db_session)
+        r = await client.get(f"{self.base_url}/portfolio", params={"top": 1})
+        assert [item["user_id"] for item in r.json()] == [rich]
+
+    async def test_get_user_balances_at(self, client: httpx.AsyncClient, db_session: AsyncSession):
+        """Test balances as of a timestamp are replayed from the nearest snapshot."""
+        before_user = utc_now()
+        user_id = (await client.post(self.base_url, json={"email": "history@test.com"})).json()["id"]
+        await client.post(f"/transactions/{user_id}", json={"amount": 100.0, "currency": "USD"})
+        after_first = utc_now()
+        tx_id = (await client.post(f"/transactions/{user_id}", json={"amount": 50.0, "currency": "USD"})).json()["id"]
+        assert await BalanceSnapshotService(test_settings.BALANCE_SNAPSHOT_INTERVAL).snapshot_balances(
+            db_session, user_id=user_id
+        ) == len(CurrencyEnum)
+        after_snapshot = utc_now()
+        await client.post(f"/transactions/{user_id}", json={"amount": 20.0, "currency": "USD"})
+        await client.patch(f"/transactions/{tx_id}/user/{user_id}/rollback")
+
+        expected = {before_user: 0.0, after_first: 100.0, after_snapshot: 150.0, utc_now(): 120.0}
+        for at, amount in expected.items():
+            r = await client.get(f"{self.base_url}/{user_id}/balances", params={"at": at.isoformat()})
+            assert r.status_code == httpx.codes.OK
+            balances = {balance["currency"]: balance["amount"] for balance in r.json()}
+            assert balances["USD"] == amount
+            assert balances["EUR"] == 0.0
+
+        r = await client.get(f"{self.base_url}/{user_id}/balances")
+        assert r.json()[0] == {"currency": "USD", "amount": 120.0}
+
+        assert (
+            await BalanceSnapshotService(test_settings.BALANCE_SNAPSHOT_INTERVAL).check_consistency(
+                db_session, user_id=user_id
+            )
+            == []
+        )
+
+    async def test_balance_snapshot_interval_setting(
+        self, client: httpx.AsyncClient, database: Database, db_session: AsyncSession, monkeypatch: pytest.MonkeyPatch
+    ):
+        if database.settings.BALANCE_MODE != "locking":
+            pytest.skip("snapshots are written by the locking balance mode")
+        monkeypatch.setattr(database, "settings", database.settings.model_copy(update={"BALANCE_SNAPSHOT_INTERVAL": 2}))
+        user_id = (await client.post(self.base_url, json={"email": "snapshot_interval@test.com"})).json()["id"]
+        snapshots_query = select(func.count()).where(UserBalanceSnapshot.user_id == user_id)
+        for written in (0, 1, 1, 2):
+            await client.post(f"/transactions/{user_id}", json={"amount": 10.0, "currency": "USD"})
+            async with db_session.begin():
+                assert await db_session.scalar(snapshots_query) == written
+
+    async def test_get_user_balances_nonexistent_user(self, client: httpx.AsyncClient):
+        """Test balances of a non-existent user returns 404 Not Found."""
+        r = await client.get(f"{self.base_url}/999999/balances")
+        assert r.status_code == httpx.codes.NOT_FOUND
+
+    async def test_balance_stream(self, client: httpx.AsyncClient, test_app: FastAPI):
+        """Test committed transactions and rollbacks are pushed to the balance stream of the user."""
+        user_id = (await client.post(self.base_url, json={"email": "stream@test.com"})).json()["id"]
+        hub: PubSubHub = test_app.state.pubsub
+        subscription = hub.subscribe(balance_topic(user_id))
+
+        tx_id = (await client.post(f"/transactions/{user_id}", json={"amount": 10.0, "currency": "USD"})).json()["id"]
+        await client.post(f"/transactions/{user_id}", json={"amount": -50.0, "currency": "USD"})
+        await client.patch(f"/transactions/{tx_id}/user/{user_id}/rollback")
+
+        events = balance_events(subscription, [{"currency": "USD", "amount": 0.0}], keepalive_seconds=0.01)
+        assert await anext(events) == b'event: balances\ndata: [{"currency":"USD","amount":0.0}]\n\n'
+        created = json.loads((await anext(events)).split(b"data: ")[1])
+        assert (created["type"], created["transaction"]["id"], created["balance"]["amount"]) == (
+            "transaction",
+            tx_id,
+            10,
+        )
+        # the rejected withdrawal was not committed, so it is not published
+        rollbacked = json.loads((await anext(events)).split(b"data: ")[1])
+        assert (rollbacked["type"], rollbacked["transaction"]["status"]) == ("rollback", "ROLLBACKED")
+        assert rollbacked["balance"] == {"currency": "USD", "amount": 0.0}
+        assert await anext(events) == b": keepalive\n\n"
+
+        await events.aclose()
+        assert hub.subscribers(balance_topic(user_id)) == 0
+
+    async def test_balance_stream_nonexistent_user(self, client: httpx.AsyncClient, test_app: FastAPI):
+        """Test the stream of a non-existent user returns 404 Not Found and leaves no subscription."""
+        r = await client.get(f"{self.base_url}/999999/balances/stream")
+        assert r.status_code == httpx.codes.NOT_FOUND
+        assert test_app.state.pubsub.subscribers(balance_topic(999999)) == 0
+
+    async def test_pubsub_drops_slow_subscribers(self):
+        """Test a subscriber with a full queue is dropped instead of blocking the publisher."""
+        hub = PubSubHub(queue_size=2)
+        slow, fast = hub.subscribe("topic"), hub.subscribe("topic")
+        assert hub.publish("topic", 1) == 2
+        assert await fast.get() == 1
+        assert hub.publish("topic", 2) == 2
+        assert hub.publish("topic", 3) == 1
+
+        assert hub.subscribers("topic") == 1
+        assert [await slow.get(), await slow.get()] == [1, 2]
+        with pytest.raises(SubscriptionOverflowError):
+            await slow.get()
+        assert [await fast.get(), await fast.get()] == [2, 3]
+
+    async def test_get_users_not_modified(self, client: httpx.AsyncClient):
+        """Test polls with a matching If-None-Match get 304 until a balance or status change."""
+        user_id = (await client.post(self.base_url, json={"email": "etag@test.com"})).json()["id"]
+        params = {"user_id": user_id}
+        r = await client.get(self.base_url, params=params)
+        etag = r.headers["etag"]
+
+        r = await client.get(self.base_url, params=params, headers={"If-None-Match": etag})
+        assert r.status_code == httpx.codes.NOT_MODIFIED
+        assert r.content == b""
+        assert r.headers["etag"] == etag
+        # only the version was read
+        assert 'desc="1 queries"' in r.headers["server-timing"]
+        # another filter is another resource
+        r = await client.get(self.base_url, params={**params, "user_status": "ACTIVE"}, headers={"If-None-Match": etag})
+        assert r.status_code == httpx.codes.OK
+
+        await client.post(f"/transactions/{user_id}", json={"amount": 10.0, "currency": "USD"})
+        r = await client.get(self.base_url, params=params, headers={"If-None-Match": etag})
+        assert r.status_code == httpx.codes.OK
+        assert r.json()[0]["balances"][0] == {"currency": "USD", "amount": 10.0}
+        etag = r.headers["etag"]
+
+        await client.patch(f"{self.base_url}/{user_id}", json={"status": "BLOCKED"})
+        r = await client.get(self.base_url, params=params, headers={"If-None-Match": etag})
+        assert r.status_code == httpx.codes.OK
+        assert r.json()[0]["status"] == "BLOCKED"
+
+        etag = (await client.get(self.base_url)).headers["etag"]
+        assert (
+            await client.get(self.base_url, headers={"If-None-Match": etag})
+        ).status_code == httpx.codes.NOT_MODIFIED
+        await client.patch(f"{self.base_url}/status", json={"status": "ACTIVE", "user_ids": [user_id]})
+        assert (await client.get(self.base_url, headers={"If-None-Match": etag})).status_code == httpx.codes.OK
+
+    async def test_get_users_single_flight(self, database: Database, create_test_tables):
+        """Test concurrent identical user queries are executed once and share the result."""
+        service = UsersService()
+        async with database.session_maker() as session:
+            with collect_queries() as single_call:
+                await service.get_users_with_relations(session, user_status=UserStatusEnum.ACTIVE)
+
+        leaders = SINGLE_FLIGHT_CALLS.value("users_with_relations", "leader")
+        shared = SINGLE_FLIGHT_CALLS.value("users_with_relations", "shared")
+        sessions = [database.session_maker() for _ in range(10)]
+        with collect_queries() as concurrent_calls:
+            results = await asyncio.gather(
+                *(service.get_users_with_relations(session, user_status=UserStatusEnum.ACTIVE) for session in sessions)
+            )
+        for session in sessions:
+            await session.close()
+
+        assert concurrent_calls.count == single_call.count
+        assert all(result is results[0] for result in results)
+        assert SINGLE_FLIGHT_CALLS.value("users_with_relations", "leader") == leaders + 1
+        assert SINGLE_FLIGHT_CALLS.value("users_with_relations", "shared") == shared + 9
+
+    async def test_single_flight_not_shared_across_versions(
+        self, client: httpx.AsyncClient, database: Database, monkeypatch: pytest.MonkeyPatch
+    ):
+        """Test a caller that read the version of a write does not join a query started before the write."""
+        user_id = (await client.post(self.base_url, json={"email": "single_flight_write@example.com"})).json()["id"]
+        service = UsersService()
+
+        leader_session = database.read_session_maker()
+        execute = leader_session.execute
+        users_loaded = asyncio.Event()
+        release = asyncio.Event()
+
+        async def paused_execute(*args, **kwargs):
+            # the users are read, the balances query waits: the leader reads a snapshot older than the write
+            if users_loaded.is_set():
+                await release.wait()
+            result = await execute(*args, **kwargs)
+            users_loaded.set()
+            return result
+
+        monkeypatch.setattr(leader_session, "execute", paused_execute)
+        async with database.read_session_maker() as session:
+            old_version = await service.get_users_version(session, user_id=user_id)
+        leader = asyncio.create_task(
+            service.get_users_with_relations(leader_session, user_id=user_id, version=old_version)
+        )
+        await users_loaded.wait()
+
+        response = await client.post(f"/transactions/{user_id}", json={"amount": 10, "currency": CurrencyEnum.USD})
+        assert response.status_code == httpx.codes.OK
+        async with database.read_session_maker() as session:
+            new_version = await service.get_users_version(session, user_id=user_id)
+            assert new_version != old_version
+            follower = asyncio.create_task(
+                service.get_users_with_relations(session, user_id=user_id, version=new_version)
+            )
+            await asyncio.sleep(0)
+            release.set()
+            [fresh_user] = await follower
+        [stale_user] = await leader
+        await leader_session.close()
+
+        amounts = {balance.currency: balance.amount for balance in fresh_user.balances}
+        assert amounts[CurrencyEnum.USD] == 10
+        assert {balance.currency: balance.amount for balance in stale_user.balances}[CurrencyEnum.USD] == 0
+
+    async def test_single_flight_failures(self):
+        """Test waiting callers get the leader exception and run the call themselves when the leader is cancelled."""
+        flight = SingleFlight("test")
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def leader_call() -> int:
+            started.set()
+            await release.wait()
+            raise ValueError("failed")
+
+        async def own_call() -> int:
+            return 2
+
+        leader = asyncio.create_task(flight.do("key", leader_call))
+        await started.wait()
+        waiting = asyncio.create_task(flight.do("key", own_call))
+        await asyncio.sleep(0)
+        release.set()
+        for task in (leader, waiting):
+            with pytest.raises(ValueError):
+                await task
+
+        started.clear()
+        release.clear()
+        leader = asyncio.create_task(flight.do("key", leader_call))
+        await started.wait()
+        waiting = asyncio.create_task(flight.do("key", own_call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await waiting == 2
+        assert leader.cancelled()